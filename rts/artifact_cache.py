@@ -0,0 +1,191 @@
+"""
+Кэш промежуточных файлов конвейера с ключом по содержимому входов.
+Ключ стадии — хэш от содержимого БД (строки таблицы баров), параметров стадии, исходного кода
+модуля стадии и ключа предыдущей стадии. Если ключ совпадает с сохранённым, стадия пропускается,
+а её результат берётся из кэша; после изменения параметра пересчитываются только стадии ниже по цепочке.
+Размер каталога кэша ограничен artifact_cache_max_mb, при переполнении удаляются давно не использованные
+записи (LRU по времени последнего обращения).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
+
+import config
+import run_profiler
+
+logger = logging.getLogger(__name__)
+
+# Строк таблицы баров в одной порции при расчёте отпечатка БД
+FINGERPRINT_ROWS = 100_000
+
+
+def hash_key(*parts, **params) -> str:
+    """Короткий sha256 от частей ключа и именованных параметров."""
+    payload = json.dumps([parts, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:20]
+
+
+def source_fingerprint(*files) -> str:
+    """Хэш исходного кода модулей (правка кода стадии делает её кэш недействительным)."""
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(Path(file).read_bytes())
+    return digest.hexdigest()[:20]
+
+
+def db_fingerprint(db_path, table_name: str) -> str:
+    """
+    Отпечаток содержимого таблицы баров: sha256 всех строк в порядке TRADEDATE (как их читают стадии),
+    поэтому правка любого бара меняет ключ. Строки читаются порциями по FINGERPRINT_ROWS.
+    Результат запоминается по размеру и mtime файла — в памяти процесса и в {db}.fingerprint.json рядом с БД,
+    поэтому неизменная БД читается целиком один раз, а не в каждом новом процессе.
+    """
+    st = Path(db_path).stat()
+    return _db_fingerprint(str(db_path), table_name, st.st_size, st.st_mtime_ns)
+
+
+def _fingerprint_path(db_path) -> Path:
+    return Path(db_path).with_name(Path(db_path).name + '.fingerprint.json')
+
+
+@lru_cache(maxsize=None)
+def _db_fingerprint(db_path: str, table_name: str, size: int, mtime_ns: int) -> str:
+    path = _fingerprint_path(db_path)
+    try:
+        stamps = json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        stamps = {}
+    stamp = stamps.get(table_name)
+    if stamp and stamp.get('size') == size and stamp.get('mtime_ns') == mtime_ns:
+        return stamp['fingerprint']
+
+    fingerprint = _scan_db_fingerprint(db_path, table_name)
+    run_profiler.count("db_fingerprint_scans")
+    stamps[table_name] = {'size': size, 'mtime_ns': mtime_ns, 'fingerprint': fingerprint}
+    try:
+        # запись через временный файл: параллельный процесс не прочитает половину JSON
+        tmp = path.with_name(path.name + f'.{os.getpid()}.tmp')
+        tmp.write_text(json.dumps(stamps, indent=0, sort_keys=True), encoding='utf-8')
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить отпечаток БД в {path}: {e}")
+    return fingerprint
+
+
+def _scan_db_fingerprint(db_path: str, table_name: str) -> str:
+    digest = hashlib.sha256()
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(f"SELECT * FROM {table_name} ORDER BY TRADEDATE")
+        digest.update(repr([d[0] for d in cursor.description]).encode('utf-8'))
+        while rows := cursor.fetchmany(FINGERPRINT_ROWS):
+            digest.update(repr(rows).encode('utf-8'))
+        rolls = []
+        if table_name == config.CONTINUOUS_VIEW:
+            # Склеенный ряд зависит от поправок календаря ролловеров: новый ролловер меняет всю историю
+            rolls = conn.execute("SELECT * FROM Rolls ORDER BY FIRST_BAR").fetchall()
+    finally:
+        conn.close()
+    return hash_key(digest.hexdigest(), rolls)
+
+
+class ArtifactCache:
+    """
+    Каталог с файлами стадий вида {kind}-{key}{suffix}.
+    Рядом с рабочим файлом стадии лежит {file}.key с ключом, размером и mtime последней выдачи из кэша,
+    чтобы не копировать файл повторно, пока его никто не перезаписал.
+    cache_dir=None отключает кэш: fetch всегда промах, store ничего не делает.
+    """
+
+    def __init__(self, cache_dir=None, max_mb: float = 2048):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    @classmethod
+    def from_settings(cls, settings: dict = None) -> 'ArtifactCache':
+        settings = config.get_settings(settings)
+        return cls(settings.get('artifact_cache_dir', 'artifact_cache'),
+                   settings.get('artifact_cache_max_mb', 2048))
+
+    def _entry(self, kind: str, key: str, target: Path) -> Path:
+        return self.cache_dir / f"{kind}-{key}{Path(target).suffix}"
+
+    @staticmethod
+    def _stamp_path(target: Path) -> Path:
+        return target.with_name(target.name + '.key')
+
+    def _is_current(self, target: Path, key: str) -> bool:
+        """Рабочий файл уже выдан из кэша по этому ключу и не менялся после."""
+        stamp_path = self._stamp_path(target)
+        if not (target.exists() and stamp_path.exists()):
+            return False
+        st = target.stat()
+        try:
+            stamp = json.loads(stamp_path.read_text(encoding='utf-8'))
+        except ValueError:
+            return False
+        return stamp == {'key': key, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    def _write_stamp(self, target: Path, key: str) -> None:
+        st = target.stat()
+        self._stamp_path(target).write_text(
+            json.dumps({'key': key, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}), encoding='utf-8')
+
+    def fetch(self, key: str, targets: dict) -> bool:
+        """
+        Восстанавливает файлы стадии {kind: путь} по ключу.
+        True — все файлы есть в кэше и разложены по рабочим путям (стадию можно пропустить).
+        """
+        if self.cache_dir is None:
+            return False
+        entries = {kind: self._entry(kind, key, target) for kind, target in targets.items()}
+        if not all(entry.exists() for entry in entries.values()):
+            run_profiler.count("cache_misses")
+            return False
+
+        for kind, target in targets.items():
+            target = Path(target)
+            entry = entries[kind]
+            os.utime(entry)  # отметка обращения для LRU
+            if not self._is_current(target, key):
+                shutil.copyfile(entry, target)
+                self._write_stamp(target, key)
+        run_profiler.count("cache_hits")
+        logger.info(f"Кэш: {', '.join(targets)} актуальны (ключ {key})")
+        return True
+
+    def store(self, key: str, targets: dict) -> None:
+        """Кладёт файлы стадии в кэш под ключом и вытесняет старые записи сверх лимита."""
+        if self.cache_dir is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for kind, target in targets.items():
+            target = Path(target)
+            entry = self._entry(kind, key, target)
+            tmp = entry.with_name(entry.name + '.tmp')
+            shutil.copyfile(target, tmp)
+            os.replace(tmp, entry)
+            self._write_stamp(target, key)
+        self.evict()
+
+    def evict(self) -> None:
+        """Удаляет давно не использованные записи, пока размер кэша больше лимита."""
+        entries = sorted(
+            (p for p in self.cache_dir.iterdir() if p.is_file() and not p.name.endswith('.tmp')),
+            key=lambda p: p.stat().st_mtime,
+        )
+        total = sum(p.stat().st_size for p in entries)
+        # самую свежую запись не удаляем, даже если она одна больше лимита
+        for path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink()
+            run_profiler.count("cache_evictions")
+            logger.info(f"Кэш: удалена запись {path.name}")
@@ -0,0 +1,192 @@
+"""
+Воспроизводимый бенчмарк стадий конвейера на синтетических минутных барах.
+Генерирует RTS-подобные бары (synthetic_bars.py) во временную SQLite БД с таблицей Futures
+и замеряет стадии: загрузку из БД, расчёт признаков, построение дневных векторов
+и DTW-схожесть на нескольких размерах истории (в днях).
+Результаты можно сохранить как базовую линию и сравнивать с ней последующие замеры.
+
+Примеры:
+    python benchmark.py --years 1 --dtw-days 35 50
+    python benchmark.py --save-baseline main
+    python benchmark.py --compare main
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from run_profiler import RunProfiler, set_profiler
+from synthetic_bars import generate_minute_bars, write_minute_db
+
+# Каталог базовых линий бенчмарка
+BASELINE_DIR = Path(__file__).parent / "bench_baselines"
+# Порог регрессии при сравнении с базовой линией (доля)
+REGRESSION_THRESHOLD = 0.10
+
+
+def run_benchmark(
+        years: float = 1.0,
+        bars_per_day: int = 840,
+        gap_rate: float = 0.01,
+        zero_range_rate: float = 0.02,
+        dtw_days=(35, 50),
+        repeat: int = 1,
+        seed: int = 42) -> dict:
+    """
+    Прогоняет стадии на синтетической БД repeat раз и возвращает словарь
+    {стадия: {wall_s, cpu_s, counters}} с минимальным временем по повторам.
+    """
+    from minutes_bars_to_vectors_pkl import load_ohlcv_from_sqlite, compute_features
+    from minutes_vectors_to_days_vectors import (
+        build_daily_vectors, load_ohlc_from_sqlite, compute_daily_body, merge_daily_body)
+    from data_processing_similarity import MAX_WINDOW, compute_similarity
+
+    params = {
+        'years': years,
+        'bars_per_day': bars_per_day,
+        'gap_rate': gap_rate,
+        'zero_range_rate': zero_range_rate,
+        'dtw_days': list(dtw_days),
+        'repeat': repeat,
+        'seed': seed,
+    }
+    stages = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = write_minute_db(
+            generate_minute_bars(years, bars_per_day, gap_rate, zero_range_rate, seed=seed),
+            Path(tmp) / "bench_futures_minute.db",
+        )
+
+        for attempt in range(repeat):
+            profiler = set_profiler(RunProfiler("benchmark"))
+
+            df_raw = load_ohlcv_from_sqlite(db_path, "Futures")
+            df_vectors = compute_features(df_raw)
+            df_daily_vectors = build_daily_vectors(df_vectors)
+            df_body = compute_daily_body(load_ohlc_from_sqlite(db_path, "Futures"))
+            df_daily = merge_daily_body(df_daily_vectors, df_body).dropna()
+
+            records = [(record.name, record) for record in profiler.stages]
+            if attempt == 0:
+                # Прогрев вне замера: компиляция (или загрузка из кэша) ядра numba и импорт tslearn
+                set_profiler(None)
+                compute_similarity(df_daily.tail(MAX_WINDOW + 2).reset_index(drop=True))
+                set_profiler(profiler)
+            for days in dtw_days:
+                compute_similarity(df_daily.tail(days).reset_index(drop=True))
+                records.append((f"dtw_sweep_{days}d", profiler.stages[-1]))
+
+            for name, record in records:
+                best = stages.get(name)
+                if best is None or record.wall_s < best['wall_s']:
+                    stages[name] = {
+                        'wall_s': round(record.wall_s, 6),
+                        'cpu_s': round(record.cpu_s, 6),
+                        'counters': record.counters,
+                    }
+
+    set_profiler(None)
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'params': params,
+        'environment': {
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'stages': stages,
+    }
+
+
+def save_baseline(result: dict, name: str) -> Path:
+    """Сохраняет результат бенчмарка как базовую линию name."""
+    BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+    path = BASELINE_DIR / f"{name}.json"
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+    return path
+
+
+def load_baseline(name: str) -> dict:
+    path = BASELINE_DIR / f"{name}.json"
+    if not path.exists():
+        raise FileNotFoundError(f"Baseline not found: {path}")
+    return json.loads(path.read_text(encoding='utf-8'))
+
+
+def compare_with_baseline(result: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> pd.DataFrame:
+    """
+    Таблица сравнения wall time по стадиям: baseline, current, ratio и флаг регрессии.
+    """
+    if result['params'] != baseline['params']:
+        print(f"Внимание: параметры отличаются от базовой линии: {baseline['params']}")
+
+    rows = []
+    for name, stage in result['stages'].items():
+        base = baseline['stages'].get(name)
+        base_wall = base['wall_s'] if base else np.nan
+        ratio = stage['wall_s'] / base_wall if base and base_wall > 0 else np.nan
+        rows.append({
+            'STAGE': name,
+            'BASELINE_S': base_wall,
+            'CURRENT_S': stage['wall_s'],
+            'RATIO': ratio,
+            'REGRESSION': bool(ratio > 1 + threshold) if ratio == ratio else False,
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк стадий конвейера на синтетических минутных барах")
+    parser.add_argument('--years', type=float, default=1.0, help="Длина синтетической истории в годах")
+    parser.add_argument('--bars-per-day', type=int, default=840, help="Минутных баров в сессии")
+    parser.add_argument('--gap-rate', type=float, default=0.01, help="Доля пропущенных баров")
+    parser.add_argument('--zero-range-rate', type=float, default=0.02, help="Доля баров с нулевым диапазоном")
+    parser.add_argument('--dtw-days', type=int, nargs='+', default=[35, 50],
+                        help="Размеры истории (в днях) для замера DTW-схожести")
+    parser.add_argument('--repeat', type=int, default=1, help="Число повторов, берётся минимум")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save-baseline', metavar='NAME', help="Сохранить результат как базовую линию")
+    parser.add_argument('--compare', metavar='NAME', help="Сравнить с базовой линией")
+    args = parser.parse_args()
+
+    result = run_benchmark(
+        years=args.years,
+        bars_per_day=args.bars_per_day,
+        gap_rate=args.gap_rate,
+        zero_range_rate=args.zero_range_rate,
+        dtw_days=args.dtw_days,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+
+    df_stages = pd.DataFrame(
+        [{'STAGE': name, **{k: v for k, v in stage.items() if k != 'counters'}, **stage['counters']}
+         for name, stage in result['stages'].items()]
+    )
+    with pd.option_context("display.width", 1000, "display.max_columns", 30):
+        print(df_stages)
+
+    if args.save_baseline:
+        path = save_baseline(result, args.save_baseline)
+        print(f"Базовая линия сохранена: {path}")
+
+    if args.compare:
+        df_cmp = compare_with_baseline(result, load_baseline(args.compare))
+        with pd.option_context("display.width", 1000, "display.max_columns", 30):
+            print(df_cmp)
+        if df_cmp['REGRESSION'].any():
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Единая точка входа конвейера.
+Модули стадий импортируются только при запуске соответствующей команды,
+поэтому старт (и --help) не платит за импорт pandas, tslearn и matplotlib.
+run_stage() можно вызывать повторно из долгоживущего процесса: настройки читаются один раз.
+
+Примеры:
+    python cli.py download
+    python cli.py minute-vectors daily-vectors similarity
+    python cli.py all --settings other_settings.yaml
+"""
+
+import argparse
+import importlib
+
+import config
+from run_profiler import RunProfiler, get_profiler, set_profiler
+
+# Команда -> (модуль стадии, описание)
+STAGES = {
+    'download': ('rts_download_minutes_to_db', "Загрузка минутных баров из MOEX ISS в SQLite"),
+    'minute-vectors': ('minutes_bars_to_vectors_pkl', "Минутные бары -> минутные векторы признаков"),
+    'daily-vectors': ('minutes_vectors_to_days_vectors', "Минутные векторы -> дневные векторы с BODY"),
+    'tensor': ('days_vectors_to_tensor', "Минутные бары -> тензор (дни, T, 7) для обучения моделей потоком по дням"),
+    'similarity': ('data_processing_similarity', "DTW-схожесть дневных векторов по окнам 3..30"),
+    'out-of-core': ('out_of_core', "Бары -> дневное хранилище и схожесть одним проходом с постоянной памятью"),
+    'plot': ('sum_graph', "График кумулятивных сумм MAX_ колонок"),
+    'plot-top5': ('sum_graph_01', "График топ-5 кумулятивных сумм"),
+    'pl': ('data_processing_pl', "Симуляция P/L с выбором окна по 22 предыдущим дням"),
+    'walk-forward': ('walk_forward', "Walk-forward: выбор окна на обучении, P/L на фолдах по test_days дней"),
+    'show-pkl': ('test_pkl_file', "Печать содержимого pkl файлов векторов"),
+    'daemon': ('daemon', "Демон: инкрементальное обновление векторов и сигналов после сессии"),
+    'stream': ('streaming_dtw', "Внутридневное сопоставление текущего дня с историей (prefix DTW)"),
+}
+
+# Порядок стадий полного прогона (команда all)
+PIPELINE = ['download', 'minute-vectors', 'daily-vectors', 'similarity', 'plot', 'plot-top5', 'pl']
+
+
+def run_stage(name: str, settings: dict = None) -> None:
+    """Запускает стадию конвейера по имени команды."""
+    module_name, _ = STAGES[name]
+    module = importlib.import_module(module_name)
+    if name == 'download':
+        module.setup_logging(settings=settings)
+    module.main(settings=settings)
+
+
+def run_pipeline(names, settings: dict = None) -> None:
+    """Последовательно запускает стадии; 'all' раскрывается в PIPELINE."""
+    for name in names:
+        for stage_name in (PIPELINE if name == 'all' else [name]):
+            run_stage(stage_name, settings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Конвейер: минутные бары -> векторы -> DTW-схожесть -> графики",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(f"  {name:<15} {descr}" for name, (_, descr) in STAGES.items())
+               + f"\n  {'all':<15} Полный прогон: {', '.join(PIPELINE)}",
+    )
+    parser.add_argument('commands', nargs='+', choices=[*STAGES, 'all'], metavar='command',
+                        help="Команды конвейера (см. список ниже)")
+    parser.add_argument('--settings', default=str(config.SETTINGS_FILE), help="Путь к settings.yaml")
+    args = parser.parse_args(argv)
+
+    settings = config.load_settings(args.settings)
+    profiler = get_profiler() or set_profiler(RunProfiler.from_settings(settings, '_'.join(args.commands)))
+    try:
+        run_pipeline(args.commands, settings)
+    finally:
+        profiler.write_report()
+
+
+if __name__ == "__main__":
+    main()
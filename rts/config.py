@@ -0,0 +1,64 @@
+"""
+Настройки конвейера из settings.yaml.
+Файл читается лениво при первом обращении и кэшируется в процессе,
+поэтому импорт модулей конвейера не выполняет IO и может повторяться в долгоживущем процессе.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+
+import yaml
+
+# Путь к settings.yaml в той же директории, что и модуль
+SETTINGS_FILE = Path(__file__).parent / "settings.yaml"
+
+# Таблица минутных баров и представление склеенного ряда с поправкой на ролловер контрактов
+BARS_TABLE = 'Futures'
+CONTINUOUS_VIEW = 'FuturesContinuous'
+
+# Шаблоны имён промежуточных файлов конвейера (в текущей директории)
+ARTIFACTS = {
+    'minute_vectors': '{ticker}_futures_minute_2015_vectors.pkl',
+    'daily_vectors': '{ticker}_futures_daily_vectors.pkl',
+    'similarity': '{ticker}_dtw_similarity_weights.pkl',
+    'similarity_checkpoint': '{ticker}_dtw_similarity_checkpoint.jsonl',
+    'signals': '{ticker}_next_day_signals.pkl',
+    'volume_state': '{ticker}_volume_state.json',
+    'trading_calendar': '{ticker}_trading_calendar.json',
+    'daily_tensor': '{ticker}_daily_tensor.npy',
+    'daily_tensor_mask': '{ticker}_daily_tensor_mask.npy',
+    'daily_tensor_index': '{ticker}_daily_tensor_index.json',
+    'day_store': '{ticker}_daily_store.bin',
+    'day_store_index': '{ticker}_daily_store_index.json',
+    'day_quality': '{ticker}_day_quality.pkl',
+    'walk_forward': '{ticker}_walk_forward.pkl',
+}
+
+
+@lru_cache(maxsize=None)
+def load_settings(path=SETTINGS_FILE) -> dict:
+    """Читает settings.yaml (один раз на процесс)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+def get_settings(settings: dict = None) -> dict:
+    """Переданные настройки или настройки из settings.yaml."""
+    return load_settings() if settings is None else settings
+
+
+def db_path(settings: dict = None) -> Path:
+    """Путь к базе данных с минутными барами фьючерсов."""
+    settings = get_settings(settings)
+    return Path(settings['path_db_minute'].replace('{ticker}', settings['ticker']))
+
+
+def bars_table(settings: dict = None) -> str:
+    """Источник баров для признаков и BODY: склеенный ряд (continuous_prices: true) или исходная таблица."""
+    return CONTINUOUS_VIEW if get_settings(settings).get('continuous_prices', False) else BARS_TABLE
+
+
+def artifact_path(kind: str, settings: dict = None) -> Path:
+    """Путь к промежуточному файлу конвейера по его виду из ARTIFACTS."""
+    settings = get_settings(settings)
+    return Path(ARTIFACTS[kind].format(ticker=settings['ticker']))
@@ -0,0 +1,281 @@
+"""
+Режим демона: обновление векторов и сигналов сразу после закрытия сессии.
+Минутные данные текущей сессии на MOEX ISS доступны после 19:05. Демон после daemon_ready_time
+опрашивает ISS (rts_download_minutes_to_db.main) каждые daemon_poll_seconds, пока сессия дня не докачана
+(последний бар не раньше 23:49), затем ждёт daemon_ready_time следующего дня. Если в БД появились новые бары,
+инкрементально пересчитывает минутные векторы, затронутые дневные векторы, таблицу качества дней,
+строки DTW-схожести и сигналы на следующий день. При quality_exclude дни с EXCLUDE убираются из схожести
+так же, как на стадии similarity. Минутные, дневные векторы и схожесть держатся в памяти между итерациями,
+поэтому полный пересчёт истории выполняется только при первом запуске без pkl файлов.
+Загрузку ведёт итерация обновления (update): при запуске сначала поднимается состояние из pkl, затем первая
+итерация докачивает пропущенное. Если загрузка закрыла пропуск внутри истории (бар раньше последнего
+обработанного), минутные векторы, окно объёма и всё дальнейшее пересчитываются с дня этого бара.
+Минутные векторы (большой файл) сохраняются, когда сессия дня докачана, и при остановке; после сбоя
+посреди сессии бары дня пересчитываются из БД при следующем запуске.
+
+Примеры:
+    python daemon.py          # бесконечный цикл
+    python daemon.py --once   # одна итерация обновления
+"""
+
+import argparse
+import logging
+import time as time_module
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import config
+import rts_download_minutes_to_db
+from data_processing_similarity import (
+    compute_signals, compute_similarity, prepare_daily_vectors, MAX_WINDOW)
+from data_quality import (
+    QUALITY_COLUMNS, compute_day_quality, drop_excluded_days, excluded_days, load_day_quality, quality_params)
+from minutes_bars_to_vectors_pkl import (
+    VOLUME_WINDOW, compute_features, compute_features_incremental,
+    load_ohlcv_from_sqlite, load_ohlcv_tail_from_sqlite, load_volume_stats_from_sqlite)
+from minutes_vectors_to_days_vectors import (
+    build_daily_vectors, compute_daily_body, load_minute_vectors, load_ohlc_from_sqlite, merge_daily_body)
+from rolling_stats import RollingVolumeStats
+from rts_download_minutes_to_db import SESSION_COMPLETE_TIME
+from run_profiler import RunProfiler, set_profiler
+from similarity_metrics import metric_settings
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineDaemon:
+    """
+    Тёплое состояние конвейера и его инкрементальное обновление.
+    df_minute — TRADEDATE, VECTORS; df_daily — TRADEDATE, VECTORS, BODY, NEXT_BODY
+    (включая последний день без NEXT_BODY); df_rez — TRADEDATE, MAX_n;
+    df_quality — таблица качества дней (data_quality.py); volume_stats — окно объёма на последнем баре df_minute.
+    """
+
+    def __init__(self, settings: dict = None):
+        self.settings = config.get_settings(settings)
+        self.db_path = config.db_path(self.settings)
+        self.table = config.bars_table(self.settings)
+        self.pl_days = self.settings.get('test_days', 22)
+        self.vector_storage = self.settings.get('vector_storage', 'float32')
+        self.metric, self.metric_params = metric_settings(self.settings)
+        self.quality_exclude = self.settings.get('quality_exclude', False)
+        self.quality_params = quality_params(self.settings)
+        self.df_minute = None
+        self.df_quality = None
+        self.volume_stats = None
+        self.df_daily = None
+        self.df_rez = None
+        self.signals = None
+
+    def warm_up(self) -> None:
+        """Загружает pkl файлы предыдущих запусков или строит состояние с нуля (без обращения к ISS)."""
+        pkl_minute = config.artifact_path("minute_vectors", self.settings)
+        pkl_daily = config.artifact_path("daily_vectors", self.settings)
+        pkl_similarity = config.artifact_path("similarity", self.settings)
+
+        pkl_volume_state = config.artifact_path("volume_state", self.settings)
+
+        if pkl_minute.exists():
+            self.df_minute = load_minute_vectors(pkl_minute)
+            last_bar = str(self.df_minute["TRADEDATE"].max())
+            if pkl_volume_state.exists():
+                self.volume_stats = RollingVolumeStats.load(pkl_volume_state)
+            if self.volume_stats is None or self.volume_stats.last_tradedate != last_bar:
+                logger.info("Снимок окна объёма не совпадает с минутными векторами, восстановление из БД")
+                self.volume_stats = load_volume_stats_from_sqlite(self.db_path, self.table, until=last_bar)
+        else:
+            logger.info("Минутные векторы не найдены, полный расчёт из БД")
+            self.volume_stats = RollingVolumeStats(VOLUME_WINDOW)
+            self.df_minute = compute_features(load_ohlcv_from_sqlite(self.db_path, self.table), self.volume_stats)
+
+        self.df_quality = load_day_quality(self.settings)
+        if self.df_quality is None or list(self.df_quality.columns) != QUALITY_COLUMNS:
+            logger.info("Таблица качества дней не найдена или устарела, расчёт из БД")
+            self.df_quality = compute_day_quality(load_ohlcv_from_sqlite(self.db_path, self.table),
+                                                  self.quality_params)
+
+        if pkl_daily.exists() and pkl_similarity.exists():
+            self.df_daily = pd.read_pickle(pkl_daily)
+            self.df_rez = pd.read_pickle(pkl_similarity)
+        if self.df_daily is None or (not self.quality_exclude and self.df_daily["VECTORS"].isna().any()):
+            # нет файлов или дневные векторы построены без матриц исключённых дней, а исключение выключено
+            logger.info("Дневные векторы или схожесть не найдены, полный расчёт")
+            self.df_daily = merge_daily_body(
+                build_daily_vectors(self.df_minute, self.vector_storage, self._skip_days()),
+                compute_daily_body(load_ohlc_from_sqlite(self.db_path, self.table)),
+            )
+            self.df_rez = compute_similarity(
+                self._similarity_days(self.df_daily), metric=self.metric, metric_params=self.metric_params)
+
+        # Дни, которые есть в минутных векторах, но ещё не попали в дневные (прерванный запуск)
+        last_day = pd.to_datetime(self.df_daily["TRADEDATE"]).max()
+        lagging = self.df_minute[self.df_minute["TRADEDATE"] >= last_day]
+        if not lagging.empty:
+            self._update_days(lagging)
+
+    def update(self) -> bool:
+        """
+        Одна итерация: докачка ISS и инкрементальный пересчёт.
+        Возвращает True, если появились новые бары.
+        """
+        first_inserted = rts_download_minutes_to_db.main(settings=self.settings, vacuum=False)
+
+        after = self.df_minute["TRADEDATE"].max()
+        if first_inserted is not None and pd.Timestamp(first_inserted) <= after:
+            # Докачан пропуск внутри истории: инкрементальный расчёт после after его не увидит
+            logger.info(f"Докачаны бары внутри истории с {first_inserted}, пересчёт с этого дня")
+            self._update_days(self._refresh_minutes_since(pd.Timestamp(first_inserted).normalize()))
+            return True
+        df_new = compute_features_incremental(self.db_path, self.table, after, self.volume_stats)
+        if df_new.empty:
+            logger.info(f"Новых баров после {after} нет")
+            return False
+
+        logger.info(f"Новых минутных баров: {len(df_new)} ({df_new['TRADEDATE'].min()} - {df_new['TRADEDATE'].max()})")
+        self.df_minute = pd.concat([self.df_minute, df_new], ignore_index=True)
+        self._update_days(df_new)
+        return True
+
+    def _refresh_minutes_since(self, day: pd.Timestamp) -> pd.DataFrame:
+        """
+        Пересчитывает минутные векторы с дня day: окно объёма восстанавливается по БД на последнем баре
+        перед day, бары с day считаются заново. Возвращает пересчитанные минутные векторы.
+        """
+        df_head = self.df_minute[self.df_minute["TRADEDATE"] < day]
+        if df_head.empty:
+            self.volume_stats = RollingVolumeStats(VOLUME_WINDOW)
+        else:
+            self.volume_stats = load_volume_stats_from_sqlite(
+                self.db_path, self.table, until=df_head["TRADEDATE"].max())
+        df_new = compute_features(load_ohlcv_from_sqlite(self.db_path, self.table, since=day), self.volume_stats)
+        self.df_minute = pd.concat([df_head, df_new], ignore_index=True)
+        return df_new
+
+    def _skip_days(self):
+        """Дни без матриц в дневных векторах: исключённые по качеству при quality_exclude."""
+        return excluded_days(self.df_quality) if self.quality_exclude else None
+
+    def _similarity_days(self, df_daily: pd.DataFrame, dropna: bool = True) -> pd.DataFrame:
+        """Дни для схожести: как на стадии similarity, без дней с EXCLUDE при quality_exclude."""
+        df = prepare_daily_vectors(df_daily, dropna=dropna)
+        if self.quality_exclude:
+            df = drop_excluded_days(df, self.df_quality)
+        return df
+
+    def _update_days(self, df_new: pd.DataFrame) -> None:
+        """Пересчитывает дневные векторы, качество дней, схожесть и сигналы начиная с первого затронутого дня."""
+        first_day = df_new["TRADEDATE"].min().normalize()
+
+        # Таблица качества затронутых дней; последний бар перед ними — для правил на границе дня
+        df_bars = load_ohlcv_tail_from_sqlite(self.db_path, self.table, first_day - pd.Timedelta(seconds=1), context=1)
+        before = df_bars["TRADEDATE"] < first_day
+        df_quality_tail = compute_day_quality(df_bars[~before], self.quality_params, previous=df_bars[before])
+        df_quality_head = self.df_quality[self.df_quality["TRADEDATE"] < first_day.date()]
+        self.df_quality = pd.concat([df_quality_head, df_quality_tail], ignore_index=True)
+
+        # Дневные векторы и BODY только для затронутых дней
+        df_minute_tail = self.df_minute[self.df_minute["TRADEDATE"] >= first_day]
+        df_daily_tail = merge_daily_body(
+            build_daily_vectors(df_minute_tail, self.vector_storage, self._skip_days()),
+            compute_daily_body(load_ohlc_from_sqlite(self.db_path, self.table, since=first_day)),
+        )
+        df_daily_head = self.df_daily[pd.to_datetime(self.df_daily["TRADEDATE"]) < first_day]
+        df_daily = pd.concat([df_daily_head, df_daily_tail], ignore_index=True)
+        # NEXT_BODY последнего старого дня меняется вместе с первым новым днём
+        df_daily["NEXT_BODY"] = df_daily["BODY"].shift(-1)
+        self.df_daily = df_daily
+
+        # Строки схожести: с дня перед первым затронутым (у него изменился NEXT_BODY)
+        df_eval = self._similarity_days(self.df_daily)
+        start = max(0, int((df_eval["TRADEDATE"] < first_day).sum()) - 1)
+        df_rez_tail = compute_similarity(df_eval, start=start, metric=self.metric, metric_params=self.metric_params)
+        if start < len(df_eval):
+            rez_dates = pd.to_datetime(self.df_rez["TRADEDATE"])
+            df_rez_head = self.df_rez[rez_dates < df_eval.at[df_eval.index[start], "TRADEDATE"]]
+            self.df_rez = pd.concat([df_rez_head, df_rez_tail], ignore_index=True)
+
+        # Сигналы на следующий день по последнему дню
+        df_full = self._similarity_days(self.df_daily, dropna=False)
+        last_day = pd.to_datetime(self.df_daily["TRADEDATE"]).max()
+        if df_full.empty or df_full["TRADEDATE"].iloc[-1] != last_day:
+            logger.warning(f"День {last_day.date()} исключён по качеству данных, сигналы не обновляются")
+        elif len(df_full) > MAX_WINDOW:
+            self.signals = compute_signals(df_full, self.df_rez, pl_days=self.pl_days,
+                                           metric=self.metric, metric_params=self.metric_params)
+            logger.info(f"Сигналы на следующий день:\n{self.signals.to_string()}")
+
+    def save(self, minute: bool = False) -> None:
+        """Сохраняет состояние в pkl; минутные векторы и окно объёма — только по запросу (файл большой)."""
+        self.df_daily.to_pickle(config.artifact_path("daily_vectors", self.settings))
+        self.df_rez.to_pickle(config.artifact_path("similarity", self.settings))
+        self.df_quality.to_pickle(config.artifact_path("day_quality", self.settings))
+        if self.signals is not None:
+            self.signals.to_pickle(config.artifact_path("signals", self.settings))
+        if minute:
+            self.df_minute.to_pickle(config.artifact_path("minute_vectors", self.settings))
+            self.volume_stats.save(config.artifact_path("volume_state", self.settings))
+
+    def session_complete(self, day) -> bool:
+        """Сессия дня day докачана: последний минутный бар не раньше SESSION_COMPLETE_TIME."""
+        return self.df_minute["TRADEDATE"].max() >= pd.Timestamp(datetime.combine(day, SESSION_COMPLETE_TIME))
+
+    def next_poll(self, now: datetime) -> datetime:
+        """
+        Время следующего опроса ISS: daemon_ready_time дня, затем каждые daemon_poll_seconds до полуночи
+        (последний опрос в полночь забирает поздние бары вечерней сессии); если сессия дня уже докачана —
+        daemon_ready_time следующего дня.
+        """
+        ready_time = datetime.strptime(self.settings.get('daemon_ready_time', '19:05'), "%H:%M").time()
+        ready = datetime.combine(now.date(), ready_time)
+        if now < ready:
+            return ready
+        if self.session_complete(now.date()):
+            return ready + timedelta(days=1)
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        return min(now + timedelta(seconds=self.settings.get('daemon_poll_seconds', 300)), midnight)
+
+    def run_once(self) -> bool:
+        """Итерация с замером стадий и сохранением результата."""
+        profiler = set_profiler(RunProfiler.from_settings(self.settings, "daemon"))
+        try:
+            updated = self.update()
+            if updated:
+                # минутные векторы — как только сессия дня докачана, чтобы сбой до остановки не терял день
+                self.save(minute=self.session_complete(datetime.now().date()))
+            return updated
+        finally:
+            profiler.write_report()
+
+    def run_forever(self) -> None:
+        """Опрос ISS по расписанию next_poll; первая итерация догоняет пропущенные дни."""
+        self.run_once()
+        try:
+            while True:
+                next_poll = self.next_poll(datetime.now())
+                logger.info(f"Следующий опрос ISS в {next_poll}")
+                time_module.sleep(max(1.0, (next_poll - datetime.now()).total_seconds()))
+                self.run_once()
+        finally:
+            logger.info("Остановка демона, сохраняем минутные векторы")
+            self.save(minute=True)
+
+
+def main(settings: dict = None, once: bool = False):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    rts_download_minutes_to_db.setup_logging(settings=settings)
+
+    daemon = PipelineDaemon(settings)
+    daemon.warm_up()
+    if once:
+        daemon.run_once()
+        daemon.save(minute=True)
+    else:
+        daemon.run_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Демон обновления векторов и сигналов после закрытия сессии")
+    parser.add_argument('--once', action='store_true', help="Одна итерация обновления и выход")
+    args = parser.parse_args()
+    main(once=args.once)
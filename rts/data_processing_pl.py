@@ -1,90 +1,103 @@
+import numpy as np
 import pandas as pd
 from pathlib import Path
-import yaml
-import matplotlib.pyplot as plt
 import re
 
-
-# Путь к settings.yaml
-SETTINGS_FILE = Path(__file__).parent / "settings.yaml"
-
-# Чтение настроек
-with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-    settings = yaml.safe_load(f)
-
-ticker = settings['ticker']
-PKL_SIMILARITY = fr"{ticker}_dtw_similarity_weights.pkl"
-
-# === Загрузка дневного датафрейма ===
-df = pd.read_pickle(PKL_SIMILARITY)
-df['TRADEDATE'] = pd.to_datetime(df['TRADEDATE'])
-df = df.sort_values('TRADEDATE').reset_index(drop=True)
-df.dropna(inplace=True)  # Удаление строк с NaN
-
-# создаём PL_колонки и считаем rolling-сумму по 22 предыдущим строкам
-for n in range(3, 31):
-    max_col = f"MAX_{n}"
-    pl_col = f"PL_{n}"
-
-    if max_col not in df.columns:
-        continue
-
-    # 1) сначала PL_n = MAX_n (как копия значения текущей строки)
-    df[pl_col] = df[max_col]
-
-    # 2) затем в PL_n записываем сумму 22 предыдущих значений MAX_n, без текущей
-    # shift(1) сдвигает столбец вниз, чтобы исключить текущую строку,
-    # rolling(22).sum() берёт сумму по окну из 22 строк над текущей
-    df[pl_col] = df[max_col].shift(1).rolling(window=22, min_periods=1).sum()
-
-with pd.option_context(  # Печать широкого и длинного датафрейма
-        "display.width", 1000,
-        "display.max_columns", 70,
-        "display.max_colwidth", 100,
-        "display.min_rows", 50,
-):
-    print("Датафрейм с результатом:")
-    print(df)
-
-# Список колонок PL_ и MAX_
-pl_cols  = [c for c in df.columns if c.startswith("PL_")]
-max_cols = [c for c in df.columns if c.startswith("MAX_")]
-
-# Функция обработки одной строки
-def process_row(row):
-    # максимум по PL_3..PL_30
-    max_pl_val = row[pl_cols].max()
-    if max_pl_val <= 0.0 or pd.isna(max_pl_val):
-        return pd.Series({"TRADEDATE": row["TRADEDATE"], "P/L": 0.0})
-
-    # имя колонки, где этот максимум
-    col_pl = row[pl_cols].idxmax()          # например, 'PL_7'
-    n = int(re.findall(r"\d+", col_pl)[0])  # 7
-
-    max_col_name = f"MAX_{n}"
-    pl_value = row[max_col_name]
-
-    return pd.Series({"TRADEDATE": row["TRADEDATE"], "P/L": pl_value})
-
-# Формирование df_rez
-df_rez = df.apply(process_row, axis=1)
-
-print(df_rez)
-
-# Кумулятивная сумма P/L
-df_rez["Cum_P/L"] = df_rez["P/L"].cumsum()
-
-# График кумулятивной суммы
-plt.figure(figsize=(10, 5))
-plt.plot(df_rez["TRADEDATE"], df_rez["Cum_P/L"])
-plt.xlabel("TRADEDATE")
-plt.ylabel("Cumulative P/L")
-plt.title("Кумулятивная сумма P/L")
-plt.grid(True)
-plt.tight_layout()
-# plt.show()
-
-# Сохранение графика
-output_plot = Path(__file__).parent / f"{ticker}_cumsum_plot_max.png"
-plt.savefig(output_plot)
-plt.close()
\ No newline at end of file
+import config
+import run_profiler
+from plot_report import MAX_POINTS, decimate, render_curves
+from run_profiler import RunProfiler, set_profiler
+from sum_graph import load_similarity_weights
+
+
+def add_pl_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Создаёт PL_ колонки: rolling-сумма MAX_n по 22 предыдущим строкам.
+    """
+    # создаём PL_колонки и считаем rolling-сумму по 22 предыдущим строкам
+    for n in range(3, 31):
+        max_col = f"MAX_{n}"
+        pl_col = f"PL_{n}"
+
+        if max_col not in df.columns:
+            continue
+
+        # 1) сначала PL_n = MAX_n (как копия значения текущей строки)
+        df[pl_col] = df[max_col]
+
+        # 2) затем в PL_n записываем сумму 22 предыдущих значений MAX_n, без текущей
+        # shift(1) сдвигает столбец вниз, чтобы исключить текущую строку,
+        # rolling(22).sum() берёт сумму по окну из 22 строк над текущей
+        df[pl_col] = df[max_col].shift(1).rolling(window=22, min_periods=1).sum()
+    return df
+
+
+def compute_pl(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Для каждой даты берёт MAX_n окна с максимальной PL_n и возвращает TRADEDATE, P/L.
+    """
+    # Пары PL_n / MAX_n в порядке колонок PL_
+    pl_cols = [c for c in df.columns if c.startswith("PL_")]
+    max_cols = ["MAX_" + re.findall(r"\d+", c)[0] for c in pl_cols]  # 'PL_7' -> 'MAX_7'
+
+    # Одна операция по матрице (дни, окна) вместо построчного apply
+    pl = df[pl_cols].to_numpy(dtype=float)
+    has_pl = ~np.isnan(pl).all(axis=1)
+    best = np.nanargmax(np.where(has_pl[:, None], pl, 0.0), axis=1)  # первое окно с максимумом, как idxmax
+    rows = np.arange(len(df))
+    max_pl_val = pl[rows, best]
+    pl_value = df[max_cols].to_numpy(dtype=float)[rows, best]
+
+    # максимум PL <= 0 или все PL пустые -> P/L 0
+    return pd.DataFrame({
+        "TRADEDATE": df["TRADEDATE"].to_numpy(),
+        "P/L": np.where(has_pl & (max_pl_val > 0.0), pl_value, 0.0),
+    }, index=df.index)
+
+
+def plot_cum_pl(df_rez: pd.DataFrame, output_plot: Path,
+                max_points: int = MAX_POINTS, method: str = 'minmax') -> Path:
+    """График кумулятивной суммы P/L."""
+    with run_profiler.stage("plotting"):
+        dates = df_rez["TRADEDATE"].to_numpy()
+        curves = df_rez[["Cum_P/L"]].to_numpy(dtype=float)
+        render_curves(decimate(dates, curves, max_points, method), [None], "Кумулятивная сумма P/L",
+                      output_plot, figsize=(10, 5), xlabel="TRADEDATE", ylabel="Cumulative P/L")
+    return output_plot
+
+
+def main(settings: dict = None):
+    settings = config.get_settings(settings)
+    ticker = settings['ticker']
+
+    # === Загрузка дневного датафрейма ===
+    df = load_similarity_weights(config.artifact_path("similarity", settings))
+    df = add_pl_columns(df)
+
+    with pd.option_context(  # Печать широкого и длинного датафрейма
+            "display.width", 1000,
+            "display.max_columns", 70,
+            "display.max_colwidth", 100,
+            "display.min_rows", 50,
+    ):
+        print("Датафрейм с результатом:")
+        print(df)
+
+    df_rez = compute_pl(df)
+
+    print(df_rez)
+
+    # Кумулятивная сумма P/L
+    df_rez["Cum_P/L"] = df_rez["P/L"].cumsum()
+
+    # График кумулятивной суммы
+    plot_cum_pl(df_rez, Path(__file__).parent / f"{ticker}_cumsum_plot_max.png",
+                settings.get('plot_max_points', MAX_POINTS), settings.get('plot_decimation', 'minmax'))
+
+
+if __name__ == "__main__":
+    profiler = set_profiler(RunProfiler.from_settings(config.load_settings(), "pl"))
+    try:
+        main()
+    finally:
+        profiler.write_report()
@@ -8,90 +8,292 @@
 Сохраняет результат в .pkl файл для дальнейшего анализа.
 """
 
+import json
+import os
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
-from pathlib import Path
-import yaml
-from tslearn.metrics import dtw
 from tqdm import tqdm
 
-# Путь к settings.yaml
-SETTINGS_FILE = Path(__file__).parent / "settings.yaml"
-
-# Чтение настроек
-with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-    settings = yaml.safe_load(f)
+import config
+import minutes_vectors_to_days_vectors
+import run_profiler
+from artifact_cache import ArtifactCache, hash_key, source_fingerprint
+from data_quality import drop_excluded_days, load_day_quality
+from run_profiler import RunProfiler, set_profiler
+from similarity_metrics import distance_band, metric_settings, select_similar
 
-ticker = settings['ticker']
-PKL_DAILY = fr"{ticker}_futures_daily_vectors.pkl"
-# start_date = '2015-01-01'
+# Диапазон окон поиска похожего дня (в днях)
+MIN_WINDOW = 3
+MAX_WINDOW = 30
 
-# === Загрузка дневного датафрейма ===
-df = pd.read_pickle(PKL_DAILY)
-df['TRADEDATE'] = pd.to_datetime(df['TRADEDATE'])
-df = df.sort_values('TRADEDATE').reset_index(drop=True)
-df.dropna(inplace=True)  # Удаление строк с NaN
+# Как часто (в днях) дописывать готовые строки в контрольную точку
+CHECKPOINT_EVERY = 20
 
-# === Инициализация df_rez ===
-df_rez = pd.DataFrame()
+# Дней в одном блоке ленты расстояний без контрольной точки
+BLOCK_DAYS = 64
 
-# === Обработка каждой строки с прогресс-баром ===
-for idx_bar in tqdm(df.index, desc="Processing rows"):
-    day_vec = df.at[idx_bar, 'VECTORS']
-    day_vec = np.asarray(day_vec, dtype=float)
 
-    max_results = {}
+def load_daily_vectors(pkl_path: str) -> pd.DataFrame:
+    """
+    Загружает дневной датафрейм TRADEDATE, VECTORS, BODY, NEXT_BODY,
+    сортирует по дате и удаляет строки с NaN.
+    """
+    return prepare_daily_vectors(pd.read_pickle(pkl_path))
 
-    for n in range(3, 31):
-        if idx_bar < n:
-            max_results[f"MAX_{n}"] = 0.0
-            continue
 
-        best_dist = None
-        idx_bar_similar = None
+def prepare_daily_vectors(df: pd.DataFrame, dropna: bool = True) -> pd.DataFrame:
+    """
+    Приводит TRADEDATE к datetime, сортирует по дате и (по умолчанию) удаляет строки с NaN.
+    """
+    df = df.copy()
+    df['TRADEDATE'] = pd.to_datetime(df['TRADEDATE'])
+    df = df.sort_values('TRADEDATE').reset_index(drop=True)
+    if dropna:
+        df.dropna(inplace=True)  # Удаление строк с NaN
+    return df
 
-        for shift in range(1, n + 1):
-            idx_prev = idx_bar - shift
-            prev_vec = df.at[idx_prev, 'VECTORS']
-            prev_vec = np.asarray(prev_vec, dtype=float)
 
-            dist = dtw(day_vec, prev_vec)
-            if (best_dist is None) or (dist < best_dist):
-                best_dist = dist
-                idx_bar_similar = idx_prev
+def find_similar_days(df: pd.DataFrame, idx_bar: int,
+                      min_window: int = MIN_WINDOW, max_window: int = MAX_WINDOW,
+                      metric: str = 'dtw', metric_params: dict = None) -> dict:
+    """
+    Для дня idx_bar возвращает {n: индекс наиболее похожего по метрике (по умолчанию DTW) дня среди n предыдущих}.
+    Окна, для которых истории меньше n дней, в результат не попадают.
+    Расстояние каждой пары считается один раз (лента distance_band) и переиспользуется всеми окнами.
+    """
+    pos = df.index.get_loc(idx_bar)
+    band = distance_band(df['VECTORS'].tolist(), max_window, metric, rows=[pos], params=metric_params)
+    similar = select_similar(band, [pos], min_window, max_window)[0]
+    return {
+        n: df.index[similar[k]]
+        for k, n in enumerate(range(min_window, max_window + 1)) if similar[k] >= 0
+    }
 
-        next_body_curr = df.at[idx_bar, 'NEXT_BODY']
-        next_body_sim = df.at[idx_bar_similar, 'NEXT_BODY']
 
-        sign_curr = np.sign(next_body_curr)
-        sign_sim = np.sign(next_body_sim)
+class SimilarityCheckpoint:
+    """
+    Контрольная точка DTW-прохода: JSON Lines, первая строка — {"key": ключ входов},
+    далее по строке df_rez на день. Файл только дописывается, поэтому его можно читать
+    (load_similarity_checkpoint) во время работы. Оборванная при сбое последняя строка отбрасывается,
+    а файл с чужим ключом (другие дневные векторы или окна) начинается заново.
+    """
 
-        value = abs(next_body_curr)
-        if sign_curr == 0 or sign_sim == 0:
-            max_results[f"MAX_{n}"] = 0.0
-        elif sign_curr == sign_sim:
-            max_results[f"MAX_{n}"] = value
+    def __init__(self, path, key: str, every: int = CHECKPOINT_EVERY):
+        self.path = Path(path)
+        self.key = key
+        self.every = every
+        self.pending = []
+        self.rows, valid_bytes = _read_checkpoint(self.path, key)
+        if valid_bytes:
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_bytes)
         else:
-            max_results[f"MAX_{n}"] = -value
+            self.path.write_text(json.dumps({"key": key}) + "\n", encoding='utf-8')
+
+    def add(self, row: dict) -> None:
+        self.pending.append(row)
+        if len(self.pending) >= self.every:
+            self.flush()
+
+    def flush(self) -> None:
+        """Дописывает накопленные строки и сбрасывает их на диск."""
+        if not self.pending:
+            return
+        lines = "".join(
+            json.dumps({**row, "TRADEDATE": pd.Timestamp(row["TRADEDATE"]).isoformat()}) + "\n"
+            for row in self.pending
+        )
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self.rows.extend(self.pending)
+        self.pending = []
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def _read_checkpoint(path: Path, key: str = None) -> tuple:
+    """Строки контрольной точки и длина её целой части в байтах (0 — файла нет или ключ другой)."""
+    if not path.exists():
+        return [], 0
+    rows = []
+    valid_bytes = 0
+    with open(path, 'rb') as f:
+        for i, line in enumerate(f):
+            if not line.endswith(b"\n"):
+                break  # строка оборвана при сбое
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if i == 0:
+                if key is not None and record.get("key") != key:
+                    return [], 0
+            else:
+                record["TRADEDATE"] = pd.Timestamp(record["TRADEDATE"])
+                rows.append(record)
+            valid_bytes += len(line)
+    return rows, valid_bytes
+
+
+def load_similarity_checkpoint(path) -> pd.DataFrame:
+    """Уже посчитанные строки df_rez из контрольной точки (в том числе во время работы прохода)."""
+    rows, _ = _read_checkpoint(Path(path))
+    return pd.DataFrame(rows)
+
+
+def compute_similarity(df: pd.DataFrame, min_window: int = MIN_WINDOW, max_window: int = MAX_WINDOW,
+                       start: int = 0, checkpoint: SimilarityCheckpoint = None,
+                       metric: str = 'dtw', metric_params: dict = None) -> pd.DataFrame:
+    """
+    Для каждой даты ищет наиболее похожий по метрике (по умолчанию DTW) день среди n предыдущих
+    (n от min_window до max_window) и возвращает датафрейм TRADEDATE, MAX_n.
+    start — индекс первой обрабатываемой строки (более ранние строки служат только историей).
+    checkpoint — контрольная точка: дни из неё не пересчитываются, новые дописываются по ходу прохода.
+    metric — метрика схожести из similarity_metrics.METRICS.
+    """
+    rows = []
+    if checkpoint is not None and checkpoint.rows:
+        first_date = df.at[start, "TRADEDATE"] if start < len(df) else None
+        last_date = df["TRADEDATE"].iloc[-1] if len(df) else None
+        rows = [row for row in checkpoint.rows
+                if first_date is not None and first_date <= row["TRADEDATE"] <= last_date]
+        if rows:
+            start = int((df["TRADEDATE"] <= rows[-1]["TRADEDATE"]).sum())
+            run_profiler.count("days_resumed", len(rows))
+
+    vectors = df['VECTORS'].tolist()
+    next_body = df['NEXT_BODY'].to_numpy(dtype=float)
+    dates = df['TRADEDATE'].tolist()
+    windows = range(min_window, max_window + 1)
+    block = checkpoint.every if checkpoint is not None else BLOCK_DAYS
+
+    # === Обработка дней блоками: лента расстояний блока и выбор похожих дней по всем окнам сразу ===
+    with run_profiler.stage("dtw_sweep") as sweep:
+        positions = np.flatnonzero(df.index >= start)
+        for lo in tqdm(range(0, len(positions), block), desc="Processing rows"):
+            block_rows = positions[lo:lo + block]
+            band = distance_band(vectors, max_window, metric, rows=block_rows, params=metric_params)
+            similar = select_similar(band, block_rows, min_window, max_window)
 
-    # Добавление строки в df_rez
-    df_rez = pd.concat([
-        df_rez,
-        pd.DataFrame([{
+            # Вес: |NEXT_BODY| со знаком совпадения направлений, 0 при нулевом направлении или нехватке истории
+            sign_curr = np.sign(next_body[block_rows])[:, None]
+            sign_sim = np.sign(next_body[similar])
+            value = np.abs(next_body[block_rows])[:, None]
+            weights = np.where((sign_curr == 0) | (sign_sim == 0), 0.0,
+                               np.where(sign_curr == sign_sim, value, -value))
+            weights[similar < 0] = 0.0
+
+            for k, idx_bar in enumerate(block_rows):
+                # Добавление строки в df_rez
+                row = {
+                    "TRADEDATE": dates[idx_bar],
+                    **{f"MAX_{n}": float(weights[k, j]) for j, n in enumerate(windows)},
+                }
+                rows.append(row)
+                if checkpoint is not None:
+                    checkpoint.add(row)
+        if checkpoint is not None:
+            checkpoint.flush()
+        sweep.add("days", len(rows))
+    df_rez = pd.DataFrame(rows)
+    if not df_rez.empty:
+        # даты из контрольной точки приводятся к типу TRADEDATE входного датафрейма
+        df_rez["TRADEDATE"] = df_rez["TRADEDATE"].astype(df["TRADEDATE"].dtype)
+    return df_rez
+
+
+def compute_signals(df: pd.DataFrame, df_rez: pd.DataFrame = None, pl_days: int = 22,
+                    min_window: int = MIN_WINDOW, max_window: int = MAX_WINDOW,
+                    metric: str = 'dtw', metric_params: dict = None) -> pd.DataFrame:
+    """
+    Сигналы на следующий день для последней даты df (NEXT_BODY которой ещё неизвестен).
+    Для каждого окна n: наиболее похожий день, его NEXT_BODY и направление SIGNAL (+1/-1/0).
+    Если передан df_rez, добавляется PL — сумма MAX_n за последние pl_days дней,
+    по которой выбирается окно (как в data_processing_pl.py).
+    """
+    df = df.reset_index(drop=True)
+    idx_bar = df.index[-1]
+    similar = find_similar_days(df, idx_bar, min_window, max_window, metric, metric_params)
+
+    rows = []
+    for n, idx_similar in similar.items():
+        next_body_sim = df.at[idx_similar, 'NEXT_BODY']
+        row = {
             "TRADEDATE": df.at[idx_bar, "TRADEDATE"],
-            # "IDX_BAR": idx_bar,
-            **max_results
-        }])
-    ], ignore_index=True)
-
-with pd.option_context(  # Печать широкого и длинного датафрейма
-        "display.width", 1000,
-        "display.max_columns", 30,
-        "display.max_colwidth", 100
-):
-    print("Датафрейм с результатом:")
-    print(df_rez)
-
-# Сохранение df_rez в pkl файл
-df_rez.to_pickle(f"{ticker}_dtw_similarity_weights.pkl")
-print(f"df_rez saved to {ticker}_dtw_similarity_weights.pkl")
+            "WINDOW": n,
+            "SIMILAR_DATE": df.at[idx_similar, "TRADEDATE"],
+            "SIMILAR_NEXT_BODY": next_body_sim,
+            "SIGNAL": float(np.sign(next_body_sim)),
+        }
+        if df_rez is not None and f"MAX_{n}" in df_rez.columns:
+            row["PL"] = df_rez[f"MAX_{n}"].tail(pl_days).sum()
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def artifact_key(settings: dict = None) -> str:
+    """Ключ кэша схожести: ключ дневных векторов (и таблицы качества), диапазон окон, метрика и код расчёта."""
+    metric, metric_params = metric_settings(settings)
+    quality_exclude = config.get_settings(settings).get('quality_exclude', False)
+    return hash_key(
+        "similarity",
+        minutes_vectors_to_days_vectors.artifact_key(settings),
+        source_fingerprint(__file__, *(Path(__file__).with_name(name) for name in (
+            "vector_codec.py", "similarity_metrics.py", "day_layout.py", "dtw_engine.py"))),
+        min_window=MIN_WINDOW, max_window=MAX_WINDOW, metric=metric, metric_params=metric_params,
+        quality_exclude=quality_exclude,
+    )
+
+
+def main(settings: dict = None):
+    PKL_DAILY = config.artifact_path("daily_vectors", settings)
+    PKL_SIMILARITY = config.artifact_path("similarity", settings)
+
+    cache = ArtifactCache.from_settings(settings)
+    key = artifact_key(settings)
+    if cache.fetch(key, {"similarity": PKL_SIMILARITY}):
+        print(f"{PKL_SIMILARITY} is up to date (cache key {key}), skipping")
+        return
+
+    # === Загрузка дневного датафрейма ===
+    df = load_daily_vectors(PKL_DAILY)
+    if config.get_settings(settings).get('quality_exclude', False):
+        # Дни с EXCLUDE в таблице качества не участвуют в схожести ни как текущие, ни как кандидаты
+        df = drop_excluded_days(df, load_day_quality(settings))
+
+    # Контрольная точка: прерванный проход продолжается с последнего сохранённого дня
+    checkpoint = SimilarityCheckpoint(
+        config.artifact_path("similarity_checkpoint", settings), key,
+        every=config.get_settings(settings).get('similarity_checkpoint_every', CHECKPOINT_EVERY),
+    )
+    if checkpoint.rows:
+        print(f"Resuming from checkpoint: {len(checkpoint.rows)} days already computed")
+    metric, metric_params = metric_settings(settings)
+    df_rez = compute_similarity(df, checkpoint=checkpoint, metric=metric, metric_params=metric_params)
+
+    with pd.option_context(  # Печать широкого и длинного датафрейма
+            "display.width", 1000,
+            "display.max_columns", 30,
+            "display.max_colwidth", 100
+    ):
+        print("Датафрейм с результатом:")
+        print(df_rez)
+
+    # Сохранение df_rez в pkl файл
+    df_rez.to_pickle(PKL_SIMILARITY)
+    print(f"df_rez saved to {PKL_SIMILARITY}")
+    cache.store(key, {"similarity": PKL_SIMILARITY})
+    checkpoint.remove()
+
+
+if __name__ == "__main__":
+    profiler = set_profiler(RunProfiler.from_settings(config.load_settings(), "similarity"))
+    try:
+        main()
+    finally:
+        profiler.write_report()
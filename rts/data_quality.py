@@ -0,0 +1,195 @@
+"""
+Проверка качества минутных баров одним векторным проходом.
+Флаги бара: DUPLICATE (повтор TRADEDATE), OUT_OF_ORDER (бар раньше уже пройденного), BAD_BAR
+(пустая или неположительная цена, HIGH/LOW не охватывают OPEN/CLOSE, отрицательный объём),
+ZERO_RANGE (HIGH == LOW), GAP (пропуск больше quality_gap_minutes минут внутри дня),
+SPIKE (|лог-ретёрн CLOSE к CLOSE предыдущего бара дня| больше quality_spike_limit),
+ROLL (первый бар нового контракта: SECID отличается от предыдущего бара, в том числе через ночь),
+JUMP (|ln(OPEN первого бара дня / CLOSE последнего бара предыдущего дня)| больше quality_open_jump_limit —
+ночной разрыв, прежде всего скачок цены при ролловере на сырых ценах Futures). Флаги сводятся в компактную
+таблицу качества по дням {ticker}_day_quality.pkl с признаком EXCLUDE и причинами REASON.
+Сам ролловер день не исключает: признаки бара и BODY не выходят за границы дня, а склеенный ряд
+(continuous_prices) убирает разрыв; исключается день с ночным скачком выше порога.
+
+При загрузке (rts_download_minutes_to_db.py) clean_bars отбрасывает только точные дубли и пустые бары,
+остальные нарушения остаются в БД и попадают в таблицу качества. DUPLICATE и OUT_OF_ORDER срабатывают
+на страницах ответа ISS (clean_bars); на барах из БД они всегда 0 — TRADEDATE там первичный ключ,
+а бары читаются ORDER BY TRADEDATE.
+Таблица строится на стадии минутных векторов, в out_of_core.py и в демоне (правила на границе дня
+получают последний бар предыдущего дня, previous). При quality_exclude: true (по умолчанию выключено)
+матрицы исключённых дней не строятся стадией дневных векторов и демоном (VECTORS = None), не декодируются
+в out_of_core.py, а стадия схожести и демон убирают такие дни до расчёта DTW. Порог всплеска 5% за минуту
+срабатывает и на реальных днях высокой волатильности, поэтому исключение включается осознанно.
+"""
+
+import numpy as np
+import pandas as pd
+
+import config
+import run_profiler
+
+# Пороги по умолчанию (перекрываются ключами quality_* в settings.yaml)
+QUALITY_DEFAULTS = {
+    'quality_min_bars': 60,  # меньше баров — день исключается
+    'quality_gap_minutes': 15,  # пропуск длиннее считается в GAPS
+    'quality_max_gap_minutes': 180,  # самый длинный пропуск дня, после которого день исключается
+    'quality_spike_limit': 0.05,  # |ln(CLOSE / CLOSE предыдущего бара)| выше — всплеск (день исключается)
+    'quality_open_jump_limit': 0.05,  # |ln(OPEN дня / CLOSE предыдущего дня)| выше — ночной скачок (исключается)
+    'quality_max_bad_share': 0.01,  # доля дублей, баров не по порядку и битых баров для исключения
+    'quality_max_zero_range_share': 0.5,  # доля баров с HIGH == LOW для исключения
+}
+
+# Порог нулевого диапазона бара (как EPS в minutes_bars_to_vectors_pkl.py)
+EPS = 1e-12
+
+QUALITY_COLUMNS = ['TRADEDATE', 'BARS', 'DUPLICATES', 'OUT_OF_ORDER', 'BAD_BARS', 'ZERO_RANGE',
+                   'GAPS', 'MAX_GAP_MIN', 'SPIKES', 'ROLLS', 'OPEN_JUMP', 'EXCLUDE', 'REASON']
+
+
+def quality_params(settings: dict = None) -> dict:
+    """Пороги проверки качества из settings.yaml."""
+    settings = config.get_settings(settings)
+    return {key: settings.get(key, default) for key, default in QUALITY_DEFAULTS.items()}
+
+
+def flag_bars(df: pd.DataFrame, params: dict = None, previous: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Флаги качества каждого бара (TRADEDATE, OPEN, LOW, HIGH, CLOSE, VOLUME и, если есть, SECID)
+    в порядке строк df: DUPLICATE, OUT_OF_ORDER, BAD_BAR, ZERO_RANGE, GAP, GAP_MIN, SPIKE, ROLL, JUMP, JUMP_LOG.
+    previous — последний бар перед df (те же колонки) для ROLL и JUMP первого бара df;
+    без него первый бар df ни с чем не сравнивается.
+    """
+    params = {**QUALITY_DEFAULTS, **(params or {})}
+    skip = 0
+    if previous is not None and len(previous):
+        columns = [c for c in df.columns if c in previous.columns]
+        df = pd.concat([previous[columns].tail(1), df[columns]], ignore_index=True)
+        skip = 1
+    t = pd.to_datetime(df["TRADEDATE"]).reset_index(drop=True)
+    O, L, H, C = (pd.to_numeric(df[col], errors='coerce').reset_index(drop=True).astype(float)
+                  for col in ("OPEN", "LOW", "HIGH", "CLOSE"))
+    V = pd.to_numeric(df["VOLUME"], errors='coerce').reset_index(drop=True).astype(float)
+
+    same_day = t.dt.normalize().eq(t.dt.normalize().shift())
+    duplicate = t.duplicated(keep='first')
+    out_of_order = t < t.cummax().shift()
+    bad_bar = (
+        pd.concat([O, L, H, C], axis=1).isna().any(axis=1)
+        | (pd.concat([O, L, H, C], axis=1) <= EPS).any(axis=1)
+        | (H < np.maximum(O, C)) | (L > np.minimum(O, C))
+        | V.isna() | (V < 0)
+    )
+    zero_range = (H - L).abs() <= EPS
+
+    step = same_day & ~duplicate & ~out_of_order
+    # первый бар дня после баров предыдущего дня: сравнение с его последним баром через ночь
+    new_day = ~same_day & t.shift().notna() & ~out_of_order
+    valid_pair = ~bad_bar & ~bad_bar.shift(fill_value=False)
+    gap_min = ((t - t.shift()).dt.total_seconds() / 60).where(step, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        jump = np.abs(np.log(C / C.shift())).where(step & valid_pair, 0.0)
+        open_jump = np.abs(np.log(O / C.shift())).where(new_day & valid_pair, 0.0).fillna(0.0)
+    if "SECID" in df.columns:
+        secid = df["SECID"].reset_index(drop=True)
+        roll = secid.ne(secid.shift()) & secid.shift().notna()
+    else:
+        roll = pd.Series(False, index=t.index)
+
+    flags = pd.DataFrame({
+        'TRADEDATE': t,
+        'DUPLICATE': duplicate,
+        'OUT_OF_ORDER': out_of_order,
+        'BAD_BAR': bad_bar,
+        'ZERO_RANGE': zero_range,
+        'GAP': gap_min > params['quality_gap_minutes'],
+        'GAP_MIN': gap_min.fillna(0.0),
+        'SPIKE': jump.fillna(0.0) > params['quality_spike_limit'],
+        'ROLL': roll,
+        'JUMP': open_jump > params['quality_open_jump_limit'],
+        'JUMP_LOG': open_jump,
+    })
+    return flags.iloc[skip:].reset_index(drop=True)
+
+
+def compute_day_quality(df: pd.DataFrame, params: dict = None, previous: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Таблица качества по дням: число баров и нарушений каждого вида, самый длинный пропуск,
+    OPEN_JUMP — |лог-разрыв| открытия дня к закрытию предыдущего дня,
+    EXCLUDE — день исключается из схожести, REASON — сработавшие правила через запятую.
+    previous — последний бар перед df (см. flag_bars), когда df — часть истории.
+    """
+    params = {**QUALITY_DEFAULTS, **(params or {})}
+    with run_profiler.stage("data_quality") as st:
+        flags = flag_bars(df, params, previous)
+        grouped = flags.groupby(flags["TRADEDATE"].dt.date)
+        quality = pd.DataFrame({
+            'BARS': grouped.size(),
+            'DUPLICATES': grouped['DUPLICATE'].sum(),
+            'OUT_OF_ORDER': grouped['OUT_OF_ORDER'].sum(),
+            'BAD_BARS': grouped['BAD_BAR'].sum(),
+            'ZERO_RANGE': grouped['ZERO_RANGE'].sum(),
+            'GAPS': grouped['GAP'].sum(),
+            'MAX_GAP_MIN': grouped['GAP_MIN'].max(),
+            'SPIKES': grouped['SPIKE'].sum(),
+            'ROLLS': grouped['ROLL'].sum(),
+            'OPEN_JUMP': grouped['JUMP_LOG'].max(),
+        }).astype({'BARS': np.int32, 'DUPLICATES': np.int32, 'OUT_OF_ORDER': np.int32, 'BAD_BARS': np.int32,
+                   'ZERO_RANGE': np.int32, 'GAPS': np.int32, 'MAX_GAP_MIN': np.float32,
+                   'SPIKES': np.int32, 'ROLLS': np.int32, 'OPEN_JUMP': np.float32})
+        quality.index.name = 'TRADEDATE'
+        quality = quality.reset_index()
+
+        rules = {
+            'bars': quality['BARS'] < params['quality_min_bars'],
+            'bad': (quality['DUPLICATES'] + quality['OUT_OF_ORDER'] + quality['BAD_BARS'])
+                   > params['quality_max_bad_share'] * quality['BARS'],
+            'zero_range': quality['ZERO_RANGE'] > params['quality_max_zero_range_share'] * quality['BARS'],
+            'gap': quality['MAX_GAP_MIN'] > params['quality_max_gap_minutes'],
+            'spike': quality['SPIKES'] > 0,
+            'jump': quality['OPEN_JUMP'] > params['quality_open_jump_limit'],
+        }
+        reason = pd.Series('', index=quality.index)
+        for name, mask in rules.items():
+            reason = reason.where(~mask, reason + ',' + name)
+        quality['REASON'] = reason.str.lstrip(',')
+        quality['EXCLUDE'] = quality['REASON'] != ''
+        quality = quality[QUALITY_COLUMNS]
+        st.add("days", len(quality))
+        st.add("excluded_days", int(quality['EXCLUDE'].sum()))
+    return quality
+
+
+def clean_bars(df: pd.DataFrame) -> tuple:
+    """
+    Для загрузки в БД: отбрасывает только точные дубли строк и бары с пустыми OPEN/LOW/HIGH/CLOSE/VOLUME
+    (колонки NOT NULL в Futures). Бары не по порядку, битые бары и всплески остаются в БД как есть —
+    исходные данные ISS не теряются, такие бары учитываются в таблице качества дней.
+    Возвращает датафрейм и {флаг: число баров} для журнала.
+    """
+    flags = flag_bars(df)
+    counts = {name: int(flags[name].sum()) for name in ('DUPLICATE', 'OUT_OF_ORDER', 'BAD_BAR', 'SPIKE')}
+    keep = ~df.duplicated(keep='first') & df[['OPEN', 'LOW', 'HIGH', 'CLOSE', 'VOLUME']].notna().all(axis=1)
+    return df[keep.to_numpy()].reset_index(drop=True), counts
+
+
+def load_day_quality(settings: dict = None):
+    """Таблица качества дней или None, если она ещё не построена."""
+    path = config.artifact_path("day_quality", settings)
+    return pd.read_pickle(path) if path.exists() else None
+
+
+def excluded_days(quality: pd.DataFrame) -> set:
+    """Даты (date) дней с EXCLUDE."""
+    if quality is None:
+        return set()
+    return set(quality.loc[quality['EXCLUDE'], 'TRADEDATE'])
+
+
+def drop_excluded_days(df: pd.DataFrame, quality: pd.DataFrame) -> pd.DataFrame:
+    """Убирает из дневного датафрейма (TRADEDATE, ...) дни с EXCLUDE; NEXT_BODY остальных дней не меняется."""
+    excluded = excluded_days(quality)
+    if not excluded:
+        return df
+    mask = pd.to_datetime(df['TRADEDATE']).dt.date.isin(excluded)
+    run_profiler.count("days_excluded", int(mask.sum()))
+    return df[~mask].reset_index(drop=True)
@@ -0,0 +1,28 @@
+"""
+Раскладка матрицы дня (N_day, dim) на сетку фиксированной длины — общая для тензора (days_vectors_to_tensor.py)
+и векторных метрик схожести (similarity_metrics.py).
+    resample_day — линейная интерполяция дня на length равномерных точек (день растягивается на всю сетку);
+    pad_day      — слот = номер бара от начала сессии, слоты после последнего бара дня — NaN.
+В матрицах дневных векторов нет времени баров, поэтому pad_day выравнивает дни по номеру бара:
+минутные бары RTS идут внутри сессии почти без пропусков, и номер бара совпадает с минутой сессии.
+"""
+
+import numpy as np
+
+
+def resample_day(matrix: np.ndarray, length: int) -> np.ndarray:
+    """Линейная интерполяция матрицы дня (N_day, dim) на length равномерных точек."""
+    n = len(matrix)
+    if n == 1:
+        return np.repeat(matrix, length, axis=0)
+    src = np.linspace(0.0, 1.0, n)
+    dst = np.linspace(0.0, 1.0, length)
+    return np.stack([np.interp(dst, src, matrix[:, k]) for k in range(matrix.shape[1])], axis=1)
+
+
+def pad_day(matrix: np.ndarray, length: int) -> np.ndarray:
+    """Первые length баров дня по слотам сессии (length, dim); пустые слоты в конце — NaN."""
+    out = np.full((length, matrix.shape[1]), np.nan)
+    n = min(len(matrix), length)
+    out[:n] = matrix[:n]
+    return out
@@ -0,0 +1,243 @@
+"""
+Экспорт минутных векторов в тензор фиксированной формы (дни, T, 7) float32 для обучения моделей.
+Дни содержат разное число баров, поэтому ряд VECTORS из дневного pkl нельзя собрать в батч.
+Режимы выравнивания (tensor_mode в settings.yaml):
+    align    — слот бара = минута от начала сессии tensor_session_start, T = tensor_session_minutes;
+               пустые слоты заполнены нулями и отмечены 0 в маске;
+    resample — бары дня линейно интерполируются на T равномерных точек, маска вся из единиц.
+Не заданные в settings.yaml начало и длина сессии берутся по данным: от самой ранней до самой поздней
+минуты баров во всей истории (утренняя и вечерняя сессии MOEX попадают в тензор целиком).
+Дни читаются из БД потоком по порциям (out_of_core.iter_days, признаки как на стадии минутных векторов)
+и пишутся в memmap блоками по CHUNK_DAYS дней, поэтому память не зависит от длины истории.
+Файлы .npy открываются через np.load(mmap_mode='r'), поэтому обучение читает батчи с диска
+без распаковки pkl; рядом лежит JSON-индекс с датами, BODY и NEXT_BODY.
+
+Пример чтения:
+    for x, mask, next_body, dates in iter_batches(settings=settings, batch_size=64, shuffle=True):
+        ...
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import minutes_vectors_to_days_vectors
+import run_profiler
+from artifact_cache import ArtifactCache, hash_key, source_fingerprint
+from day_layout import resample_day
+from run_profiler import RunProfiler, set_profiler
+
+# Размерность минутного вектора признаков
+DIM = 7
+
+# Начало сессии для пустой БД и T режима resample без tensor_session_minutes
+SESSION_START = '09:00'
+SESSION_MINUTES = 890
+
+# Число дней, записываемых в memmap за один проход
+CHUNK_DAYS = 256
+
+TENSOR_MODES = ('align', 'resample')
+
+
+def tensor_params(settings: dict = None) -> dict:
+    """Параметры выравнивания из settings.yaml; session_start/session_minutes None — по данным (session_extent)."""
+    settings = config.get_settings(settings)
+    mode = settings.get('tensor_mode', 'align')
+    if mode not in TENSOR_MODES:
+        raise ValueError(f"Неизвестный режим тензора: {mode} (допустимы {', '.join(TENSOR_MODES)})")
+    session_start = settings.get('tensor_session_start')
+    session_minutes = settings.get('tensor_session_minutes')
+    return {
+        'mode': mode,
+        'session_start': None if session_start is None else str(session_start),
+        'session_minutes': None if session_minutes is None else int(session_minutes),
+    }
+
+
+def session_extent(db_path, table_name: str) -> tuple:
+    """
+    Одним запросом к БД: число дней, самая ранняя и самая поздняя минута бара ('HH:MM') по всей истории.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        n_days, first, last = conn.execute(
+            f"SELECT COUNT(DISTINCT substr(TRADEDATE, 1, 10)), "
+            f"MIN(substr(TRADEDATE, 12, 5)), MAX(substr(TRADEDATE, 12, 5)) FROM {table_name}"
+        ).fetchone()
+    finally:
+        conn.close()
+    if not n_days:
+        return 0, SESSION_START, SESSION_START
+    return n_days, first, last
+
+
+def _minute_of_day(hhmm: str) -> int:
+    hours, minutes = map(int, hhmm.split(':'))
+    return hours * 60 + minutes
+
+
+def frame_days(df_minute: pd.DataFrame):
+    """
+    Дни минутного датафрейма (TRADEDATE, VECTORS) в виде (дата, матрица (N_day, 7), минуты от полуночи)
+    — тот же формат, что у потока из БД в main.
+    """
+    for date, g in df_minute.groupby(df_minute["TRADEDATE"].dt.date, sort=True):
+        minutes = (g["TRADEDATE"].dt.hour * 60 + g["TRADEDATE"].dt.minute).to_numpy(dtype=np.int16)
+        yield date, np.stack(g["VECTORS"].to_numpy()).astype(np.float32), minutes
+
+
+def build_tensor(days, n_days: int, tensor_path: Path, mask_path: Path,
+                 mode: str = 'align', session_start: str = SESSION_START,
+                 session_minutes: int = SESSION_MINUTES) -> tuple:
+    """
+    Пишет тензор (n_days, T, 7) float32 и маску (n_days, T) uint8 в .npy файлы через open_memmap.
+    days — поток (дата, матрица (N_day, 7), минуты от полуночи каждого бара) в порядке дат
+    (frame_days или поток из БД); в памяти держится один блок из CHUNK_DAYS дней.
+    Возвращает даты и BODY дней (BODY — пятый элемент дня, если он есть, иначе None).
+    """
+    start = _minute_of_day(session_start)
+    dates, bodies = [], []
+    with run_profiler.stage("build_tensor") as st:
+        tensor = np.lib.format.open_memmap(tensor_path, mode='w+', dtype=np.float32,
+                                           shape=(n_days, session_minutes, DIM))
+        mask = np.lib.format.open_memmap(mask_path, mode='w+', dtype=np.uint8,
+                                         shape=(n_days, session_minutes))
+        x = np.zeros((CHUNK_DAYS, session_minutes, DIM), dtype=np.float32)
+        m = np.zeros((CHUNK_DAYS, session_minutes), dtype=np.uint8)
+        dropped = 0
+
+        def flush(lo: int, count: int) -> None:
+            tensor[lo:lo + count] = x[:count]
+            mask[lo:lo + count] = m[:count]
+            x[:count] = 0
+            m[:count] = 0
+
+        for i, day in enumerate(days):
+            date, matrix, minutes = day[:3]
+            k = i % CHUNK_DAYS
+            if mode == 'align':
+                slots = minutes.astype(np.int64) - start
+                inside = (slots >= 0) & (slots < session_minutes)
+                dropped += int((~inside).sum())
+                x[k, slots[inside]] = matrix[inside]
+                m[k, slots[inside]] = 1
+            else:
+                x[k] = resample_day(matrix, session_minutes)
+                m[k] = 1
+            dates.append(date)
+            bodies.append(day[3] if len(day) > 3 else None)
+            if k == CHUNK_DAYS - 1:
+                flush(i - k, CHUNK_DAYS)
+        if len(dates) % CHUNK_DAYS:
+            flush(len(dates) - len(dates) % CHUNK_DAYS, len(dates) % CHUNK_DAYS)
+        if len(dates) != n_days:
+            raise ValueError(f"Ожидалось {n_days} дней, получено {len(dates)}")
+        tensor.flush()
+        mask.flush()
+        st.add("days", len(dates))
+        st.add("dropped_bars", dropped)
+        st.add("bytes", int(tensor.nbytes + mask.nbytes))
+    del tensor, mask
+    return dates, bodies
+
+
+def save_tensor_index(path: Path, dates: list, bodies: list, params: dict) -> None:
+    """JSON-индекс тензора: даты дней, BODY, NEXT_BODY (BODY следующего дня, у последнего None) и параметры."""
+    index = {
+        **params,
+        'dim': DIM,
+        'dates': [d.isoformat() for d in dates],
+        'body': bodies,
+        'next_body': bodies[1:] + [None],
+    }
+    Path(path).write_text(json.dumps(index), encoding='utf-8')
+
+
+def load_tensor(settings: dict = None) -> tuple:
+    """Тензор и маска как read-only memmap и JSON-индекс."""
+    tensor = np.load(config.artifact_path("daily_tensor", settings), mmap_mode='r')
+    mask = np.load(config.artifact_path("daily_tensor_mask", settings), mmap_mode='r')
+    index = json.loads(config.artifact_path("daily_tensor_index", settings).read_text(encoding='utf-8'))
+    return tensor, mask, index
+
+
+def iter_batches(settings: dict = None, batch_size: int = 64, shuffle: bool = False, seed: int = None,
+                 drop_last: bool = False, days: np.ndarray = None):
+    """
+    Потоковый итератор мини-батчей (x, mask, next_body, dates) по memmap тензора.
+    x — (B, T, 7) float32, mask — (B, T) uint8, next_body — (B,) float64 (NaN у последнего дня).
+    days — номера дней для выборки (например, обучающий период), по умолчанию все.
+    При shuffle порядок дней перемешивается, но внутри батча индексы идут по возрастанию,
+    чтобы чтение с диска было последовательным.
+    """
+    tensor, mask, index = load_tensor(settings)
+    next_body = np.array([np.nan if v is None else v for v in index['next_body']], dtype=np.float64)
+    dates = np.array(index['dates'])
+    order = np.arange(len(tensor)) if days is None else np.asarray(days)
+    if shuffle:
+        order = np.random.default_rng(seed).permutation(order)
+    for lo in range(0, len(order), batch_size):
+        batch = np.sort(order[lo:lo + batch_size])
+        if drop_last and len(batch) < batch_size:
+            break
+        yield np.asarray(tensor[batch]), np.asarray(mask[batch]), next_body[batch], dates[batch]
+
+
+def artifact_key(settings: dict = None) -> str:
+    """Ключ кэша тензора: ключ дневных векторов (минутные векторы и BODY), параметры и код экспорта."""
+    return hash_key(
+        "daily_tensor",
+        minutes_vectors_to_days_vectors.artifact_key(settings),
+        source_fingerprint(__file__, *(Path(__file__).with_name(name) for name in ("out_of_core.py", "day_layout.py"))),
+        **tensor_params(settings),
+    )
+
+
+def main(settings: dict = None):
+    from out_of_core import CHUNK_ROWS, iter_days
+
+    settings = config.get_settings(settings)
+    DB_PATH = config.db_path(settings)
+    if not Path(DB_PATH).exists():
+        raise FileNotFoundError(f"Database not found: {DB_PATH}")
+    outputs = {kind: config.artifact_path(kind, settings)
+               for kind in ("daily_tensor", "daily_tensor_mask", "daily_tensor_index")}
+
+    cache = ArtifactCache.from_settings(settings)
+    key = artifact_key(settings)
+    if cache.fetch(key, outputs):
+        print(f"{outputs['daily_tensor']} is up to date (cache key {key}), skipping")
+        return
+
+    params = tensor_params(settings)
+    table = config.bars_table(settings)
+    n_days, first, last = session_extent(DB_PATH, table)
+    if params['session_start'] is None:
+        params['session_start'] = first
+    if params['session_minutes'] is None:
+        # align — до последней минуты баров в истории, resample — длина по умолчанию
+        params['session_minutes'] = (max(1, _minute_of_day(last) - _minute_of_day(params['session_start']) + 1)
+                                     if params['mode'] == 'align' else SESSION_MINUTES)
+
+    # Поток дней из БД (признаки как на стадии минутных векторов), без загрузки минутного pkl
+    days = ((date, matrix, minutes_of_day, body)
+            for date, matrix, body, _, minutes_of_day in iter_days(
+                DB_PATH, table, 'float32', settings.get('out_of_core_chunk_rows', CHUNK_ROWS)))
+    dates, bodies = build_tensor(days, n_days, outputs["daily_tensor"], outputs["daily_tensor_mask"], **params)
+    save_tensor_index(outputs["daily_tensor_index"], dates, bodies, params)
+    print(f"Saved tensor ({len(dates)}, {params['session_minutes']}, {DIM}) "
+          f"from {params['session_start']} to {outputs['daily_tensor']}")
+    cache.store(key, outputs)
+
+
+if __name__ == "__main__":
+    profiler = set_profiler(RunProfiler.from_settings(config.load_settings(), "daily_tensor"))
+    try:
+        main()
+    finally:
+        profiler.write_report()
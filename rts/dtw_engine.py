@@ -0,0 +1,113 @@
+"""
+Нативный движок DTW для всей ленты (дни × 1..max_shift предыдущих дней) одним вызовом.
+Дни упаковываются в непрерывное хранилище pack_days: values (сумма N_day, 7) и offsets (дни + 1),
+матрица дня i — values[offsets[i]:offsets[i + 1]]. Ядро на numba компилируется в машинный код,
+отпускает GIL (nogil) и распределяет пары (день, сдвиг) по потокам (prange) — параллелизм между парами;
+внутри пары DTW идёт по двум строкам накопленной стоимости, без матрицы N×M.
+precision='float32' считает стоимость в float32 (вдвое больше значений в SIMD-регистре),
+'float64' повторяет tslearn.metrics.dtw (та же формула: sqrt суммы квадратов евклидовых расстояний).
+С gamma > 0 то же ядро считает soft-DTW (tslearn.metrics.soft_dtw): минимум трёх соседей заменён
+сглаженным -gamma * log(sum(exp(-x / gamma))), результат без корня и может быть отрицательным.
+Без numba available() возвращает False и similarity_metrics считает пары через tslearn.
+"""
+
+import numpy as np
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:  # движок недоступен, используется tslearn
+    numba = None
+
+from vector_codec import decode_day
+
+PRECISIONS = ('float32', 'float64')
+
+# Флаги fastmath ядра: всё, кроме nnan/ninf — граница матрицы и недоступные клетки задаются np.inf,
+# и сравнения с ним при ninf были бы неопределённым поведением LLVM
+FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+
+def available() -> bool:
+    """Установлен ли numba."""
+    return numba is not None
+
+
+def pack_days(days, precision: str = 'float64') -> tuple:
+    """
+    Непрерывное хранилище матриц дней (любой кодировки vector_codec): values (сумма N_day, dim) и offsets.
+    Принимает список матриц или ряд VECTORS из вывода build_daily_vectors.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Неизвестная точность DTW: {precision} (допустимы {', '.join(PRECISIONS)})")
+    matrices = [decode_day(m) for m in days]
+    offsets = np.zeros(len(matrices) + 1, dtype=np.int64)
+    np.cumsum([len(m) for m in matrices], out=offsets[1:])
+    if not matrices:
+        return np.zeros((0, 0), dtype=precision), offsets
+    values = np.ascontiguousarray(np.concatenate(matrices), dtype=precision)
+    return values, offsets
+
+
+if numba is not None:
+    @njit(nogil=True, fastmath=FASTMATH, cache=True)
+    def _dtw(values, x_lo, x_hi, y_lo, y_hi, gamma, prev, curr):
+        """DTW (soft-DTW при gamma > 0) пары отрезков хранилища на двух строках накопленной стоимости длины M + 1."""
+        m = y_hi - y_lo
+        dim = values.shape[1]
+        prev[0] = 0.0
+        for j in range(1, m + 1):
+            prev[j] = np.inf
+        for i in range(x_lo, x_hi):
+            curr[0] = np.inf
+            for j in range(m):
+                diff = values[i, 0] - values[y_lo + j, 0]
+                cost = diff * diff
+                for f in range(1, dim):
+                    diff = values[i, f] - values[y_lo + j, f]
+                    cost += diff * diff
+                best = prev[j]
+                if prev[j + 1] < best:
+                    best = prev[j + 1]
+                if curr[j] < best:
+                    best = curr[j]
+                if gamma > 0 and best < np.inf:
+                    # сглаженный минимум со сдвигом на best: экспоненты не переполняются
+                    best -= gamma * np.log(np.exp((best - prev[j]) / gamma) + np.exp((best - prev[j + 1]) / gamma)
+                                           + np.exp((best - curr[j]) / gamma))
+                curr[j + 1] = cost + best
+            prev, curr = curr, prev
+        return prev[m] if gamma > 0 else np.sqrt(prev[m])
+
+    @njit(parallel=True, nogil=True, cache=True)
+    def _dtw_band(values, offsets, rows, max_shift, gamma, out):
+        n_pairs = len(rows) * max_shift
+        for p in prange(n_pairs):
+            k = p // max_shift
+            s = p % max_shift + 1
+            i = rows[k]
+            j = i - s
+            if j < 0:
+                continue
+            m = offsets[j + 1] - offsets[j]
+            prev = np.empty(m + 1, dtype=values.dtype)
+            curr = np.empty(m + 1, dtype=values.dtype)
+            out[k, s - 1] = _dtw(values, offsets[i], offsets[i + 1], offsets[j], offsets[j + 1], gamma, prev, curr)
+
+
+def dtw_band(values: np.ndarray, offsets: np.ndarray, rows, max_shift: int, threads: int = None,
+             gamma: float = 0.0) -> np.ndarray:
+    """
+    Лента DTW (len(rows), max_shift) по хранилищу pack_days: band[k, s - 1] = DTW(день rows[k], день rows[k] - s),
+    inf, если такого дня нет. threads — число потоков numba (по умолчанию все ядра); gamma > 0 — soft-DTW.
+    """
+    if numba is None:
+        raise RuntimeError("Движок DTW требует numba (pip install numba)")
+    rows = np.ascontiguousarray(rows, dtype=np.int64)
+    band = np.full((len(rows), max_shift), np.inf)
+    if len(rows) == 0:
+        return band
+    if threads:
+        numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+    _dtw_band(values, offsets, rows, max_shift, values.dtype.type(gamma), band)
+    return band
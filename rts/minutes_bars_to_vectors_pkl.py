@@ -3,54 +3,121 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 from tqdm import tqdm
-import yaml
 
-# Путь к settings.yaml в той же директории, что и скрипт
-SETTINGS_FILE = Path(__file__).parent / "settings.yaml"
-
-# Чтение настроек
-with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-    settings = yaml.safe_load(f)
+import config
+import run_profiler
+from artifact_cache import ArtifactCache, db_fingerprint, hash_key, source_fingerprint
+from data_quality import compute_day_quality, quality_params
+from rolling_stats import RollingVolumeStats
+from run_profiler import RunProfiler, set_profiler
 
 # ==== Параметры ====
-ticker = settings['ticker']
-
-# Путь к файлам и БД
-DB_PATH = Path(settings['path_db_minute'].replace('{ticker}', ticker))
-PKL_OUT = Path(fr"{ticker}_futures_minute_2015_vectors.pkl")
 TABLE_NAME = "Futures"  # имя таблицы в БД
 
 # параметры нормализации объёма
 VOLUME_WINDOW = 100
+EPS = 1e-12  # порог нулевого диапазона бара и нулевой цены открытия
 
-# Регистрируем tqdm для pandas
-tqdm.pandas()
-
-def load_ohlcv_from_sqlite(db_path: str, table_name: str) -> pd.DataFrame:
+def load_ohlcv_from_sqlite(db_path: str, table_name: str, since=None) -> pd.DataFrame:
     """
-    Загружает TRADEDATE, OPEN, LOW, HIGH, CLOSE, VOLUME из SQLite.
+    Загружает TRADEDATE, SECID, OPEN, LOW, HIGH, CLOSE, VOLUME из SQLite.
+    since — дата, с которой загружать бары (None — вся история).
     """
-    conn = sqlite3.connect(db_path)
-    query = f"""
-        SELECT
-            TRADEDATE,
-            OPEN,
-            LOW,
-            HIGH,
-            CLOSE,
-            VOLUME
-        FROM {table_name}
-        ORDER BY TRADEDATE
+    where = "WHERE TRADEDATE >= ?" if since is not None else ""
+    params = (pd.Timestamp(since).strftime("%Y-%m-%d"),) if since is not None else ()
+    with run_profiler.stage("load_ohlcv_from_sqlite") as st:
+        conn = sqlite3.connect(db_path)
+        query = f"""
+            SELECT
+                TRADEDATE,
+                SECID,
+                OPEN,
+                LOW,
+                HIGH,
+                CLOSE,
+                VOLUME
+            FROM {table_name}
+            {where}
+            ORDER BY TRADEDATE
+        """
+        df = pd.read_sql_query(query, conn, params=params, parse_dates=["TRADEDATE"])
+        conn.close()
+        st.add("rows", len(df))
+    return df
+
+def load_ohlcv_tail_from_sqlite(db_path: str, table_name: str, after: pd.Timestamp,
+                                context: int = VOLUME_WINDOW - 1) -> pd.DataFrame:
     """
-    df = pd.read_sql_query(query, conn, parse_dates=["TRADEDATE"])
-    conn.close()
+    Загружает бары с TRADEDATE > after и context баров перед ними,
+    чтобы скользящее окно объёма для новых баров было полным.
+    """
+    after_str = pd.Timestamp(after).strftime("%Y-%m-%d %H:%M:%S")
+    with run_profiler.stage("load_ohlcv_from_sqlite") as st:
+        conn = sqlite3.connect(db_path)
+        query = f"""
+            SELECT TRADEDATE, SECID, OPEN, LOW, HIGH, CLOSE, VOLUME FROM (
+                SELECT TRADEDATE, SECID, OPEN, LOW, HIGH, CLOSE, VOLUME
+                FROM {table_name}
+                WHERE TRADEDATE <= ?
+                ORDER BY TRADEDATE DESC
+                LIMIT ?
+            )
+            UNION ALL
+            SELECT TRADEDATE, SECID, OPEN, LOW, HIGH, CLOSE, VOLUME
+            FROM {table_name}
+            WHERE TRADEDATE > ?
+            ORDER BY TRADEDATE
+        """
+        df = pd.read_sql_query(query, conn, params=(after_str, context, after_str), parse_dates=["TRADEDATE"])
+        conn.close()
+        st.add("rows", len(df))
     return df
 
-def compute_features(df: pd.DataFrame) -> pd.DataFrame:
+def load_volume_stats_from_sqlite(db_path: str, table_name: str, until: pd.Timestamp = None) -> RollingVolumeStats:
+    """
+    Восстанавливает состояние скользящего окна объёма проходом по VOLUME всей истории
+    (до until включительно), когда сохранённого снимка нет или он отстал.
+    """
+    where = "WHERE TRADEDATE <= ?" if until is not None else ""
+    params = (pd.Timestamp(until).strftime("%Y-%m-%d %H:%M:%S"),) if until is not None else ()
+    conn = sqlite3.connect(db_path)
+    df = pd.read_sql_query(
+        f"SELECT TRADEDATE, VOLUME FROM {table_name} {where} ORDER BY TRADEDATE", conn, params=params
+    )
+    conn.close()
+    volume_stats = RollingVolumeStats(VOLUME_WINDOW)
+    volume_stats.extend(df["VOLUME"].astype(float).values)
+    if len(df):
+        volume_stats.last_tradedate = str(pd.Timestamp(df["TRADEDATE"].iloc[-1]))
+    return volume_stats
+
+def compute_features_incremental(db_path: str, table_name: str, after: pd.Timestamp,
+                                 volume_stats: RollingVolumeStats = None) -> pd.DataFrame:
+    """
+    Векторы признаков только для баров с TRADEDATE > after.
+    С состоянием volume_stats, снятым на баре after, из БД читаются только новые бары;
+    без него контекст окна объёма берётся из предыдущих баров БД.
+    """
+    if volume_stats is not None and volume_stats.last_tradedate != str(pd.Timestamp(after)):
+        raise ValueError(f"Состояние окна объёма снято на {volume_stats.last_tradedate}, а не на {after}")
+    context = 0 if volume_stats is not None else VOLUME_WINDOW - 1
+    df_raw = load_ohlcv_tail_from_sqlite(db_path, table_name, after, context=context)
+    df_vectors = compute_features(df_raw, volume_stats)
+    return df_vectors[df_raw["TRADEDATE"] > pd.Timestamp(after)].reset_index(drop=True)
+
+def compute_features(df: pd.DataFrame, volume_stats: RollingVolumeStats = None) -> pd.DataFrame:
     """
     Строит вектор признаков [rO, rC, rbody, rup, rdown, rlog, V_tilde]
     и возвращает DataFrame с колонками TRADEDATE и VECTORS.
+    volume_stats — состояние скользящего окна объёма, которое продолжается барами df
+    (None — окно начинается с первого бара df).
     """
+    with run_profiler.stage("compute_features") as st:
+        out_df = _compute_features(df, volume_stats)
+        st.add("rows", len(out_df))
+    return out_df
+
+def _compute_features(df: pd.DataFrame, volume_stats: RollingVolumeStats = None) -> pd.DataFrame:
     # Переименуем для краткости
     O = df["OPEN"].astype(float)
     H = df["HIGH"].astype(float)
@@ -62,8 +129,7 @@ def compute_features(df: pd.DataFrame) -> pd.DataFrame:
     R = H - L
 
     # Маска «нормальных» баров, чтобы не делить на ноль
-    eps = 1e-12
-    valid_range = R.abs() > eps
+    valid_range = R.abs() > EPS
 
     # Инициализация всех признаков NaN
     rO = pd.Series(np.nan, index=df.index, dtype=float)
@@ -86,13 +152,19 @@ def compute_features(df: pd.DataFrame) -> pd.DataFrame:
     r_down.loc[valid_range] = (lower_body - L[valid_range].values) / R_valid.values
 
     # Лог-ретёрн
-    valid_open = O.abs() > eps
+    valid_open = O.abs() > EPS
     r_log = pd.Series(np.nan, index=df.index, dtype=float)
     r_log.loc[valid_open] = np.log(C[valid_open].values / O[valid_open].values)
 
-    # Нормализация объёма (z-score по скользящему окну)
-    V_mean = V.rolling(VOLUME_WINDOW, min_periods=1).mean()
-    V_std = V.rolling(VOLUME_WINDOW, min_periods=1).std(ddof=0)
+    # Нормализация объёма (z-score по скользящему окну).
+    # V.rolling(VOLUME_WINDOW, min_periods=1).mean()/.std(ddof=0) по хвосту окна volume_stats и барам df
+    if volume_stats is None:
+        volume_stats = RollingVolumeStats(VOLUME_WINDOW)
+    V_mean, V_std = volume_stats.extend(V.values)
+    V_mean = pd.Series(V_mean, index=df.index)
+    V_std = pd.Series(V_std, index=df.index)
+    if len(df):
+        volume_stats.last_tradedate = str(pd.Timestamp(df["TRADEDATE"].iloc[-1]))
     V_std_safe = V_std.replace(0, np.nan)
     V_tilde = (V - V_mean) / V_std_safe
     V_tilde = V_tilde.fillna(0.0)
@@ -120,19 +192,56 @@ def compute_features(df: pd.DataFrame) -> pd.DataFrame:
     )
     return out_df
 
-def main():
+def artifact_key(settings: dict = None) -> str:
+    """Ключ кэша минутных векторов и таблицы качества дней: содержимое БД, параметры и код расчёта."""
+    return hash_key(
+        "minute_vectors",
+        db_fingerprint(config.db_path(settings), config.bars_table(settings)),
+        source_fingerprint(__file__, *(Path(__file__).with_name(name)
+                                       for name in ("rolling_stats.py", "data_quality.py"))),
+        volume_window=VOLUME_WINDOW, eps=EPS, **quality_params(settings),
+    )
+
+def main(settings: dict = None):
+    DB_PATH = config.db_path(settings)
+    PKL_OUT = config.artifact_path("minute_vectors", settings)
     if not Path(DB_PATH).exists():
         raise FileNotFoundError(f"Database not found: {DB_PATH}")
 
-    df_raw = load_ohlcv_from_sqlite(DB_PATH, TABLE_NAME)
-    df_vectors = compute_features(df_raw)
+    cache = ArtifactCache.from_settings(settings)
+    key = artifact_key(settings)
+    outputs = {
+        "minute_vectors": PKL_OUT,
+        "volume_state": config.artifact_path("volume_state", settings),
+        "day_quality": config.artifact_path("day_quality", settings),
+    }
+    if cache.fetch(key, outputs):
+        print(f"{PKL_OUT} is up to date (cache key {key}), skipping")
+        return
+
+    df_raw = load_ohlcv_from_sqlite(DB_PATH, config.bars_table(settings))
+
+    # Таблица качества дней тем же проходом по загруженным барам
+    df_quality = compute_day_quality(df_raw, quality_params(settings))
+    df_quality.to_pickle(outputs["day_quality"])
+    print(f"Day quality: {int(df_quality['EXCLUDE'].sum())} of {len(df_quality)} days excluded")
+
+    volume_stats = RollingVolumeStats(VOLUME_WINDOW)
+    df_vectors = compute_features(df_raw, volume_stats)
+    # Снимок окна объёма для инкрементального и потокового расчёта
+    volume_stats.save(config.artifact_path("volume_state", settings))
 
     # Показываем прогресс сохранения (одна "итерация" — весь процесс)
-    with tqdm(total=1, desc="Saving to pickle", unit="file") as pbar:
+    with tqdm(total=1, desc="Saving to pickle", unit="file") as pbar, run_profiler.stage("save_pickle"):
         df_vectors.to_pickle(PKL_OUT)
         pbar.update(1)
 
     print(f"Saved {len(df_vectors)} rows to {PKL_OUT}")
+    cache.store(key, outputs)
 
 if __name__ == "__main__":
-    main()
+    profiler = set_profiler(RunProfiler.from_settings(config.load_settings(), "minute_vectors"))
+    try:
+        main()
+    finally:
+        profiler.write_report()
@@ -4,27 +4,18 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-import yaml
 
-# Путь к settings.yaml в той же директории, что и скрипт
-SETTINGS_FILE = Path(__file__).parent / "settings.yaml"
-
-# Чтение настроек
-with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-    settings = yaml.safe_load(f)
+import config
+import minutes_bars_to_vectors_pkl
+import run_profiler
+from artifact_cache import ArtifactCache, db_fingerprint, hash_key, source_fingerprint
+from data_quality import excluded_days, load_day_quality
+from run_profiler import RunProfiler, set_profiler
+from vector_codec import encode_day
 
 # ==== Параметры ====
-ticker = settings['ticker']
-
-# Путь к файлам и БД
-PKL_MINUTE = fr"{ticker}_futures_minute_2015_vectors.pkl"
-DB_PATH = Path(settings['path_db_minute'].replace('{ticker}', ticker))
-PKL_DAILY = fr"{ticker}_futures_daily_vectors.pkl"
 TABLE_NAME = "Futures"  # имя таблицы в БД
 
-# Регистрируем tqdm для pandas
-tqdm.pandas()
-
 def load_minute_vectors(pkl_path: str) -> pd.DataFrame:
     """
     Загружаем df с колонками:
@@ -37,20 +28,26 @@ def load_minute_vectors(pkl_path: str) -> pd.DataFrame:
     return df
 
 
-def load_ohlc_from_sqlite(db_path: str, table_name: str) -> pd.DataFrame:
+def load_ohlc_from_sqlite(db_path: str, table_name: str, since=None) -> pd.DataFrame:
     """
     Загружаем исходные минутные OHLC из SQLite для вычисления BODY.
+    since — дата, с которой загружать бары (None — вся история).
     """
     conn = sqlite3.connect(db_path)
+    where = "WHERE TRADEDATE >= ?" if since is not None else ""
+    params = (pd.Timestamp(since).strftime("%Y-%m-%d"),) if since is not None else ()
     query = f"""
         SELECT
             TRADEDATE,
             OPEN,
             CLOSE
         FROM {table_name}
+        {where}
         ORDER BY TRADEDATE
     """
-    df = pd.read_sql_query(query, conn, parse_dates=["TRADEDATE"])
+    with run_profiler.stage("load_ohlc_from_sqlite") as st:
+        df = pd.read_sql_query(query, conn, params=params, parse_dates=["TRADEDATE"])
+        st.add("rows", len(df))
     conn.close()
     return df
 
@@ -61,6 +58,14 @@ def compute_daily_body(df_ohlc: pd.DataFrame) -> pd.DataFrame:
     Возвращает DataFrame с колонками:
         TRADEDATE (date), BODY (float)
     """
+    with run_profiler.stage("compute_daily_body") as st:
+        df_body = _compute_daily_body(df_ohlc)
+        st.add("rows", len(df_ohlc))
+        st.add("days", len(df_body))
+    return df_body
+
+
+def _compute_daily_body(df_ohlc: pd.DataFrame) -> pd.DataFrame:
     df_ohlc = df_ohlc.copy()
     df_ohlc["DATE"] = df_ohlc["TRADEDATE"].dt.date
 
@@ -87,14 +92,26 @@ def compute_daily_body(df_ohlc: pd.DataFrame) -> pd.DataFrame:
     return df_body
 
 
-def build_daily_vectors(df_minute: pd.DataFrame) -> pd.DataFrame:
+def build_daily_vectors(df_minute: pd.DataFrame, storage: str = 'float32', skip_days: set = None) -> pd.DataFrame:
     """
     Группируем минутные вектора по дате и склеиваем в большие массивы.
     На входе:
         TRADEDATE (datetime), VECTORS (np.array)
     На выходе:
         TRADEDATE (date), VECTORS (np.array shape [N_day, dim])
+    storage — кодировка матриц дня (float32, float16, q16, q8; см. vector_codec.py).
+    skip_days — даты (date), для которых матрица не строится (VECTORS = None): дни, исключённые
+    по качеству данных (quality_exclude), в схожесть не попадают и не загружаются ею.
     """
+    with run_profiler.stage("build_daily_vectors") as st:
+        df_daily = _build_daily_vectors(df_minute, storage, skip_days or set())
+        st.add("rows", len(df_minute))
+        st.add("days", len(df_daily))
+        st.add("vector_bytes", int(sum(m.nbytes for m in df_daily["VECTORS"] if m is not None)))
+    return df_daily
+
+
+def _build_daily_vectors(df_minute: pd.DataFrame, storage: str, skip_days: set) -> pd.DataFrame:
     df = df_minute.copy()
     df["DATE"] = df["TRADEDATE"].dt.date
 
@@ -103,51 +120,93 @@ def build_daily_vectors(df_minute: pd.DataFrame) -> pd.DataFrame:
 
     daily_records = []
     for date, g in tqdm(groups, desc="Building daily vectors"):
+        if date in skip_days:
+            daily_records.append((date, None))
+            continue
         # g["VECTORS"] — это Series из np.array одинаковой длины (dim=7)
         vectors_list = g["VECTORS"].tolist()
         # склеиваем по оси 0 -> (N_day, dim)
-        day_matrix = np.stack(vectors_list, axis=0).astype(np.float32)
+        day_matrix = encode_day(np.stack(vectors_list, axis=0).astype(np.float32), storage)
         daily_records.append((date, day_matrix))
 
     df_daily = pd.DataFrame(daily_records, columns=["TRADEDATE", "VECTORS"])
     return df_daily
 
 
-def main():
+def merge_daily_body(df_daily_vectors: pd.DataFrame, df_body: pd.DataFrame) -> pd.DataFrame:
+    """
+    Мёрджит дневные VECTORS и BODY по дате и добавляет NEXT_BODY.
+    """
+    # df_daily_vectors.TRADEDATE и df_body.TRADEDATE — тип date
+    df_daily = pd.merge(
+        df_daily_vectors,
+        df_body,
+        on="TRADEDATE",
+        how="inner",
+        validate="one_to_one",
+    )
+
+    # NEXT_BODY — BODY со сдвигом вверх на 1 день
+    df_daily = df_daily.sort_values("TRADEDATE").reset_index(drop=True)
+    df_daily["NEXT_BODY"] = df_daily["BODY"].shift(-1)
+    return df_daily
+
+
+def artifact_key(settings: dict = None) -> str:
+    """Ключ кэша дневных векторов: ключ минутных векторов, OHLC из БД (BODY) и код расчёта."""
+    return hash_key(
+        "daily_vectors",
+        minutes_bars_to_vectors_pkl.artifact_key(settings),
+        db_fingerprint(config.db_path(settings), config.bars_table(settings)),
+        source_fingerprint(__file__, Path(__file__).with_name("vector_codec.py")),
+        vector_storage=config.get_settings(settings).get('vector_storage', 'float32'),
+        quality_exclude=config.get_settings(settings).get('quality_exclude', False),
+    )
+
+
+def main(settings: dict = None):
+    # Путь к файлам и БД
+    PKL_MINUTE = config.artifact_path("minute_vectors", settings)
+    DB_PATH = config.db_path(settings)
+    PKL_DAILY = config.artifact_path("daily_vectors", settings)
+
     # Проверки
     if not Path(PKL_MINUTE).exists():
         raise FileNotFoundError(f"Minute vectors pkl not found: {PKL_MINUTE}")
     if not Path(DB_PATH).exists():
         raise FileNotFoundError(f"Database not found: {DB_PATH}")
 
+    cache = ArtifactCache.from_settings(settings)
+    key = artifact_key(settings)
+    if cache.fetch(key, {"daily_vectors": PKL_DAILY}):
+        print(f"{PKL_DAILY} is up to date (cache key {key}), skipping")
+        return
+
     # 1. Загружаем минутные вектора
     df_minute = load_minute_vectors(PKL_MINUTE)
 
-    # 2. Строим дневные массивы VECTORS
-    df_daily_vectors = build_daily_vectors(df_minute)
+    # 2. Строим дневные массивы VECTORS (без матриц дней, исключённых по качеству данных)
+    storage = config.get_settings(settings).get('vector_storage', 'float32')
+    skip_days = (excluded_days(load_day_quality(settings))
+                 if config.get_settings(settings).get('quality_exclude', False) else None)
+    df_daily_vectors = build_daily_vectors(df_minute, storage, skip_days)
 
     # 3. Загружаем OHLC для вычисления дневного BODY
-    df_ohlc = load_ohlc_from_sqlite(DB_PATH, TABLE_NAME)
+    df_ohlc = load_ohlc_from_sqlite(DB_PATH, config.bars_table(settings))
     df_body = compute_daily_body(df_ohlc)
 
-    # 4. Мёрджим дневные VECTORS и BODY по дате
-    # df_daily_vectors.TRADEDATE и df_body.TRADEDATE — тип date
-    df_daily = pd.merge(
-        df_daily_vectors,
-        df_body,
-        on="TRADEDATE",
-        how="inner",
-        validate="one_to_one",
-    )
-
-    # 5. Добавляем NEXT_BODY (BODY со сдвигом вверх на 1 день)
-    df_daily = df_daily.sort_values("TRADEDATE").reset_index(drop=True)
-    df_daily["NEXT_BODY"] = df_daily["BODY"].shift(-1)
+    # 4-5. Мёрджим дневные VECTORS и BODY, добавляем NEXT_BODY
+    df_daily = merge_daily_body(df_daily_vectors, df_body)
 
     # 6. Сохраняем результат
     df_daily.to_pickle(PKL_DAILY)
     print(f"Saved daily dataframe with {len(df_daily)} rows to {PKL_DAILY}")
+    cache.store(key, {"daily_vectors": PKL_DAILY})
 
 
 if __name__ == "__main__":
-    main()
+    profiler = set_profiler(RunProfiler.from_settings(config.load_settings(), "daily_vectors"))
+    try:
+        main()
+    finally:
+        profiler.write_report()
@@ -0,0 +1,234 @@
+"""
+Режим вне памяти: минутные бары -> дневные векторы -> схожесть одним проходом по дням в порядке дат.
+Бары читаются из SQLite порциями по out_of_core_chunk_rows строк, окно объёма переносится между порциями,
+готовые дни дописываются в дневное хранилище на диске, а схожесть считается блоками по скользящему окну
+из MAX_WINDOW предыдущих дней и дней блока. В памяти одновременно только порция баров и окно дней,
+поэтому расход памяти не зависит от длины истории; растёт лишь таблица схожести (MAX_n на день).
+
+Дневное хранилище — непрерывный файл значений {ticker}_daily_store.bin (кодировка vector_storage)
+и JSON-индекс со смещениями дней, датами, BODY и NEXT_BODY (как pack_days в dtw_engine.py):
+матрица дня i — values[offsets[i]:offsets[i + 1]], см. load_day_store.
+Прерванный проход продолжается по контрольной точке схожести: бары перечитываются, признаки и дневное
+хранилище строятся заново (файл .bin перезаписывается), не повторяется только DTW дней из контрольной точки.
+Таблица качества дней (data_quality.py) строится тем же проходом; исключённые дни пишутся в хранилище,
+но в окно схожести не попадают.
+"""
+
+import json
+import sqlite3
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import data_processing_similarity
+import run_profiler
+from artifact_cache import ArtifactCache, hash_key, source_fingerprint
+from data_quality import QUALITY_COLUMNS, compute_day_quality, quality_params
+from data_processing_similarity import (
+    CHECKPOINT_EVERY, MAX_WINDOW, MIN_WINDOW, SimilarityCheckpoint, compute_similarity, prepare_daily_vectors)
+from minutes_bars_to_vectors_pkl import VOLUME_WINDOW, compute_features
+from rolling_stats import RollingVolumeStats
+from run_profiler import RunProfiler, set_profiler
+from similarity_metrics import metric_settings
+from vector_codec import encode_day
+
+# Строк баров в одной порции чтения из БД
+CHUNK_ROWS = 200_000
+
+
+def iter_days(db_path, table_name: str, storage: str = 'float32', chunk_rows: int = CHUNK_ROWS,
+              volume_stats: RollingVolumeStats = None, quality: dict = None):
+    """
+    Генератор дней (дата, матрица дня в кодировке storage, BODY, строка таблицы качества,
+    минуты от полуночи каждого бара) в порядке дат.
+    Признаки считаются по порциям с переносом окна объёма, поэтому совпадают с расчётом по всей истории;
+    качество — по готовым дням порции; правилам на границе дня (ROLL, JUMP) передаётся последний бар
+    предыдущего готового дня, поэтому таблица та же, что по всей истории.
+    """
+    if volume_stats is None:
+        volume_stats = RollingVolumeStats(VOLUME_WINDOW)
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(
+            f"SELECT TRADEDATE, SECID, OPEN, LOW, HIGH, CLOSE, VOLUME FROM {table_name} ORDER BY TRADEDATE"
+        )
+        columns = [d[0] for d in cursor.description]
+        pending = None  # бары незавершённого дня из предыдущей порции (с признаками)
+        previous = None  # последний бар уже выданных дней
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            df = pd.DataFrame(rows, columns=columns)
+            df["TRADEDATE"] = pd.to_datetime(df["TRADEDATE"])
+            df["VECTORS"] = compute_features(df, volume_stats)["VECTORS"]
+            run_profiler.count("bars", len(df))
+            if pending is not None:
+                df = pd.concat([pending, df], ignore_index=True)
+            dates = df["TRADEDATE"].dt.date
+            last_date = dates.iloc[-1]
+            pending = df[dates == last_date]
+            ready = df[dates != last_date]
+            yield from _split_days(ready, storage, quality, previous)
+            if not ready.empty:
+                previous = ready.tail(1)
+        if pending is not None:
+            yield from _split_days(pending, storage, quality, previous)
+    finally:
+        conn.close()
+
+
+def _split_days(df: pd.DataFrame, storage: str, quality: dict = None, previous: pd.DataFrame = None):
+    if df.empty:
+        return
+    df_quality = compute_day_quality(df, quality, previous).set_index("TRADEDATE")
+    for date, g in df.groupby(df["TRADEDATE"].dt.date, sort=True):
+        matrix = encode_day(np.stack(g["VECTORS"].tolist(), axis=0).astype(np.float32), storage)
+        minutes = (g["TRADEDATE"].dt.hour * 60 + g["TRADEDATE"].dt.minute).to_numpy(dtype=np.int16)
+        yield date, matrix, float(g["CLOSE"].iloc[-1] - g["OPEN"].iloc[0]), df_quality.loc[date], minutes
+
+
+class DayStore:
+    """Дневное хранилище: значения дней дописываются в .bin, индекс пишется в JSON при закрытии."""
+
+    def __init__(self, values_path, index_path):
+        self.values_path = Path(values_path)
+        self.index_path = Path(index_path)
+        self.file = open(self.values_path, 'wb')
+        self.index = {'dtype': None, 'dim': None, 'offsets': [0], 'dates': [], 'body': [], 'next_body': []}
+
+    def append(self, date, matrix: np.ndarray, body: float) -> None:
+        self.index['dtype'] = str(matrix.dtype)
+        self.index['dim'] = int(matrix.shape[1])
+        self.file.write(np.ascontiguousarray(matrix).tobytes())
+        self.index['offsets'].append(self.index['offsets'][-1] + len(matrix))
+        self.index['dates'].append(date.isoformat())
+        if self.index['body']:
+            self.index['next_body'][-1] = body
+        self.index['body'].append(body)
+        self.index['next_body'].append(None)
+
+    def close(self) -> None:
+        self.file.close()
+        self.index_path.write_text(json.dumps(self.index), encoding='utf-8')
+
+
+def load_day_store(settings: dict = None) -> tuple:
+    """Значения дневного хранилища как read-only memmap (строки, dim), смещения дней и индекс."""
+    index = json.loads(config.artifact_path("day_store_index", settings).read_text(encoding='utf-8'))
+    offsets = np.asarray(index['offsets'], dtype=np.int64)
+    if index['dtype'] is None:
+        return np.zeros((0, 0)), offsets, index
+    values = np.memmap(config.artifact_path("day_store", settings), dtype=index['dtype'], mode='r',
+                       shape=(int(offsets[-1]), index['dim']))
+    return values, offsets, index
+
+
+def run_out_of_core(db_path, table_name: str, store: DayStore, checkpoint: SimilarityCheckpoint,
+                    storage: str = 'float32', chunk_rows: int = CHUNK_ROWS, block: int = CHECKPOINT_EVERY,
+                    metric: str = 'dtw', metric_params: dict = None,
+                    min_window: int = MIN_WINDOW, max_window: int = MAX_WINDOW,
+                    quality: dict = None, exclude: bool = False) -> tuple:
+    """
+    Проход по дням: каждый день пишется в store, схожесть дня считается, когда известен его NEXT_BODY
+    (пришёл следующий день). В окне — не больше max_window + block дней.
+    exclude — дни с EXCLUDE в таблице качества не попадают в окно (их матрицы не декодируются).
+    Возвращает (таблица схожести TRADEDATE, MAX_n; таблица качества дней).
+    """
+    window = deque(maxlen=max_window + block)  # (TRADEDATE, VECTORS, NEXT_BODY) дней схожести
+    ready = 0  # дней в конце окна, для которых ещё не посчитана схожесть
+    previous = None  # (TRADEDATE, VECTORS, EXCLUDE) дня, ждущего свой NEXT_BODY
+    quality_rows = []
+    parts = []  # строки схожести блоков; даты приведены compute_similarity, как в стадии similarity
+
+    def flush_block():
+        df = prepare_daily_vectors(pd.DataFrame(list(window), columns=["TRADEDATE", "VECTORS", "NEXT_BODY"]),
+                                   dropna=False)
+        parts.append(compute_similarity(df, min_window, max_window, start=len(df) - ready, checkpoint=checkpoint,
+                                        metric=metric, metric_params=metric_params))
+
+    with run_profiler.stage("out_of_core") as st:
+        for date, matrix, body, day_quality, _ in iter_days(db_path, table_name, storage, chunk_rows, quality=quality):
+            store.append(date, matrix, body)
+            quality_rows.append(day_quality)
+            if previous is not None and not (exclude and previous[2]):
+                window.append((previous[0], previous[1], body))
+                ready += 1
+                if ready == block:
+                    flush_block()
+                    st.add("similarity_days", ready)
+                    ready = 0
+            previous = (date, matrix, bool(day_quality["EXCLUDE"]))
+        if ready:
+            flush_block()
+            st.add("similarity_days", ready)
+        st.add("days", len(quality_rows))
+    df_rez = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    if not quality_rows:
+        return df_rez, pd.DataFrame(columns=QUALITY_COLUMNS)
+    df_quality = pd.DataFrame(quality_rows)
+    df_quality.index.name = "TRADEDATE"
+    return df_rez, df_quality.reset_index()[QUALITY_COLUMNS]
+
+
+def artifact_key(settings: dict = None) -> str:
+    """Ключ кэша: ключ схожести стадии similarity (результат тот же) и код прохода."""
+    return hash_key(
+        "out_of_core",
+        data_processing_similarity.artifact_key(settings),
+        source_fingerprint(__file__),
+    )
+
+
+def main(settings: dict = None):
+    settings = config.get_settings(settings)
+    DB_PATH = config.db_path(settings)
+    if not Path(DB_PATH).exists():
+        raise FileNotFoundError(f"Database not found: {DB_PATH}")
+    outputs = {kind: config.artifact_path(kind, settings)
+               for kind in ("similarity", "day_store", "day_store_index", "day_quality")}
+
+    cache = ArtifactCache.from_settings(settings)
+    key = artifact_key(settings)
+    if cache.fetch(key, outputs):
+        print(f"{outputs['similarity']} is up to date (cache key {key}), skipping")
+        return
+
+    # Контрольная точка общая со стадией similarity: тот же ключ входов, те же строки
+    checkpoint = SimilarityCheckpoint(
+        config.artifact_path("similarity_checkpoint", settings), data_processing_similarity.artifact_key(settings),
+        every=settings.get('similarity_checkpoint_every', CHECKPOINT_EVERY),
+    )
+    if checkpoint.rows:
+        print(f"Resuming from checkpoint: {len(checkpoint.rows)} days already computed")
+
+    metric, metric_params = metric_settings(settings)
+    store = DayStore(outputs["day_store"], outputs["day_store_index"])
+    try:
+        df_rez, df_quality = run_out_of_core(
+            DB_PATH, config.bars_table(settings), store, checkpoint,
+            storage=settings.get('vector_storage', 'float32'),
+            chunk_rows=settings.get('out_of_core_chunk_rows', CHUNK_ROWS),
+            block=checkpoint.every, metric=metric, metric_params=metric_params,
+            quality=quality_params(settings), exclude=settings.get('quality_exclude', False),
+        )
+    finally:
+        store.close()
+    df_quality.to_pickle(outputs["day_quality"])
+    print(f"Day quality: {int(df_quality['EXCLUDE'].sum())} of {len(df_quality)} days excluded")
+
+    df_rez.to_pickle(outputs["similarity"])
+    print(f"df_rez with {len(df_rez)} rows saved to {outputs['similarity']}")
+    cache.store(key, outputs)
+    checkpoint.remove()
+
+
+if __name__ == "__main__":
+    profiler = set_profiler(RunProfiler.from_settings(config.load_settings(), "out_of_core"))
+    try:
+        main()
+    finally:
+        profiler.write_report()
@@ -0,0 +1,189 @@
+"""
+Графики отчёта по кумулятивным суммам MAX_n.
+Все кривые считаются одним np.cumsum по матрице (дни, окна), перед отрисовкой прореживаются
+до plot_max_points точек (min/max по корзинам или LTTB) и рисуются через Figure + Agg без pyplot,
+поэтому рендер не зависит от GUI и безопасен в дочерних процессах.
+Пакетный режим строит графики для многих файлов схожести (тикеры, конфигурации прогона) параллельно.
+
+Пример:
+    python plot_report.py RTS_dtw_similarity_weights.pkl runs/*.pkl --out-dir reports --workers 8
+"""
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import run_profiler
+
+# Число точек на кривую после прореживания
+MAX_POINTS = 2000
+
+
+def cumsum_curves(df: pd.DataFrame) -> tuple:
+    """Даты, имена MAX_ колонок и матрица их кумулятивных сумм (дни, окна) одной операцией."""
+    columns = [col for col in df.columns if col.startswith('MAX_')]
+    curves = np.cumsum(df[columns].to_numpy(dtype=float), axis=0)
+    return df['TRADEDATE'].to_numpy(), columns, curves
+
+
+def minmax_indices(curves: np.ndarray, max_points: int = MAX_POINTS) -> np.ndarray:
+    """
+    Индексы точек min/max-прореживания для всех кривых сразу: (число точек, число кривых).
+    В каждой корзине сохраняются минимум и максимум, поэтому выбросы не теряются.
+    """
+    n = len(curves)
+    if n <= max_points:
+        return np.repeat(np.arange(n)[:, None], curves.shape[1], axis=1)
+    n_buckets = max(1, (max_points - 2) // 2)
+    size = -(-n // n_buckets)
+    padded = np.concatenate([curves, np.repeat(curves[-1:], n_buckets * size - n, axis=0)])
+    buckets = padded.reshape(n_buckets, size, -1)
+    offsets = (np.arange(n_buckets) * size)[:, None]
+    idx = np.concatenate([
+        np.zeros((1, curves.shape[1]), dtype=np.int64),
+        np.minimum(buckets.argmin(axis=1) + offsets, n - 1),
+        np.minimum(buckets.argmax(axis=1) + offsets, n - 1),
+        np.full((1, curves.shape[1]), n - 1, dtype=np.int64),
+    ])
+    return np.sort(idx, axis=0)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int = MAX_POINTS) -> np.ndarray:
+    """Индексы точек Largest-Triangle-Three-Buckets для одной кривой (сохраняет форму линии)."""
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    idx = np.empty(max_points, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            avg_x, avg_y = x[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+def decimate(dates: np.ndarray, curves: np.ndarray, max_points: int = MAX_POINTS, method: str = 'minmax') -> list:
+    """Список (даты, значения) по каждой кривой после прореживания методом minmax или lttb."""
+    if method == 'minmax':
+        idx = minmax_indices(curves, max_points)
+        return [(dates[idx[:, k]], curves[idx[:, k], k]) for k in range(curves.shape[1])]
+    if method == 'lttb':
+        x = dates.astype('datetime64[s]').astype(np.float64)
+        result = []
+        for k in range(curves.shape[1]):
+            idx = lttb_indices(x, curves[:, k], max_points)
+            result.append((dates[idx], curves[idx, k]))
+        return result
+    raise ValueError(f"Неизвестный метод прореживания: {method}")
+
+
+def render_curves(series: list, labels: list, title: str, output_plot: Path,
+                  figsize=(24, 12), xlabel: str = 'Дата', ylabel: str = 'Кумулятивная сумма') -> Path:
+    """Рисует кривые на Figure с бэкендом Agg (без pyplot и глобального состояния) и сохраняет PNG."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize)
+    ax = fig.add_subplot()
+    for (x, y), label in zip(series, labels):
+        ax.plot(x, y, label=label)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if any(labels):
+        ax.legend()
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(output_plot)
+    return Path(output_plot)
+
+
+def plot_cumsum_report(df: pd.DataFrame, ticker: str, output_plot: Path, top: int = None,
+                       max_points: int = MAX_POINTS, method: str = 'minmax') -> Path:
+    """
+    График кумулятивных сумм MAX_ колонок; top — только top колонок с наибольшим значением на последней дате.
+    """
+    with run_profiler.stage("plotting") as st:
+        dates, columns, curves = cumsum_curves(df)
+        if top is not None:
+            order = np.argsort(-curves[-1], kind='stable')[:top]
+            curves = curves[:, order]
+            columns = [columns[k] for k in order]
+            labels = [f"{col} (финал: {curves[-1, k]:.2f})" for k, col in enumerate(columns)]
+            title = f'Топ-{top} кумулятивных сумм по доходности на конец периода — {ticker}'
+        else:
+            labels = columns
+            title = f'Кумулятивные суммы для {ticker}'
+        series = decimate(dates, curves, max_points, method)
+        st.add("points", int(sum(len(x) for x, _ in series)))
+        render_curves(series, labels, title, output_plot)
+    return Path(output_plot)
+
+
+def _render_job(job: dict) -> list:
+    """Один файл схожести -> графики всех кривых и топ-5 (выполняется в дочернем процессе)."""
+    from sum_graph import load_similarity_weights
+
+    df = load_similarity_weights(job['similarity'])
+    out_dir = Path(job['out_dir'])
+    name = job['name']
+    return [
+        plot_cumsum_report(df, job['ticker'], out_dir / f"{name}_cumsum_plot.png",
+                           max_points=job['max_points'], method=job['method']),
+        plot_cumsum_report(df, job['ticker'], out_dir / f"{name}_cumsum_top5_plot.png", top=5,
+                           max_points=job['max_points'], method=job['method']),
+    ]
+
+
+def render_batch(similarity_files, out_dir, ticker: str, workers: int = None,
+                 max_points: int = MAX_POINTS, method: str = 'minmax') -> list:
+    """Строит графики для набора файлов схожести параллельно в workers процессах; возвращает пути PNG."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [
+        {'similarity': str(path), 'out_dir': str(out_dir), 'name': Path(path).stem, 'ticker': ticker,
+         'max_points': max_points, 'method': method}
+        for path in similarity_files
+    ]
+    workers = workers or os.cpu_count()
+    with run_profiler.stage("plot_batch") as st:
+        if workers == 1 or len(jobs) == 1:
+            results = [_render_job(job) for job in jobs]
+        else:
+            # spawn, а не fork: родитель мог уже запустить потоки numba/BLAS, копия их блокировок в fork-потомке
+            # подвешивает завершение процесса
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                results = list(pool.map(_render_job, jobs))
+        st.add("charts", sum(len(paths) for paths in results))
+    return [path for paths in results for path in paths]
+
+
+def main():
+    settings = config.load_settings()
+    parser = argparse.ArgumentParser(description="Пакетная отрисовка графиков кумулятивных сумм MAX_n")
+    parser.add_argument('similarity', nargs='+', help="pkl файлы схожести (TRADEDATE, MAX_n)")
+    parser.add_argument('--out-dir', default='reports', help="Каталог для PNG")
+    parser.add_argument('--ticker', default=settings['ticker'])
+    parser.add_argument('--workers', type=int, default=None, help="Число процессов (по умолчанию — все ядра)")
+    parser.add_argument('--max-points', type=int, default=settings.get('plot_max_points', MAX_POINTS))
+    parser.add_argument('--method', choices=('minmax', 'lttb'), default=settings.get('plot_decimation', 'minmax'))
+    args = parser.parse_args()
+
+    paths = render_batch(args.similarity, args.out_dir, args.ticker, args.workers, args.max_points, args.method)
+    print(f"Построено графиков: {len(paths)} в {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
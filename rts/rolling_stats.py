@@ -0,0 +1,380 @@
+"""
+Онлайн скользящие среднее и стандартное отклонение объёма (кольцевой буфер + Уэлфорд).
+Повторяет арифметику pandas Series.rolling(window, min_periods=1).mean() / .std(ddof=0)
+(суммирование Кэхэна для среднего, Уэлфорд с компенсацией и пересчётом окна при потере точности
+для дисперсии), поэтому результаты совпадают с pandas бит в бит.
+Один и тот же объект используется пакетным расчётом признаков, демоном и потоковым режимом.
+Пакеты баров (extend) считаются ядром numba с той же арифметикой, что у update, поэтому пакеты,
+продолжения окна (демон, режим вне памяти) и снимки совпадают с pandas по всей истории бит в бит;
+в потоковом режиме каждый бар нормализуется за O(1) (update). Состояние сохраняется в JSON и продолжается
+с того же места без повторного чтения предыдущих баров из SQLite.
+Без numba пакет считается pandas rolling по хвосту окна и пакету, а состояние переснимается с последних
+window значений: пакет с пустого окна совпадает с pandas бит в бит, продолжение отличается от pandas по всей
+истории только накопленной погрешностью самого pandas (относительно ~1e-9, на порядок ниже точности float32
+векторов признаков).
+"""
+
+import json
+import math
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+except ImportError:  # пакеты считаются pandas rolling
+    njit = None
+
+# Порог потери точности дисперсии, как в pandas (_libs/window/aggregations.pyx)
+INV_COND_TOL = np.finfo(np.float64).eps * 1e3
+
+# Поля состояния, которые ядро extend получает и возвращает массивом float64 (целые и bool — точно)
+KERNEL_FIELDS = (
+    'm_nobs', 'm_sum', 'm_neg_ct', 'm_comp_add', 'm_comp_remove', 'm_same', 'm_prev',
+    'v_nobs', 'v_mean', 'v_ssqdm', 'v_comp_add', 'v_comp_remove', 'v_unstable',
+)
+_INT_FIELDS = ('m_nobs', 'm_neg_ct', 'm_same')
+
+# Поля состояния, сохраняемые в снимок
+STATE_FIELDS = (
+    'window', 'count', 'last_tradedate',
+    'm_nobs', 'm_sum', 'm_neg_ct', 'm_comp_add', 'm_comp_remove', 'm_same', 'm_prev',
+    'v_nobs', 'v_mean', 'v_ssqdm', 'v_comp_add', 'v_comp_remove', 'v_unstable',
+)
+
+
+class RollingVolumeStats:
+    """
+    Скользящие mean/std(ddof=0) с окном window и min_periods=1.
+    update(value) добавляет значение и возвращает (mean, std) для окна, оканчивающегося на нём.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.buffer = deque(maxlen=window)
+        self.count = 0  # сколько значений обработано всего
+        self.last_tradedate = None  # метка последнего бара (для проверки снимка)
+        # состояние среднего
+        self.m_nobs = 0
+        self.m_sum = 0.0
+        self.m_neg_ct = 0
+        self.m_comp_add = 0.0
+        self.m_comp_remove = 0.0
+        self.m_same = 0
+        self.m_prev = math.nan
+        # состояние дисперсии
+        self.v_nobs = 0.0
+        self.v_mean = 0.0
+        self.v_ssqdm = 0.0
+        self.v_comp_add = 0.0
+        self.v_comp_remove = 0.0
+        self.v_unstable = False
+
+    # ==== Среднее (roll_mean) ====
+
+    def _add_mean(self, val: float) -> None:
+        if val == val:
+            self.m_nobs += 1
+            y = val - self.m_comp_add
+            t = self.m_sum + y
+            self.m_comp_add = t - self.m_sum - y
+            self.m_sum = t
+            if math.copysign(1.0, val) < 0:
+                self.m_neg_ct += 1
+            if val == self.m_prev:
+                self.m_same += 1
+            else:
+                self.m_same = 1
+            self.m_prev = val
+
+    def _remove_mean(self, val: float) -> None:
+        if val == val:
+            self.m_nobs -= 1
+            y = -val - self.m_comp_remove
+            t = self.m_sum + y
+            self.m_comp_remove = t - self.m_sum - y
+            self.m_sum = t
+            if math.copysign(1.0, val) < 0:
+                self.m_neg_ct -= 1
+
+    def _calc_mean(self) -> float:
+        if self.m_nobs >= 1:
+            result = self.m_sum / self.m_nobs
+            if self.m_same >= self.m_nobs:
+                result = self.m_prev
+            elif self.m_neg_ct == 0 and result < 0:
+                result = 0.0
+            elif self.m_neg_ct == self.m_nobs and result > 0:
+                result = 0.0
+            return result
+        return math.nan
+
+    # ==== Дисперсия (roll_var) ====
+
+    def _add_var(self, val: float) -> None:
+        if val != val:
+            return
+        prev_m2 = self.v_ssqdm
+        self.v_nobs += 1
+        prev_mean = self.v_mean - self.v_comp_add
+        y = val - self.v_comp_add
+        t = y - self.v_mean
+        self.v_comp_add = t + self.v_mean - y
+        self.v_mean = self.v_mean + t / self.v_nobs
+        self.v_ssqdm = self.v_ssqdm + (val - prev_mean) * (val - self.v_mean)
+        if prev_m2 * INV_COND_TOL > self.v_ssqdm:
+            self.v_unstable = True
+
+    def _remove_var(self, val: float) -> None:
+        if val == val:
+            prev_m2 = self.v_ssqdm
+            self.v_nobs -= 1
+            if self.v_nobs:
+                prev_mean = self.v_mean - self.v_comp_remove
+                y = val - self.v_comp_remove
+                t = y - self.v_mean
+                self.v_comp_remove = t + self.v_mean - y
+                self.v_mean = self.v_mean - t / self.v_nobs
+                self.v_ssqdm = self.v_ssqdm - (val - prev_mean) * (val - self.v_mean)
+                if prev_m2 * INV_COND_TOL > self.v_ssqdm:
+                    self.v_unstable = True
+            else:
+                self.v_mean = 0.0
+                self.v_ssqdm = 0.0
+                self.v_unstable = False
+
+    def _recompute_var(self) -> None:
+        """Пересчёт дисперсии по текущему окну (первое окно или потеря точности)."""
+        self.v_mean = self.v_ssqdm = self.v_nobs = 0.0
+        self.v_comp_add = self.v_comp_remove = 0.0
+        for val in self.buffer:
+            self._add_var(val)
+        self.v_unstable = False
+
+    def _calc_std(self) -> float:
+        if self.v_nobs >= 1:
+            var = self.v_ssqdm / self.v_nobs
+            return math.sqrt(var) if var >= 0 else 0.0
+        return math.nan
+
+    # ==== Публичный интерфейс ====
+
+    def update(self, value) -> tuple:
+        """Добавляет значение и возвращает (mean, std) окна."""
+        val = float(value)
+        first = self.count == 0
+        removed = self.buffer[0] if len(self.buffer) == self.window else None
+        self.buffer.append(val)
+
+        if first:
+            self.m_prev = val
+            self.m_same = 0
+        if removed is not None:
+            self._remove_mean(removed)
+        self._add_mean(val)
+
+        if not first:
+            if removed is not None:
+                self._remove_var(removed)
+            self._add_var(val)
+        if first or self.v_unstable:
+            self._recompute_var()
+
+        self.count += 1
+        return self._calc_mean(), self._calc_std()
+
+    def normalize(self, value) -> float:
+        """z-score значения по окну, включающему его; 0 при нулевом или неопределённом std."""
+        mean, std = self.update(value)
+        if std == 0 or std != std:
+            return 0.0
+        return (float(value) - mean) / std
+
+    def extend(self, values) -> tuple:
+        """
+        Обрабатывает пакет значений и возвращает массивы mean и std (как run).
+        С numba — ядром _extend_kernel (проход update по хвосту буфера и пакету в машинном коде).
+        Без numba окно считается pandas rolling по хвосту буфера и пакету, затем состояние update
+        переснимается проходом по последним window значениям.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return np.empty(0), np.empty(0)
+        head = len(self.buffer)
+        series = np.concatenate([np.asarray(self.buffer, dtype=np.float64), values])
+        if njit is not None:
+            state = np.array([getattr(self, field) for field in KERNEL_FIELDS], dtype=np.float64)
+            means = np.empty(len(values))
+            stds = np.empty(len(values))
+            _extend_kernel(series, head, self.window, self.count == 0, state, means, stds)
+            for field, value in zip(KERNEL_FIELDS, state.tolist()):
+                setattr(self, field, int(value) if field in _INT_FIELDS else value)
+            self.v_unstable = bool(self.v_unstable)
+            self.buffer.extend(values[-self.window:].tolist())
+            self.count += len(values)
+            return means, stds
+
+        series = pd.Series(series)
+        rolling = series.rolling(self.window, min_periods=1)
+        means = rolling.mean().to_numpy()[head:]
+        stds = rolling.std(ddof=0).to_numpy()[head:]
+
+        seeded = RollingVolumeStats(self.window)
+        seeded.run(series.to_numpy()[-self.window:])
+        count, last_tradedate = self.count + len(values), self.last_tradedate
+        self.__dict__.update(seeded.__dict__)
+        self.count, self.last_tradedate = count, last_tradedate
+        return means, stds
+
+    def run(self, values):
+        """Обрабатывает массив значений по одному (update), возвращает массивы mean и std."""
+        values = np.asarray(values, dtype=np.float64)
+        means = np.empty(len(values))
+        stds = np.empty(len(values))
+        update = self.update
+        for i, val in enumerate(values.tolist()):
+            means[i], stds[i] = update(val)
+        return means, stds
+
+    # ==== Снимок состояния ====
+
+    def to_state(self) -> dict:
+        state = {field: getattr(self, field) for field in STATE_FIELDS}
+        state['buffer'] = list(self.buffer)
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'RollingVolumeStats':
+        stats = cls(state['window'])
+        for field in STATE_FIELDS:
+            setattr(stats, field, state[field])
+        stats.buffer.extend(state['buffer'])
+        return stats
+
+    def save(self, path) -> Path:
+        """Сохраняет снимок состояния в JSON (float сохраняются без потери точности)."""
+        path = Path(path)
+        path.write_text(json.dumps(self.to_state()), encoding='utf-8')
+        return path
+
+    @classmethod
+    def load(cls, path) -> 'RollingVolumeStats':
+        return cls.from_state(json.loads(Path(path).read_text(encoding='utf-8')))
+
+
+def _add_var(val, v_nobs, v_mean, v_ssqdm, v_comp_add, v_unstable):
+    """Шаг _add_var на скалярах (для ядра extend)."""
+    if val != val:
+        return v_nobs, v_mean, v_ssqdm, v_comp_add, v_unstable
+    prev_m2 = v_ssqdm
+    v_nobs += 1
+    prev_mean = v_mean - v_comp_add
+    y = val - v_comp_add
+    t = y - v_mean
+    v_comp_add = t + v_mean - y
+    v_mean = v_mean + t / v_nobs
+    v_ssqdm = v_ssqdm + (val - prev_mean) * (val - v_mean)
+    if prev_m2 * INV_COND_TOL > v_ssqdm:
+        v_unstable = 1.0
+    return v_nobs, v_mean, v_ssqdm, v_comp_add, v_unstable
+
+
+def _extend_kernel(series, head, window, first, state, means, stds):
+    """
+    Проход update по series[head:] (series — буфер окна и пакет) на состоянии state (порядок KERNEL_FIELDS).
+    Арифметика и порядок операций те же, что у update; fastmath не используется, поэтому результат бит в бит.
+    """
+    m_nobs, m_sum, m_neg_ct, m_comp_add, m_comp_remove, m_same, m_prev = (
+        state[0], state[1], state[2], state[3], state[4], state[5], state[6])
+    v_nobs, v_mean, v_ssqdm, v_comp_add, v_comp_remove, v_unstable = (
+        state[7], state[8], state[9], state[10], state[11], state[12])
+    for p in range(head, len(series)):
+        val = series[p]
+        removed = p >= window
+        rem = series[p - window] if removed else 0.0
+        if first:
+            m_prev = val
+            m_same = 0.0
+
+        # среднее (_remove_mean, _add_mean)
+        if removed and rem == rem:
+            m_nobs -= 1
+            y = -rem - m_comp_remove
+            t = m_sum + y
+            m_comp_remove = t - m_sum - y
+            m_sum = t
+            if math.copysign(1.0, rem) < 0:
+                m_neg_ct -= 1
+        if val == val:
+            m_nobs += 1
+            y = val - m_comp_add
+            t = m_sum + y
+            m_comp_add = t - m_sum - y
+            m_sum = t
+            if math.copysign(1.0, val) < 0:
+                m_neg_ct += 1
+            if val == m_prev:
+                m_same += 1
+            else:
+                m_same = 1.0
+            m_prev = val
+
+        # дисперсия (_remove_var, _add_var, _recompute_var)
+        if not first:
+            if removed and rem == rem:
+                prev_m2 = v_ssqdm
+                v_nobs -= 1
+                if v_nobs:
+                    prev_mean = v_mean - v_comp_remove
+                    y = rem - v_comp_remove
+                    t = y - v_mean
+                    v_comp_remove = t + v_mean - y
+                    v_mean = v_mean - t / v_nobs
+                    v_ssqdm = v_ssqdm - (rem - prev_mean) * (rem - v_mean)
+                    if prev_m2 * INV_COND_TOL > v_ssqdm:
+                        v_unstable = 1.0
+                else:
+                    v_mean = 0.0
+                    v_ssqdm = 0.0
+                    v_unstable = 0.0
+            v_nobs, v_mean, v_ssqdm, v_comp_add, v_unstable = _add_var(
+                val, v_nobs, v_mean, v_ssqdm, v_comp_add, v_unstable)
+        if first or v_unstable:
+            v_mean = v_ssqdm = v_nobs = 0.0
+            v_comp_add = v_comp_remove = 0.0
+            for q in range(max(0, p - window + 1), p + 1):
+                v_nobs, v_mean, v_ssqdm, v_comp_add, v_unstable = _add_var(
+                    series[q], v_nobs, v_mean, v_ssqdm, v_comp_add, v_unstable)
+            v_unstable = 0.0
+        first = False
+
+        # _calc_mean, _calc_std
+        k = p - head
+        if m_nobs >= 1:
+            result = m_sum / m_nobs
+            if m_same >= m_nobs:
+                result = m_prev
+            elif m_neg_ct == 0 and result < 0:
+                result = 0.0
+            elif m_neg_ct == m_nobs and result > 0:
+                result = 0.0
+            means[k] = result
+        else:
+            means[k] = math.nan
+        if v_nobs >= 1:
+            var = v_ssqdm / v_nobs
+            stds[k] = math.sqrt(var) if var >= 0 else 0.0
+        else:
+            stds[k] = math.nan
+
+    state[0], state[1], state[2], state[3], state[4], state[5], state[6] = (
+        m_nobs, m_sum, m_neg_ct, m_comp_add, m_comp_remove, m_same, m_prev)
+    state[7], state[8], state[9], state[10], state[11], state[12] = (
+        v_nobs, v_mean, v_ssqdm, v_comp_add, v_comp_remove, v_unstable)
+
+
+if njit is not None:
+    _add_var = njit(cache=True)(_add_var)
+    _extend_kernel = njit(cache=True)(_extend_kernel)
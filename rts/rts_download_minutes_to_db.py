@@ -2,59 +2,171 @@
 Скрипт скачивает минутные данные из MOEX ISS API и сохраняет их в базу данных SQLite.
 Если в базе данных уже есть данные, он проверяет их полноту и докачивает недостающие данные.
 Если данных нет, он загружает все доступные данные, начиная с указанной даты.
+План загрузки строится одним агрегирующим запросом к БД (бары и последний бар по дням) и сверкой
+с кэшированным торговым календарём ({ticker}_trading_calendar.json): пропуски в любом месте истории
+и неполные дни превращаются в минимальный список диапазонов (контракт, from, till), выходные
+и праздники не запрашиваются.
 Минутные данные за текущую сессию на MOEX ISS API доступны после 19:05 текущего дня,
 после окончания основной сессии.
 """
 
 from pathlib import Path
+import hashlib
+import json
+import random
+import re
 import sqlite3
+import time as time_module
 from datetime import datetime, timedelta, date, time
 import requests
 import pandas as pd
 import logging
-import yaml
 
-# Путь к settings.yaml в той же директории, что и скрипт
-SETTINGS_FILE = Path(__file__).parent / "settings.yaml"
+import config
+from data_quality import clean_bars
+import run_profiler
+from run_profiler import RunProfiler, set_profiler
 
-# Чтение настроек
-with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-    settings = yaml.safe_load(f)
+try:  # быстрый разбор JSON ответов ISS, если установлен orjson
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
-# ==== Параметры ====
-ticker = settings['ticker']
-ticker_lc = ticker.lower()
-# Начальная дата для загрузки минутных данных
-start_date = datetime.strptime(settings['start_date_download_minutes'], "%Y-%m-%d").date()
+logger = logging.getLogger(__name__)
 
-# Путь к базе данных с минутными барами фьючерсов
-path_db_minute = Path(settings['path_db_minute'].replace('{ticker}', ticker))
-log_file = Path(fr'{ticker_lc}_download_minutes_to_db.txt')  # Путь к файлу логов
+# Экспоненциальная задержка между повторами запроса (секунды): случайная в [0, min(MAX, BASE * 2**попытка)]
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
 
-# Настройка логирования: вывод в консоль и в файл, файл перезаписывается
-log_file.parent.mkdir(parents=True, exist_ok=True)
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-# Удаляем существующие обработчики, чтобы избежать дублирования
-logger.handlers = []
-logger.addHandler(logging.FileHandler(log_file))
-# Обработчик для консоли
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(console_handler)
-# Обработчик для файла (перезаписывается при каждом запуске)
-file_handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
+# Время бара, с которым сессия дня считается докачанной (вечерняя сессия заканчивается в 23:50)
+SESSION_COMPLETE_TIME = time(23, 49, 0)
+
+# Даты в параметрах запроса ISS, по которым определяется неизменность ответа
+_URL_DATE_RE = re.compile(r'[?&](?:date|from|till)=(\d{4}-\d{2}-\d{2})')
+
+
+class ResponseCache:
+    """
+    Дисковый кэш JSON-ответов ISS с ключом по URL.
+    Записываются все ответы вместе с датой получения; из кэша отдаются только неизменные — запросы,
+    все даты которых (date, from, till) раньше сегодняшней и раньше даты получения ответа. Ответ,
+    полученный в день своей даты (неполная сессия) или раньше неё, считается промахом и перезапрашивается.
+    В режиме offline сеть не используется: отдаётся любой записанный ответ (воспроизведение записанной
+    загрузки), промах считается ошибкой запроса.
+    """
+
+    def __init__(self, cache_dir, offline: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.offline = offline
+
+    @classmethod
+    def from_settings(cls, settings: dict = None):
+        """Кэш по iss_cache_dir и iss_offline из settings.yaml; None, если каталог не задан."""
+        settings = config.get_settings(settings)
+        cache_dir = settings.get('iss_cache_dir', '')
+        if not cache_dir:
+            return None
+        return cls(cache_dir.replace('{ticker}', settings['ticker']), settings.get('iss_offline', False))
+
+    def _path(self, url: str) -> Path:
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return self.cache_dir / digest[:2] / f"{digest}.json"
+
+    @staticmethod
+    def is_immutable(url: str, today_date: date = None) -> bool:
+        dates = _URL_DATE_RE.findall(url)
+        today_date = today_date or datetime.now().date()
+        return bool(dates) and max(dates) < today_date.isoformat()
+
+    def get(self, url: str, today_date: date = None):
+        if not (self.offline or self.is_immutable(url, today_date)):
+            return None
+        path = self._path(url)
+        if not path.exists():
+            return None
+        try:
+            entry = _json_loads(path.read_bytes())
+            payload = entry['payload']
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            # повреждённый или недописанный файл кэша — промах, файл удаляется
+            logger.warning(f"Повреждённый файл кэша ISS {path}: {e}")
+            run_profiler.count('iss_cache_corrupt')
+            path.unlink(missing_ok=True)
+            return None
+        # ответ получен до окончания своих дат (или без даты получения) — мог быть неполным
+        if not (self.offline or self.is_immutable(url, date.fromisoformat(entry.get('fetched') or '0001-01-01'))):
+            run_profiler.count('iss_cache_stale')
+            return None
+        return payload
+
+    def put(self, url: str, payload, today_date: date = None) -> None:
+        path = self._path(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        fetched = (today_date or datetime.now().date()).isoformat()
+        tmp.write_text(json.dumps({'url': url, 'fetched': fetched, 'payload': payload}, ensure_ascii=False),
+                       encoding='utf-8')
+        tmp.replace(path)
+
+
+_response_cache = None
+
+
+def set_response_cache(cache) -> None:
+    """Включает кэш ответов для request_moex (None — выключить)."""
+    global _response_cache
+    _response_cache = cache
+
+
+def setup_logging(log_file: Path = None, settings: dict = None) -> None:
+    """Настройка логирования: вывод в консоль и в файл, файл перезаписывается."""
+    if log_file is None:
+        ticker_lc = config.get_settings(settings)['ticker'].lower()
+        log_file = Path(fr'{ticker_lc}_download_minutes_to_db.txt')  # Путь к файлу логов
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    logger.setLevel(logging.INFO)
+    # Удаляем существующие обработчики, чтобы избежать дублирования
+    logger.handlers = []
+    # Обработчик для консоли
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(console_handler)
+    # Обработчик для файла (перезаписывается при каждом запуске)
+    file_handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(file_handler)
 
 def request_moex(session, url, retries = 5, timeout = 10):
-    """Функция запроса данных с повторными попытками"""
+    """
+    Функция запроса данных с повторными попытками (экспоненциальная задержка со случайной составляющей).
+    Если включён кэш ответов (set_response_cache), неизменные ответы берутся с диска.
+    """
+    cache = _response_cache
+    if cache is not None:
+        payload = cache.get(url)
+        if payload is not None:
+            run_profiler.count('iss_cache_hits')
+            return payload
+        if cache.offline:
+            logger.error(f"Нет записанного ответа для {url} (режим offline)")
+            return None
+
     for attempt in range(retries):
+        run_profiler.count('requests')
+        if attempt:
+            run_profiler.count('retries')
+            time_module.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
         try:
             response = session.get(url, timeout=timeout)
             response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
+            run_profiler.count('bytes', len(response.content))
+            payload = _json_loads(response.content)
+            if cache is not None:
+                cache.put(url, payload)
+            return payload
+        except (requests.RequestException, ValueError) as e:
+            # ValueError — обрезанный или не-JSON ответ (HTML страница ошибки ISS); в кэш он не пишется
             logger.error(f"Ошибка запроса {url} (попытка {attempt + 1}): {e}")
             if attempt == retries - 1:
                 return None
@@ -77,6 +189,80 @@ def create_tables(connection: sqlite3.Connection) -> None:
     except sqlite3.OperationalError as exception:
         logger.error(f"Ошибка при создании БД: {exception}")
 
+def create_continuous_tables(connection: sqlite3.Connection) -> None:
+    """
+    Календарь ролловеров Rolls и представление FuturesContinuous (если их нет).
+    Rolls — строка на контракт: первый и последний бар в БД, GAP — разрыв цены при переходе
+    на контракт (OPEN его первого бара минус CLOSE последнего бара предыдущего контракта),
+    RATIO — тот же переход отношением (OPEN / CLOSE), FACTOR — мультипликативная поправка назад
+    (произведение RATIO более поздних контрактов; у текущего контракта 1).
+    FuturesContinuous — бары Futures с ценами OPEN/LOW/HIGH/CLOSE * FACTOR, т.е. склеенный ряд без разрывов.
+    Поправка отношением не меняет отношения цен внутри контракта, поэтому все признаки бара
+    (rO, rC, r_body, r_up, r_down, r_log) по склеенному ряду те же, что по Futures; BODY — в пунктах
+    текущего контракта.
+    """
+    with connection:
+        connection.execute('''CREATE TABLE if not exists Rolls (
+                        SECID             TEXT PRIMARY KEY UNIQUE NOT NULL,
+                        LSTTRADE          DATE NOT NULL,
+                        FIRST_BAR         TEXT NOT NULL,
+                        LAST_BAR          TEXT NOT NULL,
+                        GAP               REAL NOT NULL DEFAULT 0,
+                        RATIO             REAL NOT NULL DEFAULT 1,
+                        FACTOR            REAL NOT NULL DEFAULT 1)'''
+                           )
+        connection.execute(f'''CREATE VIEW if not exists {config.CONTINUOUS_VIEW} AS
+                        SELECT f.TRADEDATE, f.SECID,
+                               f.OPEN * r.FACTOR AS OPEN, f.LOW * r.FACTOR AS LOW,
+                               f.HIGH * r.FACTOR AS HIGH, f.CLOSE * r.FACTOR AS CLOSE,
+                               f.VOLUME, f.LSTTRADE
+                        FROM Futures f JOIN Rolls r ON r.SECID = f.SECID'''
+                           )
+
+def update_rolls(connection: sqlite3.Connection, since: str = None, recompute: bool = False) -> None:
+    """
+    Инкрементально обновляет календарь ролловеров после записи баров.
+    Границы контрактов уточняются только по барам с TRADEDATE >= since (по умолчанию — с последнего
+    известного бара), затем GAP/RATIO/FACTOR пересчитываются по цепочке контрактов точечными запросами по ключу.
+    Пустой календарь (Rolls только что создана в БД с барами) строится по всей истории при любом since:
+    представление FuturesContinuous соединяется с Rolls, и контракты без строки в Rolls выпали бы из ряда.
+    recompute=True — пересчитать цепочку, даже если новых баров нет.
+    """
+    with connection:
+        last_bar = connection.execute("SELECT MAX(LAST_BAR) FROM Rolls").fetchone()[0]
+        if last_bar is None:
+            since, recompute = '', True
+        elif since is None:
+            since = last_bar
+        spans = connection.execute(
+            "SELECT SECID, MIN(LSTTRADE), MIN(TRADEDATE), MAX(TRADEDATE) FROM Futures "
+            "WHERE TRADEDATE >= ? GROUP BY SECID", (since,)
+        ).fetchall()
+        if not spans and not recompute:
+            return
+        # Бары только добавляются, поэтому границы контракта лишь расширяются
+        connection.executemany(
+            "INSERT INTO Rolls (SECID, LSTTRADE, FIRST_BAR, LAST_BAR) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(SECID) DO UPDATE SET FIRST_BAR = MIN(FIRST_BAR, excluded.FIRST_BAR), "
+            "LAST_BAR = MAX(LAST_BAR, excluded.LAST_BAR)",
+            spans,
+        )
+
+        contracts = connection.execute("SELECT SECID, FIRST_BAR, LAST_BAR FROM Rolls ORDER BY FIRST_BAR").fetchall()
+        gaps, ratios = [0.0], [1.0]
+        for (_, _, prev_last), (_, first, _) in zip(contracts, contracts[1:]):
+            prev_close = connection.execute("SELECT CLOSE FROM Futures WHERE TRADEDATE = ?", (prev_last,)).fetchone()[0]
+            first_open = connection.execute("SELECT OPEN FROM Futures WHERE TRADEDATE = ?", (first,)).fetchone()[0]
+            gaps.append(first_open - prev_close)
+            ratios.append(first_open / prev_close if prev_close > 0 else 1.0)
+        factor = 1.0
+        updates = []
+        for (secid, _, _), gap, ratio in zip(reversed(contracts), reversed(gaps), reversed(ratios)):
+            updates.append((gap, ratio, factor, secid))
+            factor *= ratio
+        connection.executemany("UPDATE Rolls SET GAP = ?, RATIO = ?, FACTOR = ? WHERE SECID = ?", updates)
+    run_profiler.count('rolls', max(0, len(contracts) - 1))
+
 def get_info_future(session, security):
     """Запрашивает у MOEX информацию по инструменту"""
     url = f'https://iss.moex.com/iss/securities/{security}.json'
@@ -85,8 +271,7 @@ def get_info_future(session, security):
     if not j:
         return pd.Series(["", "2130-01-01"])  # Гарантируем, что всегда 2 значения
 
-    data = [{k: r[i] for i, k in enumerate(j['description']['columns'])} for r in j['description']['data']]
-    df = pd.DataFrame(data)
+    df = pd.DataFrame(j['description']['data'], columns=j['description']['columns'])
 
     shortname = df.loc[df['name'] == 'SHORTNAME', 'value'].values[0] \
         if 'SHORTNAME' in df['name'].values else ""
@@ -96,14 +281,19 @@ def get_info_future(session, security):
 
     return pd.Series([shortname, lsttrade])  # Гарантируем возврат 2 значений
 
-def get_minute_candles(session, ticker: str, start_date: date, from_str: str = None, till_str: str = None) -> pd.DataFrame:
-    """Получает все минутные данные по фьючерсу за указанную дату с учетом пагинации"""
+def get_minute_candles(session, ticker: str, start_date: date, from_str: str = None, till_str: str = None,
+                       raise_errors: bool = False) -> pd.DataFrame:
+    """
+    Получает все минутные данные по фьючерсу за указанную дату (или диапазон from_str - till_str)
+    с учетом пагинации. raise_errors=True — при неудачном запросе исключение вместо частичного результата.
+    """
     if from_str is None:
         from_str = datetime.combine(start_date, time(0, 0)).isoformat()
     if till_str is None:
         till_str = datetime.combine(start_date, time(23, 59, 59)).isoformat()
 
-    all_data = []
+    pages = []  # страницы как есть: списки строк ISS без промежуточных словарей
+    columns = None
     start = 0
     page_size = 500  # MOEX ISS API возвращает до 500 записей за запрос
 
@@ -116,25 +306,27 @@ def get_minute_candles(session, ticker: str, start_date: date, from_str: str = N
         logger.info(f"Запрос минутных данных (start={start}): {url}")
 
         j = request_moex(session, url)
+        if j is None and raise_errors:
+            raise requests.RequestException(f"Ошибка получения минутных данных {ticker} с {from_str}")
         if not j or 'candles' not in j or not j['candles'].get('data'):
             logger.error(f"Нет минутных данных для {ticker} на {start_date}")
             break
 
-        data = [{k: r[i] for i, k in enumerate(j['candles']['columns'])} for r in j['candles']['data']]
-        if not data:
-            break
-
-        all_data.extend(data)
+        data = j['candles']['data']
+        columns = j['candles']['columns']
+        pages.append(data)
         start += page_size
 
         if len(data) < page_size:
             break
 
-    if not all_data:
+    if not pages:
         logger.error(f"Нет данных для {ticker} на {start_date}")
         return pd.DataFrame()
 
-    df = pd.DataFrame(all_data)
+    # Одна склейка страниц и одно построение DataFrame из списков строк
+    rows = pages[0] if len(pages) == 1 else [r for page in pages for r in page]
+    df = pd.DataFrame(rows, columns=columns)
 
     df = df.rename(columns={
         'begin': 'TRADEDATE',
@@ -147,124 +339,277 @@ def get_minute_candles(session, ticker: str, start_date: date, from_str: str = N
 
     df['SECID'] = ticker
 
-    df = df.dropna(subset=['OPEN', 'LOW', 'HIGH', 'CLOSE', 'VOLUME'])
+    # Точные дубли и пустые бары отбрасываются, прочие нарушения только журналируются (таблица качества)
+    df, flags = clean_bars(df)
+    if any(flags.values()):
+        logger.warning(f"Качество минуток {ticker} на {start_date}: {flags}")
+        run_profiler.count('bars_flagged', sum(flags.values()))
     logger.info(df.to_string(max_rows=6, max_cols=18))
 
     return df[['TRADEDATE', 'SECID', 'OPEN', 'LOW', 'HIGH', 'CLOSE', 'VOLUME']].reset_index(drop=True)
 
-def save_to_db(df: pd.DataFrame, connection: sqlite3.Connection, cursor: sqlite3.Cursor) -> None:
-    """Сохраняет DataFrame в таблицу Futures"""
+def save_to_db(df: pd.DataFrame, connection: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Сохраняет DataFrame в таблицу Futures; возвращает TRADEDATE самого раннего нового бара (или None)"""
     if df.empty:
         logger.error("DataFrame пуст, данные не сохранены")
-        return
+        return None
 
     try:
+        # INSERT OR IGNORE: бары, уже лежащие в БД, при повторной загрузке диапазона пропускаются
+        columns = list(df.columns)
+        rows = df.astype(object).where(df.notna(), None)
+        existing = {row[0] for row in connection.execute(
+            "SELECT TRADEDATE FROM Futures WHERE TRADEDATE BETWEEN ? AND ?",
+            (df['TRADEDATE'].min(), df['TRADEDATE'].max()))}
+        new_dates = df.loc[~df['TRADEDATE'].isin(existing), 'TRADEDATE']
         with connection:
-            df.to_sql('Futures', connection, if_exists='append', index=False)
+            connection.executemany(
+                f"INSERT OR IGNORE INTO Futures ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                rows.itertuples(index=False, name=None),
+            )
+        run_profiler.count('rows', len(df))
         logger.info(f"Сохранено {len(df)} записей в таблицу Futures")
+        return new_dates.min() if not new_dates.empty else None
     except sqlite3.Error as e:
         logger.error(f"Ошибка при сохранении данных в БД: {e}")
+        return None
 
-def get_future_date_results(
-        session,
-        start_date: date,
-        ticker: str,
-        connection: sqlite3.Connection,
-        cursor: sqlite3.Cursor) -> None:
-    """Получает данные по фьючерсам с MOEX ISS API и сохраняет их в базу данных."""
-    today_date = datetime.now().date()  # Текущая дата
-    while start_date <= today_date:
-        date_str = start_date.strftime('%Y-%m-%d')
-        # Проверяем количество записей в БД за дату
-        cursor.execute("SELECT COUNT(*) FROM Futures WHERE DATE(TRADEDATE) = ?", (date_str,))
-        count = cursor.fetchone()[0]
-
-        if count == 0:
-            # Нет минутных данных в БД, запрашиваем данные о торгуемых фьючерсах на дату
-            # За текущую дату торгуемые тикеры доступны после 19:05, после окончания основной сессии
-            request_url = (
-                f'https://iss.moex.com/iss/history/engines/futures/markets/forts/securities.json?'
-                f'date={date_str}&assetcode={ticker}'
-            )
-
-            j = request_moex(session, request_url)
-            if j is None:
-                logger.error(f"Ошибка получения данных для {start_date}. Прерываем процесс, чтобы повторить попытку в следующий запуск.")
-                break
-            elif 'history' not in j or not j['history'].get('data'):
-                logger.info(f"Нет данных по торгуемым фьючерсам {ticker} за {start_date}")
-                start_date += timedelta(days=1)
-                continue
-
-            data = [{k: r[i] for i, k in enumerate(j['history']['columns'])} for r in j['history']['data']]
-            df = pd.DataFrame(data).dropna(subset=['OPEN', 'LOW', 'HIGH', 'CLOSE'])
-            if len(df) == 0:
-                start_date += timedelta(days=1)
-                continue
-
-            df[['SHORTNAME', 'LSTTRADE']] = df.apply(
-                lambda x: get_info_future(session, x['SECID']), axis=1, result_type='expand'
-            )
-            df["LSTTRADE"] = pd.to_datetime(df["LSTTRADE"], errors='coerce').dt.date.fillna('2130-01-01')
-            df = df[df['LSTTRADE'] > start_date].dropna(subset=['OPEN', 'LOW', 'HIGH', 'CLOSE'])
-            df = df[df['LSTTRADE'] == df['LSTTRADE'].min()].reset_index(drop=True)
-            df = df.drop(columns=[
-                'OPENPOSITIONVALUE', 'VALUE', 'SETTLEPRICE', 'SWAPRATE', 'WAPRICE',
-                'SETTLEPRICEDAY', 'NUMTRADES', 'SHORTNAME', 'CHANGE', 'QTY'
-            ], errors='ignore')
-
-            current_ticker = df.loc[0, 'SECID']
-            lasttrade = df.loc[0, 'LSTTRADE']
-
-            # Получаем минутные данные
-            minute_df = get_minute_candles(session, current_ticker, start_date)
-            minute_df['LSTTRADE'] = lasttrade
-            if not minute_df.empty:
-                save_to_db(minute_df, connection, cursor)
+def load_trading_calendar(path: Path) -> dict:
+    """
+    Кэш торгового календаря: {'YYYY-MM-DD': None (торгов нет) или
+    {'SECID': контракт, 'LSTTRADE': 'YYYY-MM-DD', 'COMPLETE': минутки прошедшего дня докачаны}}.
+    """
+    if path.exists():
+        return json.loads(path.read_text(encoding='utf-8'))
+    return {}
 
-        else:
-            # Есть минутные данные за дату, проверяем полноту
-            cursor.execute("SELECT MAX(TRADEDATE) FROM Futures WHERE DATE(TRADEDATE) = ?", (date_str,))
-            max_time_str = cursor.fetchone()[0]
-            max_dt = datetime.strptime(max_time_str, '%Y-%m-%d %H:%M:%S')
+def save_trading_calendar(calendar: dict, path: Path) -> None:
+    path.write_text(json.dumps(calendar, indent=0, sort_keys=True), encoding='utf-8')
 
-            threshold_time = time(23, 49, 0)
-            is_today = start_date == today_date
+def get_front_contract(session, ticker: str, trade_date: date, expires_after: date = None):
+    """
+    Ближайший торгуемый на дату контракт (LSTTRADE > expires_after, по умолчанию > даты) по ответу ISS history.
+    Возвращает (SECID, LSTTRADE), () если торгов в этот день не было, None при ошибке запроса.
+    За текущую дату торгуемые тикеры доступны после 19:05, после окончания основной сессии.
+    """
+    date_str = trade_date.strftime('%Y-%m-%d')
+    request_url = (
+        f'https://iss.moex.com/iss/history/engines/futures/markets/forts/securities.json?'
+        f'date={date_str}&assetcode={ticker}'
+    )
+    j = request_moex(session, request_url)
+    if j is None:
+        return None
+    if 'history' not in j or not j['history'].get('data'):
+        return ()
+
+    df = pd.DataFrame(j['history']['data'], columns=j['history']['columns']).dropna(
+        subset=['OPEN', 'LOW', 'HIGH', 'CLOSE'])
+    if len(df) == 0:
+        return ()
+
+    df[['SHORTNAME', 'LSTTRADE']] = df.apply(
+        lambda x: get_info_future(session, x['SECID']), axis=1, result_type='expand'
+    )
+    df["LSTTRADE"] = pd.to_datetime(df["LSTTRADE"], errors='coerce').dt.date.fillna(date(2130, 1, 1))
+    df = df[df['LSTTRADE'] > (expires_after or trade_date)]
+    if len(df) == 0:
+        return ()
+    df = df[df['LSTTRADE'] == df['LSTTRADE'].min()].reset_index(drop=True)
+    return df.loc[0, 'SECID'], df.loc[0, 'LSTTRADE']
+
+def front_contract_on(session, ticker: str, calendar: dict, day: date):
+    """
+    Контракт дня day до выхода истории ISS за этот день (внутри сессии history его ещё не отдаёт):
+    запись календаря за day; иначе контракт последнего известного торгового дня, если он экспирируется позже day;
+    иначе ближайший после day по экспирации контракт из истории того дня. None, если определить не удалось.
+    """
+    entry = calendar.get(day.isoformat())
+    if entry:
+        return entry['SECID']
+    known = [d for d, e in calendar.items() if e and d < day.isoformat()]
+    if not known:
+        contract = get_front_contract(session, ticker, day)
+        return contract[0] if contract else None
+    last_day = max(known)
+    if date.fromisoformat(calendar[last_day]['LSTTRADE']) > day:
+        return calendar[last_day]['SECID']
+    contract = get_front_contract(session, ticker, date.fromisoformat(last_day), expires_after=day)
+    return contract[0] if contract else None
+
+def get_contract_trading_days(session, secid: str, from_date: date, till_date: date):
+    """Дни с торгами контракта за период одним (постраничным) запросом ISS history; None при ошибке."""
+    days = set()
+    start = 0
+    while True:
+        url = (
+            f'https://iss.moex.com/iss/history/engines/futures/markets/forts/securities/{secid}.json?'
+            f'from={from_date:%Y-%m-%d}&till={till_date:%Y-%m-%d}&start={start}'
+        )
+        j = request_moex(session, url)
+        if j is None:
+            return None
+        rows = j.get('history', {}).get('data') or []
+        if not rows:
+            break
+        columns = j['history']['columns']
+        i_date, i_open = columns.index('TRADEDATE'), columns.index('OPEN')
+        days.update(r[i_date] for r in rows if r[i_open] is not None)
+        start += len(rows)
+    return days
 
-            if not is_today and max_dt.time() >= threshold_time:
-                logger.info(f"Минутные данные за {start_date} полные, пропускаем дату {start_date}")
-                start_date += timedelta(days=1)
+def update_trading_calendar(session, ticker: str, calendar: dict, start_date: date, today_date: date) -> None:
+    """
+    Дополняет календарь днями с start_date по today_date.
+    На первый неизвестный день запрашивается ближайший контракт, затем его торговые дни
+    до дня перед экспирацией берутся одним запросом — вместо запроса на каждый календарный день.
+    Отсутствие торгов кэшируется только для прошедших дней.
+    """
+    day = start_date
+    while day <= today_date:
+        if day.isoformat() in calendar:
+            day += timedelta(days=1)
+            continue
+
+        contract = get_front_contract(session, ticker, day)
+        if contract is None:
+            logger.error(f"Ошибка получения данных для {day}. Прерываем процесс, чтобы повторить попытку в следующий запуск.")
+            break
+        if not contract:
+            logger.info(f"Нет данных по торгуемым фьючерсам {ticker} за {day}")
+            if day < today_date:
+                calendar[day.isoformat()] = None
+            day += timedelta(days=1)
+            continue
+
+        secid, lasttrade = contract
+        till_date = min(lasttrade - timedelta(days=1), today_date)
+        trading_days = get_contract_trading_days(session, secid, day, till_date)
+        if trading_days is None:
+            logger.error(f"Ошибка получения торговых дней {secid}. Прерываем процесс, чтобы повторить попытку в следующий запуск.")
+            break
+        trading_days.add(day.isoformat())  # день уже подтверждён ответом по assetcode
+        logger.info(f"Календарь: {secid} (экспирация {lasttrade}) торгуется {len(trading_days)} дней с {day} по {till_date}")
+
+        while day <= till_date:
+            if day.isoformat() in trading_days:
+                calendar[day.isoformat()] = {'SECID': secid, 'LSTTRADE': lasttrade.isoformat(), 'COMPLETE': False}
+            elif day < today_date:
+                calendar[day.isoformat()] = None
+            day += timedelta(days=1)
+
+def scan_db_days(connection: sqlite3.Connection, start_date: date) -> pd.DataFrame:
+    """Одним агрегирующим запросом: число баров и время последнего бара по дням БД."""
+    df = pd.read_sql_query(
+        "SELECT DATE(TRADEDATE) AS DAY, COUNT(*) AS BARS, MAX(TRADEDATE) AS LAST_BAR "
+        "FROM Futures WHERE TRADEDATE >= ? GROUP BY DAY ORDER BY DAY",
+        connection, params=(start_date.isoformat(),),
+    )
+    run_profiler.count('db_days', len(df))
+    return df.set_index('DAY')
+
+def plan_fetch_ranges(df_days: pd.DataFrame, calendar: dict, start_date: date, now: datetime) -> pd.DataFrame:
+    """
+    Сравнивает дни БД с торговым календарём и возвращает минимальный список диапазонов загрузки
+    SECID, LSTTRADE, FROM, TILL, DAYS. Подряд идущие торговые дни одного контракта без баров
+    в БД склеиваются в один диапазон; у неполного дня диапазон начинается со следующей минуты
+    после последнего бара. Прошедший день считается полным, если последний бар не раньше 23:49
+    или он уже докачивался (COMPLETE).
+    """
+    today_date = now.date()
+    ranges = []
+    prev_planned = False  # предыдущий торговый день попал в план целиком
+
+    for day_str in sorted(d for d, entry in calendar.items() if entry is not None):
+        day = date.fromisoformat(day_str)
+        if day < start_date or day > today_date:
+            continue
+        entry = calendar[day_str]
+        is_today = day == today_date
+
+        if day_str in df_days.index:
+            max_dt = datetime.strptime(df_days.at[day_str, 'LAST_BAR'], '%Y-%m-%d %H:%M:%S')
+            if not is_today and (max_dt.time() >= SESSION_COMPLETE_TIME or entry.get('COMPLETE')):
+                prev_planned = False
                 continue
-
-            # Неполные минутные данные или сегодняшний день (после 19:05), докачиваем
-            cursor.execute("SELECT SECID, LSTTRADE FROM Futures WHERE DATE(TRADEDATE) = ? LIMIT 1", (date_str,))
-            row = cursor.fetchone()
-            current_ticker = row[0]
-            lasttrade = datetime.strptime(row[1], '%Y-%m-%d').date() if isinstance(row[1], str) else row[1]
-
             from_dt = max_dt + timedelta(minutes=1)
-            from_str = from_dt.isoformat()
-
-            if is_today:
-                till_dt = datetime.now()
-            else:
-                till_dt = datetime.combine(start_date, time(23, 59, 59))
-            till_str = till_dt.isoformat()
+        else:
+            if not is_today and entry.get('COMPLETE'):
+                prev_planned = False
+                continue
+            from_dt = datetime.combine(day, time(0, 0))
+        till_dt = now if is_today else datetime.combine(day, time(23, 59, 59))
+
+        last = ranges[-1] if ranges else None
+        if (prev_planned and last['SECID'] == entry['SECID']
+                and from_dt == datetime.combine(day, time(0, 0))):
+            last['TILL'] = till_dt
+            last['DAYS'].append(day_str)
+        else:
+            ranges.append({'SECID': entry['SECID'], 'LSTTRADE': entry['LSTTRADE'],
+                           'FROM': from_dt, 'TILL': till_dt, 'DAYS': [day_str]})
+        prev_planned = True
 
-            minute_df = get_minute_candles(session, current_ticker, start_date, from_str, till_str)
-            minute_df['LSTTRADE'] = lasttrade
-            if not minute_df.empty:
-                save_to_db(minute_df, connection, cursor)
+    return pd.DataFrame(ranges, columns=['SECID', 'LSTTRADE', 'FROM', 'TILL', 'DAYS'])
 
-        start_date += timedelta(days=1)
+def execute_fetch_ranges(
+        session,
+        df_plan: pd.DataFrame,
+        calendar: dict,
+        connection: sqlite3.Connection,
+        cursor: sqlite3.Cursor,
+        today_date: date):
+    """
+    Загружает минутки по диапазонам плана; докачанные прошедшие дни отмечаются в календаре.
+    Возвращает TRADEDATE самого раннего записанного бара (None — новых баров нет): план закрывает
+    пропуски в любом месте истории, поэтому он может оказаться раньше последнего бара БД.
+    """
+    first_inserted = None
+    for r in df_plan.itertuples(index=False):
+        try:
+            minute_df = get_minute_candles(
+                session, r.SECID, r.FROM.date(), r.FROM.isoformat(), r.TILL.isoformat(), raise_errors=True)
+        except requests.RequestException as e:
+            logger.error(f"{e}. Прерываем процесс, чтобы повторить попытку в следующий запуск.")
+            break
+        run_profiler.count('ranges')
+        if not minute_df.empty:
+            minute_df['LSTTRADE'] = r.LSTTRADE
+            inserted = save_to_db(minute_df, connection, cursor)
+            if inserted is not None and (first_inserted is None or inserted < first_inserted):
+                first_inserted = inserted
+        for day_str in r.DAYS:
+            if date.fromisoformat(day_str) < today_date:
+                calendar[day_str]['COMPLETE'] = True
+    return first_inserted
 
 def main(
-        ticker: str = ticker,
-        path_db: Path = path_db_minute,
-        start_date: date = start_date) -> None:
+        ticker: str = None,
+        path_db: Path = None,
+        start_date: date = None,
+        settings: dict = None,
+        vacuum: bool = True):
     """
     Основная функция: подключается к базе данных, создает таблицы и загружает данные по фьючерсам.
+    Параметры по умолчанию берутся из settings.yaml.
+    vacuum=False пропускает VACUUM (для частых запусков из демона).
+    Возвращает TRADEDATE самого раннего записанного бара (None — новых баров нет).
     """
+    settings = config.get_settings(settings)
+    if ticker is None:
+        ticker = settings['ticker']
+    if path_db is None:
+        # Путь к базе данных с минутными барами фьючерсов
+        path_db = config.db_path(settings)
+    if start_date is None:
+        # Начальная дата для загрузки минутных данных
+        start_date = datetime.strptime(settings['start_date_download_minutes'], "%Y-%m-%d").date()
+
+    # Кэш ответов ISS: повторные загрузки прошедших дат не ходят в сеть, offline — воспроизведение записи
+    set_response_cache(ResponseCache.from_settings(settings))
+
+    connection = None
+    first_inserted = None
     try:
         # Создание директории под БД, если не существует
         path_db.parent.mkdir(parents=True, exist_ok=True)
@@ -279,36 +624,47 @@ def main(
         # Если таблица Futures не существует, создаем её
         if exist_table is None:
             create_tables(connection)
-
-        # Проверяем, есть ли записи в таблице Futures
-        cursor.execute("SELECT EXISTS (SELECT 1 FROM Futures) as has_rows")
-        exists_rows = cursor.fetchone()[0]
-        # Если таблица Futures не пустая
-        if exists_rows:
-            # Находим максимальную дату
-            cursor.execute("SELECT MAX(DATE(TRADEDATE)) FROM Futures")
-            max_trade_date = cursor.fetchone()[0]
-            if max_trade_date:
-                # Устанавливаем start_date на максимальную дату для проверки полноты
-                start_date = datetime.strptime(max_trade_date, "%Y-%m-%d").date()
-                logger.info(f"Начальная дата для загрузки минутных данных: {start_date}")
-
-        with requests.Session() as session:
-            get_future_date_results(session, start_date, ticker, connection, cursor)
+        create_continuous_tables(connection)
+
+        # План загрузки: дни БД против торгового календаря, без прохода по каждой дате
+        path_calendar = config.artifact_path('trading_calendar', settings)
+        calendar = load_trading_calendar(path_calendar)
+        now = datetime.now()
+        with requests.Session() as session, run_profiler.stage('iss_download'):
+            try:
+                update_trading_calendar(session, ticker, calendar, start_date, now.date())
+                df_plan = plan_fetch_ranges(scan_db_days(connection, start_date), calendar, start_date, now)
+                logger.info(f"План загрузки: {len(df_plan)} диапазонов, {int(df_plan['DAYS'].str.len().sum())} дней")
+                if not df_plan.empty:
+                    logger.info(df_plan.to_string(max_rows=20))
+                first_inserted = execute_fetch_ranges(session, df_plan, calendar, connection, cursor, now.date())
+                # Календарь ролловеров и склеенный ряд — с первого докачанного бара
+                since = df_plan['FROM'].min().strftime('%Y-%m-%d %H:%M:%S') if not df_plan.empty else None
+                update_rolls(connection, since)
+            finally:
+                save_trading_calendar(calendar, path_calendar)
 
     except Exception as e:
         logger.error(f"Ошибка в main: {e}")
 
     finally:
-        # Выполняем команду VACUUM
-        cursor.execute("VACUUM")
-        logger.info("VACUUM выполнен: база данных оптимизирована")
-
-        # Закрываем курсор и соединение
-        cursor.close()
-        connection.close()
+        if connection is not None:
+            if vacuum:
+                # Выполняем команду VACUUM
+                cursor.execute("VACUUM")
+                logger.info("VACUUM выполнен: база данных оптимизирована")
+
+            # Закрываем курсор и соединение
+            cursor.close()
+            connection.close()
         logger.info(f"Соединение с минутной БД {path_db} по фьючерсам {ticker} закрыто.")
+    return first_inserted
 
 
 if __name__ == '__main__':
-    main(ticker, path_db_minute, start_date)
\ No newline at end of file
+    setup_logging()
+    profiler = set_profiler(RunProfiler.from_settings(config.load_settings(), 'download'))
+    try:
+        main()
+    finally:
+        profiler.write_report()
@@ -0,0 +1,246 @@
+"""
+Инструментирование стадий конвейера.
+Для каждой стадии фиксируются wall time, CPU time, пиковый RSS процесса и счётчики
+(строки, пары DTW, запросы к ISS и т.п.). По окончании запуска отчёт сохраняется в JSON,
+а также дописывается строкой в JSONL-историю, чтобы регрессии были видны между ночными прогонами.
+Опционально каждая стадия профилируется: 'cprofile' пишет .prof файл (pstats, snakeviz),
+'pyspy' запускает py-spy record на время стадии и пишет профиль в формате speedscope.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('', 'cprofile', 'pyspy')
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса в МБ или None, если платформа не позволяет его измерить."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 2 ** 20
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS — байты
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+class StageRecord:
+    """Замер одной стадии: время, память и произвольные счётчики."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = datetime.now().isoformat(timespec='milliseconds')
+        self.finished = None
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_rss_mb = None
+        self.counters = {}
+        self.profile_file = None
+
+    def add(self, counter: str, value=1) -> None:
+        """Увеличивает счётчик стадии на value."""
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'started': self.started,
+            'finished': self.finished,
+            'wall_s': round(self.wall_s, 6),
+            'cpu_s': round(self.cpu_s, 6),
+            'peak_rss_mb': None if self.peak_rss_mb is None else round(self.peak_rss_mb, 1),
+            'counters': self.counters,
+            'profile_file': self.profile_file,
+        }
+
+
+class RunProfiler:
+    """
+    Собирает замеры стадий одного запуска скрипта.
+    report_path — JSON-отчёт запуска (None — отчёт не пишется),
+    profile — '', 'cprofile' или 'pyspy', profile_dir — каталог для файлов профилей.
+    """
+
+    def __init__(self, run_name: str, report_path=None, profile: str = '', profile_dir='profiles'):
+        if profile not in PROFILE_MODES:
+            raise ValueError(f"Неизвестный режим профилирования: {profile!r}, ожидается один из {PROFILE_MODES}")
+        self.run_name = run_name
+        self.report_path = Path(report_path) if report_path else None
+        self.profile = profile
+        self.profile_dir = Path(profile_dir)
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.stages = []
+        self.counters = {}
+        self._active = []
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+
+    @classmethod
+    def from_settings(cls, settings: dict, run_name: str) -> 'RunProfiler':
+        """Создаёт профайлер по ключам run_report, profile_stages и profile_dir из settings.yaml."""
+        ticker = settings['ticker']
+        report = settings.get('run_report')
+        report_path = report.replace('{ticker}', ticker).replace('{run}', run_name) if report else None
+        return cls(
+            run_name,
+            report_path=report_path,
+            profile=settings.get('profile_stages') or '',
+            profile_dir=settings.get('profile_dir', 'profiles'),
+        )
+
+    @contextmanager
+    def stage(self, name: str):
+        """Контекст замера стадии; внутри можно вызывать record.add() или profiler.count()."""
+        record = StageRecord(name)
+        self._active.append(record)
+        # Профилируем только внешнюю стадию: cProfile не допускает вложенных профайлеров
+        hook = self._start_hook(name) if len(self._active) == 1 else None
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_s = time.perf_counter() - wall0
+            record.cpu_s = time.process_time() - cpu0
+            record.profile_file = self._stop_hook(hook)
+            record.peak_rss_mb = peak_rss_mb()
+            record.finished = datetime.now().isoformat(timespec='milliseconds')
+            self._active.pop()
+            self.stages.append(record)
+            logger.info(
+                f"Стадия {name}: wall {record.wall_s:.3f} с, cpu {record.cpu_s:.3f} с, "
+                f"счётчики {record.counters}"
+            )
+
+    def count(self, counter: str, value=1) -> None:
+        """Добавляет value к счётчику текущей стадии (или запуска, если стадии нет)."""
+        if self._active:
+            self._active[-1].add(counter, value)
+        else:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def report(self) -> dict:
+        """Отчёт запуска в виде словаря."""
+        return {
+            'run': self.run_name,
+            'started': self.started,
+            'wall_s': round(time.perf_counter() - self._wall0, 6),
+            'cpu_s': round(time.process_time() - self._cpu0, 6),
+            'peak_rss_mb': peak_rss_mb(),
+            'python': sys.version.split()[0],
+            'counters': self.counters,
+            'stages': [record.to_dict() for record in self.stages],
+        }
+
+    def write_report(self, path=None):
+        """Пишет JSON-отчёт и дописывает его строкой в историю <report>.jsonl."""
+        path = Path(path) if path else self.report_path
+        if path is None:
+            return None
+        report = self.report()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        with open(path.with_suffix('.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(report, ensure_ascii=False) + '\n')
+        logger.info(f"Отчёт о запуске сохранён: {path}")
+        return path
+
+    # ==== Хуки профилирования ====
+
+    def _profile_file(self, stage_name: str, suffix: str) -> Path:
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return self.profile_dir / f"{self.run_name}_{stage_name}_{stamp}{suffix}"
+
+    def _start_hook(self, stage_name: str):
+        if self.profile == 'cprofile':
+            prof = cProfile.Profile()
+            prof.enable()
+            return 'cprofile', prof, self._profile_file(stage_name, '.prof')
+        if self.profile == 'pyspy':
+            exe = shutil.which('py-spy')
+            if exe is None:
+                logger.warning("py-spy не найден в PATH, профилирование стадии пропущено")
+                return None
+            out = self._profile_file(stage_name, '.speedscope.json')
+            proc = subprocess.Popen(
+                [exe, 'record', '--pid', str(os.getpid()), '--format', 'speedscope', '--output', str(out)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            return 'pyspy', proc, out
+        return None
+
+    @staticmethod
+    def _stop_hook(hook):
+        if hook is None:
+            return None
+        kind, handle, out = hook
+        if kind == 'cprofile':
+            handle.disable()
+            handle.dump_stats(str(out))
+        else:
+            # py-spy сохраняет профиль по SIGINT
+            handle.send_signal(signal.SIGINT)
+            try:
+                handle.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                handle.kill()
+        return str(out)
+
+
+class _NullStage:
+    """Заглушка стадии, когда профайлер не установлен."""
+
+    def add(self, counter: str, value=1) -> None:
+        pass
+
+
+# Текущий профайлер процесса. Функции стадий обращаются к нему через get_profiler(),
+# чтобы не протаскивать объект через все вызовы.
+_current = None
+
+
+def set_profiler(profiler):
+    """Устанавливает профайлер текущего процесса и возвращает его."""
+    global _current
+    _current = profiler
+    return profiler
+
+
+def get_profiler():
+    """Профайлер текущего процесса или None."""
+    return _current
+
+
+@contextmanager
+def stage(name: str):
+    """Замер стадии текущим профайлером; без профайлера — ничего не делает."""
+    if _current is None:
+        yield _NullStage()
+    else:
+        with _current.stage(name) as record:
+            yield record
+
+
+def count(counter: str, value=1) -> None:
+    """Счётчик текущей стадии текущего профайлера."""
+    if _current is not None:
+        _current.count(counter, value)
@@ -0,0 +1,292 @@
+"""
+Метрики схожести дней и ленточный движок расстояний.
+Лента — матрица (дни, max_shift): band[k, s - 1] = расстояние от дня rows[k] до дня rows[k] - s.
+Поиск похожего дня по окнам 3..30 сводится к argmin по префиксам строк ленты (select_similar),
+поэтому любая метрика подключается к DTW-проходу без изменения остального кода.
+
+Метрики (similarity_metric в settings.yaml):
+    dtw        — DTW по матрицам дня (N_day, 7); лента считается движком dtw_engine.py (numba)
+                 или, при engine: tslearn, по парам через tslearn;
+    ddtw       — derivative DTW: DTW по оценкам производной рядов (Keogh, Pazzani);
+    soft_dtw   — soft-DTW с параметром сглаживания gamma (тем же движком или по парам через tslearn);
+    euclidean  — RMS разности дней, выровненных по слотам сессии (day_layout.pad_day, session_bars слотов),
+                 по слотам, где бары есть в обоих днях;
+    corr_rlog  — 1 - корреляция кумулятивного лог-ретёрна (r_log), интерполированного на сетку из length точек;
+    feature_dist — расстояние между распределениями признаков: среднее |разность квантилей|
+                 (одномерный Wasserstein по каждому из 7 признаков).
+Векторные метрики сводят день к представлению фиксированной формы и считают ленту
+max_shift векторными операциями; парные (DTW-семейство) считают всю ленту движком dtw_engine.py,
+а без numba или с engine: tslearn — каждую пару отдельно.
+
+Сравнение метрик по P/L и времени:
+    python similarity_metrics.py dtw euclidean corr_rlog feature_dist --out-dir metrics
+"""
+
+import argparse
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import dtw_engine
+import run_profiler
+from day_layout import pad_day, resample_day
+from vector_codec import decode_day
+
+# Индекс лог-ретёрна минуты в векторе признаков
+R_LOG = 5
+
+# Параметры метрик по умолчанию (перекрываются similarity_metric_params в settings.yaml)
+DEFAULT_PARAMS = {
+    'length': 64,  # точек сетки corr_rlog
+    'session_bars': 890,  # слотов сессии euclidean (минуты 09:00-23:50)
+    'quantiles': 9,  # число квантилей для feature_dist
+    'gamma': 1.0,  # сглаживание soft_dtw
+    'engine': 'numba',  # dtw/ddtw/soft_dtw: numba — вся лента нативным движком dtw_engine.py, tslearn — по парам
+    'precision': 'float32',  # точность движка numba: float32 или float64 (как tslearn)
+    'threads': None,  # потоков движка numba (None — все ядра)
+}
+
+
+def _derivative(matrix: np.ndarray) -> np.ndarray:
+    """Оценка производной ряда для derivative DTW: ((x_i - x_{i-1}) + (x_{i+1} - x_{i-1}) / 2) / 2."""
+    if len(matrix) < 3:
+        return np.zeros_like(matrix)
+    d = ((matrix[1:-1] - matrix[:-2]) + (matrix[2:] - matrix[:-2]) / 2) / 2
+    return np.concatenate([d[:1], d, d[-1:]])
+
+
+class Metric(ABC):
+    """
+    Метрика схожести дней: векторная (VectorMetric) или парная (PairMetric).
+    params — параметры метрики поверх DEFAULT_PARAMS.
+    """
+
+    def __init__(self, **params):
+        self.params = {**DEFAULT_PARAMS, **params}
+
+
+class VectorMetric(Metric):
+    """Векторная метрика: represent (день -> массив фиксированной формы) и distance между стопками представлений."""
+
+    vectorized = True
+
+    @abstractmethod
+    def represent(self, matrix: np.ndarray) -> np.ndarray:
+        """Представление дня фиксированной формы."""
+
+    @abstractmethod
+    def distance(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Расстояния между соответствующими строками стопок представлений a и b."""
+
+
+class PairMetric(Metric):
+    """Парная метрика: prepare (подготовка матрицы дня) и pair (расстояние пары дней)."""
+
+    vectorized = False
+
+    def prepare(self, matrix: np.ndarray) -> np.ndarray:
+        return matrix
+
+    @abstractmethod
+    def pair(self, x: np.ndarray, y: np.ndarray) -> float:
+        """Расстояние между подготовленными матрицами двух дней."""
+
+
+class DTWMetric(PairMetric):
+    def native(self) -> bool:
+        """Считать ленту нативным движком (если numba установлен)."""
+        return self.params['engine'] == 'numba' and dtw_engine.available()
+
+    def gamma(self) -> float:
+        """Сглаживание для движка: 0 — обычный DTW."""
+        return 0.0
+
+    def pair(self, x, y):
+        from tslearn.metrics import dtw
+
+        return dtw(x, y)
+
+
+class DerivativeDTWMetric(DTWMetric):
+    def prepare(self, matrix):
+        return _derivative(matrix)
+
+
+class SoftDTWMetric(DTWMetric):
+    def gamma(self):
+        return self.params['gamma']
+
+    def pair(self, x, y):
+        from tslearn.metrics import soft_dtw
+
+        return soft_dtw(x, y, gamma=self.params['gamma'])
+
+
+class EuclideanMetric(VectorMetric):
+    def represent(self, matrix):
+        return pad_day(matrix, self.params['session_bars'])
+
+    def distance(self, a, b):
+        # NaN — слот без бара хотя бы в одном из дней; без общих слотов дни несравнимы (inf)
+        sq = (a - b) ** 2
+        common = ~np.isnan(sq)
+        n = common.sum(axis=(1, 2))
+        total = np.where(common, sq, 0.0).sum(axis=(1, 2))
+        return np.where(n > 0, np.sqrt(total / np.maximum(n, 1)), np.inf)
+
+
+class CorrRlogMetric(VectorMetric):
+    def represent(self, matrix):
+        path = np.cumsum(matrix[:, R_LOG])
+        path = resample_day(path[:, None], self.params['length'])[:, 0]
+        path = path - path.mean()
+        norm = np.linalg.norm(path)
+        return path / norm if norm > 0 else path
+
+    def distance(self, a, b):
+        # у дня без движения (нулевая норма) корреляция 0
+        return 1.0 - (a * b).sum(axis=1)
+
+
+class FeatureDistMetric(VectorMetric):
+    def represent(self, matrix):
+        q = np.linspace(0.0, 1.0, self.params['quantiles'])
+        return np.quantile(matrix, q, axis=0)
+
+    def distance(self, a, b):
+        return np.abs(a - b).mean(axis=(1, 2))
+
+
+METRICS = {
+    'dtw': DTWMetric,
+    'ddtw': DerivativeDTWMetric,
+    'soft_dtw': SoftDTWMetric,
+    'euclidean': EuclideanMetric,
+    'corr_rlog': CorrRlogMetric,
+    'feature_dist': FeatureDistMetric,
+}
+
+
+def get_metric(metric='dtw', params: dict = None) -> Metric:
+    """Метрика по имени (или уже созданный объект Metric)."""
+    if isinstance(metric, Metric):
+        return metric
+    if metric not in METRICS:
+        raise ValueError(f"Неизвестная метрика схожести: {metric} (допустимы {', '.join(METRICS)})")
+    return METRICS[metric](**(params or {}))
+
+
+def metric_settings(settings: dict = None) -> tuple:
+    """Имя метрики и её параметры из settings.yaml."""
+    settings = config.get_settings(settings)
+    return settings.get('similarity_metric', 'dtw'), dict(settings.get('similarity_metric_params') or {})
+
+
+def distance_band(days: list, max_shift: int, metric='dtw', rows=None, params: dict = None) -> np.ndarray:
+    """
+    Лента расстояний (len(rows), max_shift) для матриц дней days (в любой кодировке vector_codec).
+    band[k, s - 1] — расстояние от дня rows[k] до дня rows[k] - s; inf, если такого дня нет.
+    rows — позиции дней, для которых считается лента (по умолчанию все).
+    """
+    metric = get_metric(metric, params)
+    rows = np.arange(len(days)) if rows is None else np.asarray(rows, dtype=np.int64)
+    band = np.full((len(rows), max_shift), np.inf)
+    if len(rows) == 0:
+        return band
+
+    # каждый нужный день декодируется и подготавливается один раз
+    lo = max(0, int(rows.min()) - max_shift)
+    hi = int(rows.max()) + 1
+    if metric.vectorized:
+        reps = np.stack([metric.represent(decode_day(days[j])) for j in range(lo, hi)])
+        for s in range(1, max_shift + 1):
+            valid = rows - s >= 0
+            band[valid, s - 1] = metric.distance(reps[rows[valid] - lo], reps[rows[valid] - s - lo])
+    else:
+        prepared = [metric.prepare(decode_day(days[j])) for j in range(lo, hi)]
+        if isinstance(metric, DTWMetric) and metric.native():
+            values, offsets = dtw_engine.pack_days(prepared, metric.params['precision'])
+            band = dtw_engine.dtw_band(values, offsets, rows - lo, max_shift, metric.params['threads'],
+                                       gamma=metric.gamma())
+            _count_pairs(rows, max_shift)
+            return band
+        for k, i in enumerate(rows):
+            for s in range(1, min(max_shift, i) + 1):
+                band[k, s - 1] = metric.pair(prepared[i - lo], prepared[i - s - lo])
+    _count_pairs(rows, max_shift)
+    return band
+
+
+def _count_pairs(rows: np.ndarray, max_shift: int) -> None:
+    """Счётчики прогона по геометрии ленты: посчитанные пары и пропущенные (сдвиг раньше начала истории)."""
+    computed = int(np.minimum(rows, max_shift).sum())
+    run_profiler.count("pairs_computed", computed)
+    run_profiler.count("pairs_pruned", len(rows) * max_shift - computed)
+
+
+def select_similar(band: np.ndarray, rows, min_window: int, max_window: int) -> np.ndarray:
+    """
+    Позиции наиболее похожих дней (len(rows), число окон) по ленте; -1, если истории меньше окна.
+    При равных расстояниях выбирается ближайший по времени день (первый минимум).
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    similar = np.full((len(rows), max_window - min_window + 1), -1, dtype=np.int64)
+    for k, n in enumerate(range(min_window, max_window + 1)):
+        valid = rows >= n
+        similar[valid, k] = rows[valid] - 1 - band[valid, :n].argmin(axis=1)
+    return similar
+
+
+def compare_metrics(df: pd.DataFrame, metrics, params: dict = None, out_dir=None, ticker: str = None) -> pd.DataFrame:
+    """
+    Прогоняет схожесть по каждой метрике на одном дневном датафрейме и сравнивает с выбором окна
+    как в data_processing_pl.py: итоговый P/L, P/L лучшего окна и время прохода.
+    out_dir — сохранить df_rez каждой метрики в {ticker}_similarity_{metric}.pkl (для plot_report.py).
+    """
+    from data_processing_pl import add_pl_columns, compute_pl
+    from data_processing_similarity import compute_similarity
+
+    rows = []
+    for name in metrics:
+        started = time.perf_counter()
+        df_rez = compute_similarity(df, metric=name, metric_params=params)
+        wall_s = time.perf_counter() - started
+        max_cols = [c for c in df_rez.columns if c.startswith("MAX_")]
+        totals = df_rez[max_cols].sum()
+        rows.append({
+            'METRIC': name,
+            'WALL_S': round(wall_s, 3),
+            'PL': compute_pl(add_pl_columns(df_rez.copy()))["P/L"].sum(),
+            'BEST_WINDOW': totals.idxmax(),
+            'BEST_WINDOW_PL': totals.max(),
+        })
+        if out_dir is not None:
+            Path(out_dir).mkdir(parents=True, exist_ok=True)
+            df_rez.to_pickle(Path(out_dir) / f"{ticker}_similarity_{name}.pkl")
+    return pd.DataFrame(rows)
+
+
+def main():
+    settings = config.load_settings()
+    parser = argparse.ArgumentParser(description="Сравнение метрик схожести дней по P/L и времени")
+    parser.add_argument('metrics', nargs='*', default=list(METRICS), choices=list(METRICS), metavar='metric',
+                        help=f"Метрики: {', '.join(METRICS)} (по умолчанию все)")
+    parser.add_argument('--days', type=int, default=None, help="Только последние N дней истории")
+    parser.add_argument('--out-dir', default=None, help="Каталог для pkl схожести по каждой метрике")
+    args = parser.parse_args()
+
+    from data_processing_similarity import load_daily_vectors
+
+    df = load_daily_vectors(config.artifact_path("daily_vectors", settings))
+    if args.days:
+        df = df.tail(args.days).reset_index(drop=True)
+    _, params = metric_settings(settings)
+    print(compare_metrics(df, args.metrics, params, args.out_dir, settings['ticker']).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Внутридневной потоковый режим: сопоставление незавершённого дня с историческими днями по DTW.
+Текущий день приходит по одному минутному вектору. Для каждого исторического дня хранится
+последняя строка матрицы накопленной стоимости DTW, и новая минута добавляет одну строку
+(векторно по всем историческим дням), а не пересчитывает матрицу заново.
+Расстояние — open-end DTW: префикс текущего дня сравнивается с наилучшим префиксом
+исторического дня. Стоимость та же, что у tslearn.metrics.dtw (корень из суммы квадратов
+евклидовых расстояний по пути), поэтому на полных днях результаты совпадают.
+
+Пример:
+    python streaming_dtw.py   # опрос свечей ISS текущего дня и вывод сигналов по окнам
+"""
+
+import logging
+import sqlite3
+import time as time_module
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import config
+import run_profiler
+from data_processing_similarity import MIN_WINDOW, MAX_WINDOW, prepare_daily_vectors
+from vector_codec import decode_day
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixDTW:
+    """
+    Инкрементальный open-end DTW одного растущего запроса против набора эталонных рядов.
+    references — список матриц (m_k, dim). Обновление одной минутой стоит O(K * M) векторно.
+    """
+
+    def __init__(self, references):
+        self.n_refs = len(references)
+        self.lengths = np.array([len(ref) for ref in references], dtype=np.int64)
+        max_len = int(self.lengths.max()) if self.n_refs else 0
+        dim = references[0].shape[1] if self.n_refs else 0
+
+        # Эталоны в одном массиве (K, M, dim), хвосты коротких дней заполнены NaN
+        self.refs = np.full((self.n_refs, max_len, dim), np.nan)
+        for k, ref in enumerate(references):
+            self.refs[k, :len(ref)] = ref
+        self.valid = np.arange(max_len)[None, :] < self.lengths[:, None]
+        self.reset()
+
+    def reset(self) -> None:
+        """Сбрасывает состояние (начало нового дня)."""
+        self.row = None  # последняя строка накопленной стоимости (K, M)
+        self.n_query = 0
+
+    def push(self, vec) -> np.ndarray:
+        """
+        Добавляет очередной вектор запроса и возвращает open-end расстояния до всех эталонов (K,).
+        """
+        vec = np.asarray(vec, dtype=float)
+        cost = np.sum((self.refs - vec) ** 2, axis=2)
+        cost[~self.valid] = np.inf
+
+        if self.row is None:
+            # Первая строка: путь идёт только вдоль эталона
+            new_row = np.cumsum(cost, axis=1)
+        else:
+            # D[i, j] = c[j] + min(D[i-1, j], D[i-1, j-1], D[i, j-1]).
+            # Зависимость от D[i, j-1] разворачивается в префиксный минимум:
+            # D[i, j] = S[j] + min_{k<=j}(c[k] + min(D[i-1, k], D[i-1, k-1]) - S[k]), S = cumsum(c)
+            diag = np.empty_like(self.row)
+            diag[:, 0] = np.inf
+            diag[:, 1:] = self.row[:, :-1]
+            tmp = cost + np.minimum(self.row, diag)
+            prefix = np.cumsum(np.where(self.valid, cost, 0.0), axis=1)
+            new_row = prefix + np.minimum.accumulate(tmp - prefix, axis=1)
+            new_row[~self.valid] = np.inf
+
+        self.row = new_row
+        self.n_query += 1
+        return self.open_end_distances()
+
+    def open_end_distances(self) -> np.ndarray:
+        """Расстояние префикса запроса до наилучшего префикса каждого эталона."""
+        return np.sqrt(self.row.min(axis=1))
+
+    def best_prefix_lengths(self) -> np.ndarray:
+        """Длина префикса каждого эталона, на котором достигается open-end расстояние."""
+        return self.row.argmin(axis=1) + 1
+
+    def full_distances(self) -> np.ndarray:
+        """Обычный DTW (до конца эталона) для текущего запроса."""
+        return np.sqrt(self.row[np.arange(self.n_refs), self.lengths - 1])
+
+
+class StreamingMatcher:
+    """
+    Поиск похожих дней для незавершённого текущего дня по окнам n (последние n дней истории).
+    df_daily — дневной датафрейм TRADEDATE, VECTORS, BODY, NEXT_BODY завершённых дней;
+    дни без матрицы (исключённые по качеству данных, VECTORS = None) эталонами не становятся.
+    """
+
+    def __init__(self, df_daily: pd.DataFrame, min_window: int = MIN_WINDOW, max_window: int = MAX_WINDOW):
+        df_daily = prepare_daily_vectors(df_daily.dropna(subset=["VECTORS"]), dropna=False)
+        df_daily = df_daily.tail(max_window).reset_index(drop=True)
+        self.min_window = min_window
+        self.max_window = min(max_window, len(df_daily))
+        # Эталоны в порядке shift = 1..max_window (вчера — первый)
+        self.history = df_daily.iloc[::-1].reset_index(drop=True)
+        self.dtw = PrefixDTW([decode_day(v) for v in self.history["VECTORS"]])
+        self.last_latency_ms = 0.0
+
+    def push(self, vec) -> pd.DataFrame:
+        """Добавляет минутный вектор текущего дня и возвращает лучшие совпадения по окнам."""
+        t0 = time_module.perf_counter()
+        dist = self.dtw.push(vec)
+        self.last_latency_ms = (time_module.perf_counter() - t0) * 1000
+        run_profiler.count("stream_updates")
+        return self.matches(dist)
+
+    def matches(self, dist: np.ndarray = None) -> pd.DataFrame:
+        """Для каждого окна n: наиболее похожий день, расстояние, сопоставленный префикс и сигнал."""
+        if dist is None:
+            dist = self.dtw.open_end_distances()
+        prefix = self.dtw.best_prefix_lengths()
+
+        rows = []
+        for n in range(self.min_window, self.max_window + 1):
+            # первый минимум — самый близкий по времени день, как в find_similar_days
+            k = int(np.argmin(dist[:n]))
+            body_sim = self.history.at[k, "BODY"]
+            rows.append({
+                "WINDOW": n,
+                "SIMILAR_DATE": self.history.at[k, "TRADEDATE"],
+                "DISTANCE": dist[k],
+                "MATCHED_BARS": int(prefix[k]),
+                "SIMILAR_BODY": body_sim,
+                "SIMILAR_NEXT_BODY": self.history.at[k, "NEXT_BODY"],
+                "SIGNAL": float(np.sign(body_sim)),
+            })
+        return pd.DataFrame(rows)
+
+
+def run_stream(settings: dict = None, poll_seconds: int = 60) -> None:
+    """
+    Опрашивает минутные свечи ISS текущего дня и обновляет совпадения по мере прихода баров.
+    Окно объёма продолжается из снимка {ticker}_volume_state.json (или восстанавливается по БД).
+    Контракт текущего дня берётся из торгового календаря загрузчика (front_contract_on), а не с последнего бара БД:
+    в день ролловера торгуется уже следующий контракт.
+    """
+    import requests
+
+    from minutes_bars_to_vectors_pkl import TABLE_NAME, compute_features, load_volume_stats_from_sqlite
+    from rolling_stats import RollingVolumeStats
+    from rts_download_minutes_to_db import front_contract_on, get_minute_candles, load_trading_calendar
+
+    settings = config.get_settings(settings)
+    db_path = config.db_path(settings)
+    df_daily = pd.read_pickle(config.artifact_path("daily_vectors", settings))
+    today = datetime.now().date()
+    df_daily = df_daily[pd.to_datetime(df_daily["TRADEDATE"]).dt.date < today]
+    matcher = StreamingMatcher(df_daily)
+
+    # Окно объёма на последнем баре истории
+    conn = sqlite3.connect(str(db_path))
+    last_secid, last_bar = conn.execute(
+        f"SELECT SECID, TRADEDATE FROM {TABLE_NAME} WHERE TRADEDATE < ? ORDER BY TRADEDATE DESC LIMIT 1",
+        (today.strftime("%Y-%m-%d"),),
+    ).fetchone()
+    conn.close()
+    last_bar = str(pd.Timestamp(last_bar))
+    pkl_volume_state = config.artifact_path("volume_state", settings)
+    volume_stats = RollingVolumeStats.load(pkl_volume_state) if pkl_volume_state.exists() else None
+    if volume_stats is None or volume_stats.last_tradedate != last_bar:
+        volume_stats = load_volume_stats_from_sqlite(db_path, config.bars_table(settings), until=last_bar)
+
+    last_ts = None
+    with requests.Session() as session:
+        calendar = load_trading_calendar(config.artifact_path("trading_calendar", settings))
+        secid = front_contract_on(session, settings['ticker'], calendar, today)
+        if secid is None:
+            logger.warning(f"Контракт на {today} не определён, используется {last_secid} с последнего бара БД")
+            secid = last_secid
+        elif secid != last_secid:
+            logger.info(f"Ролловер: {today} торгуется {secid}, последний бар БД — {last_secid}")
+
+        while datetime.now().date() == today:
+            from_str = (last_ts + timedelta(minutes=1)).isoformat() if last_ts is not None else None
+            df_new = get_minute_candles(session, secid, today, from_str=from_str)
+            if not df_new.empty:
+                df_new["TRADEDATE"] = pd.to_datetime(df_new["TRADEDATE"])
+                if last_ts is not None:
+                    df_new = df_new[df_new["TRADEDATE"] > last_ts]
+            if not df_new.empty:
+                # Каждый новый бар нормализуется по окну объёма за O(1)
+                df_vec = compute_features(df_new.reset_index(drop=True), volume_stats)
+                for vec in df_vec["VECTORS"]:
+                    df_matches = matcher.push(vec)
+                last_ts = df_new["TRADEDATE"].max()
+                logger.info(
+                    f"{last_ts}: баров {matcher.dtw.n_query}, обновление {matcher.last_latency_ms:.2f} мс\n"
+                    f"{df_matches.to_string()}"
+                )
+            time_module.sleep(poll_seconds)
+
+
+def main(settings: dict = None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    poll_seconds = config.get_settings(settings).get('stream_poll_seconds', 60)
+    run_stream(settings, poll_seconds=poll_seconds)
+
+
+if __name__ == "__main__":
+    main()
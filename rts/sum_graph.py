@@ -1,42 +1,42 @@
 import pandas as pd
 from pathlib import Path
-import yaml
-import matplotlib.pyplot as plt
-
-# Путь к settings.yaml
-SETTINGS_FILE = Path(__file__).parent / "settings.yaml"
-
-# Чтение настроек
-with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-    settings = yaml.safe_load(f)
-
-ticker = settings['ticker']
-PKL_DTW = fr"{ticker}_dtw_similarity_weights.pkl"
-
-# === Загрузка дневного датафрейма ===
-df = pd.read_pickle(PKL_DTW)
-df['TRADEDATE'] = pd.to_datetime(df['TRADEDATE'])
-df = df.sort_values('TRADEDATE').reset_index(drop=True)
-df.dropna(inplace=True)  # Удаление строк с NaN
-
-# === Построение графиков кумулятивной суммы ===
-columns_to_plot = [col for col in df.columns if col.startswith('MAX_')]
-
-plt.figure(figsize=(24 , 12))
-for col in columns_to_plot:
-    plt.plot(df['TRADEDATE'], df[col].cumsum(), label=col)
-
-plt.title(f'Кумулятивные суммы для {ticker}')
-plt.xlabel('Дата')
-plt.ylabel('Кумулятивная сумма')
-plt.legend()
-plt.grid(True)
-plt.tight_layout()
-# plt.show()
-
-# Сохранение графика
-output_plot = Path(__file__).parent / f"{ticker}_cumsum_plot.png"
-plt.savefig(output_plot)
-plt.close()
-
-print(f"График сохранён: {output_plot}")
\ No newline at end of file
+
+import config
+from plot_report import MAX_POINTS, plot_cumsum_report
+from run_profiler import RunProfiler, set_profiler
+
+
+def load_similarity_weights(pkl_path) -> pd.DataFrame:
+    """Загружает датафрейм MAX_n, сортирует по дате и удаляет строки с NaN."""
+    df = pd.read_pickle(pkl_path)
+    df['TRADEDATE'] = pd.to_datetime(df['TRADEDATE'])
+    df = df.sort_values('TRADEDATE').reset_index(drop=True)
+    df.dropna(inplace=True)  # Удаление строк с NaN
+    return df
+
+
+def plot_cumsum(df: pd.DataFrame, ticker: str, output_plot: Path,
+                max_points: int = MAX_POINTS, method: str = 'minmax') -> Path:
+    """График кумулятивных сумм всех MAX_ колонок (прореживание до max_points точек на кривую)."""
+    return plot_cumsum_report(df, ticker, output_plot, max_points=max_points, method=method)
+
+
+def main(settings: dict = None):
+    settings = config.get_settings(settings)
+    ticker = settings['ticker']
+
+    # === Загрузка дневного датафрейма ===
+    df = load_similarity_weights(config.artifact_path("similarity", settings))
+
+    # === Построение графиков кумулятивной суммы ===
+    output_plot = plot_cumsum(df, ticker, Path(__file__).parent / f"{ticker}_cumsum_plot.png",
+                              settings.get('plot_max_points', MAX_POINTS), settings.get('plot_decimation', 'minmax'))
+    print(f"График сохранён: {output_plot}")
+
+
+if __name__ == "__main__":
+    profiler = set_profiler(RunProfiler.from_settings(config.load_settings(), "sum_graph"))
+    try:
+        main()
+    finally:
+        profiler.write_report()
@@ -0,0 +1,110 @@
+"""
+Генератор синтетических минутных баров, похожих на фьючерс RTS.
+Бары пишутся в SQLite-таблицу Futures с той же схемой, что создаёт create_tables
+из rts_download_minutes_to_db.py, поэтому все стадии конвейера работают с ними без изменений.
+Используется бенчмарком (benchmark.py), когда настоящей БД нет под рукой.
+"""
+
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from rts_download_minutes_to_db import create_continuous_tables, create_tables, update_rolls
+
+# Коды месяцев экспирации квартальных фьючерсов
+MONTH_CODES = {3: 'H', 6: 'M', 9: 'U', 12: 'Z'}
+
+
+def contract_for_day(day: pd.Timestamp):
+    """Ближайший квартальный контракт (SECID, LSTTRADE) для торгового дня."""
+    for year in (day.year, day.year + 1):
+        for month, code in MONTH_CODES.items():
+            lsttrade = pd.Timestamp(year=year, month=month, day=15)
+            if lsttrade > day:
+                return f"RI{code}{year % 10}", lsttrade.strftime('%Y-%m-%d')
+    raise ValueError(f"Не найден контракт для {day}")
+
+
+def generate_minute_bars(
+        years: float = 1.0,
+        bars_per_day: int = 840,
+        gap_rate: float = 0.01,
+        zero_range_rate: float = 0.02,
+        start: str = '2015-01-05',
+        session_start: str = '09:00',
+        price: float = 100_000.0,
+        price_step: float = 10.0,
+        seed: int = 42) -> pd.DataFrame:
+    """
+    Генерирует минутные OHLCV бары по рабочим дням.
+    years — длина истории в годах (252 торговых дня в году),
+    bars_per_day — число минутных баров в полной сессии,
+    gap_rate — доля выброшенных баров (пропуски внутри сессии),
+    zero_range_rate — доля баров с HIGH == LOW (OPEN == CLOSE).
+    Возвращает DataFrame с колонками таблицы Futures.
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(start, periods=max(1, int(round(years * 252))))
+
+    # Сетка времени: день + смещение минуты от начала сессии
+    session_offset = pd.Timedelta(f"{session_start}:00")
+    minute_offsets = session_offset + pd.to_timedelta(np.arange(bars_per_day), unit='min')
+    tradedate = (days.values[:, None] + minute_offsets.values[None, :]).ravel()
+    n = len(tradedate)
+
+    # Случайное блуждание лог-цены, цены округлены до шага цены
+    log_ret = rng.normal(0.0, 4e-4, n)
+    close = price * np.exp(np.cumsum(log_ret))
+    open_ = np.r_[price, close[:-1]] * np.exp(rng.normal(0.0, 5e-5, n))
+    close = np.round(close / price_step) * price_step
+    open_ = np.round(open_ / price_step) * price_step
+    wick = np.round(np.abs(rng.normal(0.0, 2e-4, (2, n))) * close / price_step) * price_step
+    high = np.maximum(open_, close) + wick[0]
+    low = np.minimum(open_, close) - wick[1]
+
+    # Бары с нулевым диапазоном
+    flat = rng.random(n) < zero_range_rate
+    open_[flat] = close[flat]
+    high[flat] = close[flat]
+    low[flat] = close[flat]
+
+    volume = np.maximum(1, rng.lognormal(3.0, 1.0, n)).astype(np.int64)
+
+    df = pd.DataFrame({
+        'TRADEDATE': pd.DatetimeIndex(tradedate).strftime('%Y-%m-%d %H:%M:%S'),
+        'OPEN': open_,
+        'LOW': low,
+        'HIGH': high,
+        'CLOSE': close,
+        'VOLUME': volume,
+    })
+
+    # Контракт и дата экспирации по дню бара
+    contracts = pd.DataFrame([contract_for_day(day) for day in days], columns=['SECID', 'LSTTRADE'])
+    day_idx = np.repeat(np.arange(len(days)), bars_per_day)
+    df['SECID'] = contracts['SECID'].values[day_idx]
+    df['LSTTRADE'] = contracts['LSTTRADE'].values[day_idx]
+
+    # Пропуски баров
+    keep = rng.random(n) >= gap_rate
+    df = df[keep].reset_index(drop=True)
+
+    return df[['TRADEDATE', 'SECID', 'OPEN', 'LOW', 'HIGH', 'CLOSE', 'VOLUME', 'LSTTRADE']]
+
+
+def write_minute_db(df: pd.DataFrame, db_path) -> Path:
+    """Создаёт таблицу Futures (схема create_tables), записывает в неё бары и строит календарь ролловеров."""
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(db_path))
+    try:
+        create_tables(connection)
+        create_continuous_tables(connection)
+        with connection:
+            df.to_sql('Futures', connection, if_exists='append', index=False)
+        update_rolls(connection)
+    finally:
+        connection.close()
+    return db_path
@@ -3,25 +3,12 @@
 """
 
 import pandas as pd
-import yaml
-from pathlib import Path
 
-# Путь к settings.yaml в той же директории, что и скрипт
-SETTINGS_FILE = Path(__file__).parent / "settings.yaml"
+import config
 
-# Чтение настроек
-with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-    settings = yaml.safe_load(f)
 
-# ==== Параметры ====
-ticker = settings['ticker']
-
-PKL_FILE_LST = [
-    fr"{ticker}_futures_minute_2015_vectors.pkl",
-    fr"{ticker}_futures_daily_vectors.pkl",
-]
-
-for file in PKL_FILE_LST:
+def show_pkl(file) -> None:
+    """Печатает начало и конец DataFrame из pkl и пример вектора."""
     # Загрузка DataFrame из pkl
     df = pd.read_pickle(file)
 
@@ -41,3 +28,17 @@ for file in PKL_FILE_LST:
     print(df["VECTORS"].dtype)
     print("\nПример вектора (первая строка):")
     print(df["VECTORS"].iloc[0])
+
+
+def main(settings: dict = None):
+    PKL_FILE_LST = [
+        config.artifact_path("minute_vectors", settings),
+        config.artifact_path("daily_vectors", settings),
+    ]
+
+    for file in PKL_FILE_LST:
+        show_pkl(file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Компактное хранение матриц минутных векторов дня (N_day, 7).
+Режимы (vector_storage в settings.yaml):
+    float32 — как есть (4 байта на признак);
+    float16 — половинная точность (2 байта);
+    q16 / q8 — поканальное квантование в uint16 / uint8 с фиксированными scale/offset на признак.
+Диапазоны признаков известны заранее: rO, rC, r_body, r_up, r_down лежат в [0, 1],
+лог-ретёрн минуты обрезается до ±LOG_RETURN_LIMIT, z-score объёма в окне из VOLUME_WINDOW баров
+по модулю не больше sqrt(VOLUME_WINDOW - 1). Поэтому scale/offset не зависят от данных,
+режим однозначно определяется dtype матрицы, и дни в разных кодировках можно смешивать
+(например, старые дни из pkl и новые дни демона). DTW работает на decode_day — деквантование на лету.
+"""
+
+import math
+
+import numpy as np
+
+from minutes_bars_to_vectors_pkl import VOLUME_WINDOW
+
+STORAGE_MODES = ('float32', 'float16', 'q16', 'q8')
+
+# Граница лог-ретёрна минуты для квантования (1% за минуту)
+LOG_RETURN_LIMIT = 0.01
+
+# Диапазоны признаков [rO, rC, r_body, r_up, r_down, r_log, V_tilde]
+_Z_LIMIT = math.sqrt(VOLUME_WINDOW - 1)
+FEATURE_RANGES = np.array(
+    [[0.0, 1.0]] * 5 + [[-LOG_RETURN_LIMIT, LOG_RETURN_LIMIT], [-_Z_LIMIT, _Z_LIMIT]]
+)
+
+# Максимальный код чётный, поэтому середина симметричного диапазона (ноль) кодируется точно
+_QUANT_DTYPES = {'q16': np.uint16, 'q8': np.uint8}
+_MAX_CODE = {np.dtype(np.uint16): 65534, np.dtype(np.uint8): 254}
+
+OFFSET = FEATURE_RANGES[:, 0]
+
+
+def _scale(dtype) -> np.ndarray:
+    return (FEATURE_RANGES[:, 1] - FEATURE_RANGES[:, 0]) / _MAX_CODE[np.dtype(dtype)]
+
+
+def encode_day(matrix, storage: str = 'float32') -> np.ndarray:
+    """Кодирует матрицу дня (N_day, 7) в режиме storage."""
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"Неизвестный режим хранения векторов: {storage} (допустимы {', '.join(STORAGE_MODES)})")
+    matrix = np.asarray(matrix)
+    if storage in ('float32', 'float16'):
+        return matrix.astype(storage)
+    dtype = _QUANT_DTYPES[storage]
+    codes = np.rint((matrix.astype(np.float64) - OFFSET) / _scale(dtype))
+    return np.clip(codes, 0, _MAX_CODE[np.dtype(dtype)]).astype(dtype)
+
+
+def decode_day(matrix) -> np.ndarray:
+    """Матрица дня в float64 для DTW; квантованные коды переводятся обратно по scale/offset."""
+    matrix = np.asarray(matrix)
+    if matrix.dtype in _MAX_CODE:
+        return matrix * _scale(matrix.dtype) + OFFSET
+    return matrix.astype(np.float64)
@@ -0,0 +1,205 @@
+"""
+Walk-forward оценка выбора окна схожести по готовой таблице MAX_n (без повторного DTW).
+История делится на тестовые фолды по test_days дней (settings.yaml); для каждого фолда окно n выбирается
+по сумме MAX_n на обучающем отрезке перед ним (все прошлые дни или последние walk_forward_train_days)
+и оценивается на самом фолде. Суммы по отрезкам берутся из накопленных сумм таблицы, поэтому все фолды
+считаются одной векторной операцией; несколько файлов схожести (метрики, конфигурации) обрабатываются
+параллельно в процессах.
+С test_days=1, train_days=22 и min_train_days=1 результат совпадает с data_processing_pl.py.
+
+Примеры:
+    python walk_forward.py
+    python walk_forward.py metrics/*.pkl --test-days 22 --train-days 250 --workers 4
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import run_profiler
+from run_profiler import RunProfiler, set_profiler
+from sum_graph import load_similarity_weights
+
+# Длина тестового фолда по умолчанию (test_days в settings.yaml)
+TEST_DAYS = 22
+
+
+def walk_forward_params(settings: dict = None) -> dict:
+    """Параметры фолдов из settings.yaml: test_days, walk_forward_train_days, walk_forward_min_train_days."""
+    settings = config.get_settings(settings)
+    return {
+        'test_days': settings.get('test_days', TEST_DAYS),
+        'train_days': settings.get('walk_forward_train_days'),
+        'min_train_days': settings.get('walk_forward_min_train_days'),
+    }
+
+
+def make_folds(n_days: int, test_days: int = TEST_DAYS, train_days: int = None,
+               min_train_days: int = None) -> pd.DataFrame:
+    """
+    Границы фолдов [TRAIN_LO, TRAIN_HI) и [TEST_LO, TEST_HI) в позициях дней.
+    train_days=None — обучение на всей истории до фолда, иначе на последних train_days днях.
+    min_train_days — дней истории до первого фолда (по умолчанию test_days).
+    """
+    min_train = test_days if min_train_days is None else min_train_days
+    test_lo = np.arange(min_train, n_days, test_days, dtype=np.int64)
+    train_lo = np.zeros_like(test_lo) if train_days is None else np.maximum(0, test_lo - train_days)
+    return pd.DataFrame({
+        'TRAIN_LO': train_lo,
+        'TRAIN_HI': test_lo,
+        'TEST_LO': test_lo,
+        'TEST_HI': np.minimum(test_lo + test_days, n_days),
+    })
+
+
+def walk_forward(df_rez: pd.DataFrame, test_days: int = TEST_DAYS, train_days: int = None,
+                 min_train_days: int = None, require_positive: bool = True) -> tuple:
+    """
+    Walk-forward по таблице TRADEDATE, MAX_n.
+    Окно фолда — argmax суммы MAX_n на обучении (при равенстве — меньшее n, как idxmax в data_processing_pl.py);
+    require_positive — если лучшая сумма на обучении не больше 0, фолд пропускается (P/L 0).
+    Возвращает (таблица фолдов, дневной P/L тестовых дней TRADEDATE, FOLD, WINDOW, P/L).
+    """
+    max_cols = [c for c in df_rez.columns if c.startswith("MAX_")]
+    windows = np.array([int(c.split("_")[1]) for c in max_cols])
+    values = df_rez[max_cols].to_numpy(dtype=float)
+    dates = df_rez["TRADEDATE"].to_numpy()
+
+    with run_profiler.stage("walk_forward") as st:
+        folds = make_folds(len(values), test_days, train_days, min_train_days)
+        csum = np.vstack([np.zeros((1, len(max_cols))), np.cumsum(values, axis=0)])
+        train_pl = csum[folds['TRAIN_HI']] - csum[folds['TRAIN_LO']]  # (фолды, окна)
+        best = train_pl.argmax(axis=1)
+        rows = np.arange(len(folds))
+        best_pl = train_pl[rows, best]
+        active = best_pl > 0 if require_positive else np.ones(len(folds), dtype=bool)
+        test_pl = np.where(active, csum[folds['TEST_HI'], best] - csum[folds['TEST_LO'], best], 0.0)
+
+        # Дневной P/L: фолды идут подряд, поэтому тестовые дни — непрерывный отрезок
+        fold_of_day = np.repeat(rows, folds['TEST_HI'] - folds['TEST_LO'])
+        days = np.arange(len(fold_of_day)) + (folds['TEST_LO'].iloc[0] if len(folds) else 0)
+        daily_pl = np.where(active[fold_of_day], values[days, best[fold_of_day]], 0.0)
+        st.add("folds", len(folds))
+        st.add("days", len(days))
+
+    df_folds = pd.DataFrame({
+        'FOLD': rows,
+        'TRAIN_FROM': dates[folds['TRAIN_LO']] if len(folds) else [],
+        'TRAIN_TILL': dates[folds['TRAIN_HI'] - 1] if len(folds) else [],
+        'TEST_FROM': dates[folds['TEST_LO']] if len(folds) else [],
+        'TEST_TILL': dates[folds['TEST_HI'] - 1] if len(folds) else [],
+        'WINDOW': np.where(active, windows[best], 0) if len(folds) else [],
+        'TRAIN_PL': best_pl,
+        'TEST_PL': test_pl,
+    })
+    df_daily = pd.DataFrame({
+        'TRADEDATE': dates[days],
+        'FOLD': fold_of_day,
+        'WINDOW': np.where(active[fold_of_day], windows[best[fold_of_day]], 0),
+        'P/L': daily_pl,
+    })
+    return df_folds, df_daily
+
+
+def summarize(df_folds: pd.DataFrame, df_daily: pd.DataFrame) -> dict:
+    """Итог walk-forward: суммарный P/L тестовых дней, доля прибыльных фолдов, просадка и частое окно."""
+    cum = df_daily['P/L'].cumsum()
+    traded = df_folds['WINDOW'] > 0
+    return {
+        'FOLDS': len(df_folds),
+        'TEST_DAYS': len(df_daily),
+        'TOTAL_PL': float(df_daily['P/L'].sum()),
+        'MEAN_FOLD_PL': float(df_folds['TEST_PL'].mean()) if len(df_folds) else 0.0,
+        'WIN_FOLDS': float((df_folds.loc[traded, 'TEST_PL'] > 0).mean()) if traded.any() else 0.0,
+        'TRADED_FOLDS': int(traded.sum()),
+        'MAX_DRAWDOWN': float((cum.cummax().clip(lower=0) - cum).max()) if len(cum) else 0.0,
+        'TOP_WINDOW': int(df_folds.loc[traded, 'WINDOW'].mode().iloc[0]) if traded.any() else 0,
+    }
+
+
+def _run_file(job: dict) -> dict:
+    """Walk-forward одного файла схожести (выполняется в дочернем процессе)."""
+    df_folds, df_daily = walk_forward(load_similarity_weights(job['similarity']), job['test_days'],
+                                      job['train_days'], job['min_train_days'])
+    if job.get('out_dir'):
+        out_dir = Path(job['out_dir'])
+        out_dir.mkdir(parents=True, exist_ok=True)
+        df_folds.to_pickle(out_dir / f"{Path(job['similarity']).stem}_walk_forward.pkl")
+    return {'SIMILARITY': Path(job['similarity']).name, **summarize(df_folds, df_daily)}
+
+
+def run_batch(similarity_files, test_days: int = TEST_DAYS, train_days: int = None, min_train_days: int = None,
+              workers: int = None, out_dir=None) -> pd.DataFrame:
+    """Walk-forward по набору файлов схожести параллельно в workers процессах; таблица итогов по файлам."""
+    jobs = [
+        {'similarity': str(path), 'test_days': test_days, 'train_days': train_days,
+         'min_train_days': min_train_days, 'out_dir': str(out_dir) if out_dir else None}
+        for path in similarity_files
+    ]
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(jobs) == 1:
+        results = [_run_file(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run_file, jobs))
+    return pd.DataFrame(results)
+
+
+def main(settings: dict = None):
+    settings = config.get_settings(settings)
+    ticker = settings['ticker']
+    params = walk_forward_params(settings)
+    test_days = params['test_days']
+
+    df_folds, df_daily = walk_forward(load_similarity_weights(config.artifact_path("similarity", settings)), **params)
+    df_folds.to_pickle(config.artifact_path("walk_forward", settings))
+
+    with pd.option_context("display.width", 1000, "display.max_columns", 20, "display.min_rows", 30):
+        print(df_folds)
+    for name, value in summarize(df_folds, df_daily).items():
+        print(f"{name:<14} {value}")
+
+    # График кумулятивного P/L тестовых дней
+    from plot_report import decimate, render_curves
+
+    with run_profiler.stage("plotting"):
+        cum = df_daily[["P/L"]].cumsum().to_numpy(dtype=float)
+        output_plot = Path(__file__).parent / f"{ticker}_walk_forward_plot.png"
+        render_curves(decimate(df_daily["TRADEDATE"].to_numpy(), cum, settings.get('plot_max_points', 2000),
+                               settings.get('plot_decimation', 'minmax')),
+                      [None], f"{ticker} walk-forward: фолды по {test_days} дней", output_plot,
+                      figsize=(10, 5), xlabel="TRADEDATE", ylabel="Cumulative P/L")
+    print(f"График сохранён: {output_plot}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Walk-forward оценка выбора окна по таблицам схожести")
+    parser.add_argument('similarity', nargs='*', help="pkl файлы схожести (по умолчанию — файл стадии similarity)")
+    parser.add_argument('--test-days', type=int, default=None, help="Длина фолда (по умолчанию test_days)")
+    parser.add_argument('--train-days', type=int, default=None,
+                        help="Длина обучения (по умолчанию walk_forward_train_days; не задано — вся история)")
+    parser.add_argument('--min-train-days', type=int, default=None,
+                        help="Дней истории до первого фолда (по умолчанию walk_forward_min_train_days или test_days)")
+    parser.add_argument('--workers', type=int, default=None, help="Число процессов (по умолчанию — все ядра)")
+    parser.add_argument('--out-dir', default=None, help="Каталог для таблиц фолдов каждого файла")
+    args = parser.parse_args()
+
+    settings = config.load_settings()
+    profiler = set_profiler(RunProfiler.from_settings(settings, "walk_forward"))
+    try:
+        if not args.similarity:
+            main(settings)
+        else:
+            # Параметры командной строки поверх settings.yaml — те же фолды, что и у main
+            params = walk_forward_params(settings)
+            for name in params:
+                if getattr(args, name) is not None:
+                    params[name] = getattr(args, name)
+            print(run_batch(args.similarity, **params, workers=args.workers, out_dir=args.out_dir).to_string(index=False))
+    finally:
+        profiler.write_report()
@@ -0,0 +1,43 @@
+"""
+Общие фикстуры тестов: модули конвейера лежат плоско в rts/, синтетическая БД строится synthetic_bars.py.
+"""
+
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+RTS_DIR = Path(__file__).resolve().parent.parent / "rts"
+sys.path.insert(0, str(RTS_DIR))
+
+import config  # noqa: E402
+from synthetic_bars import generate_minute_bars, write_minute_db  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(tmp_path_factory):
+    """SQLite с синтетическими минутными барами: 60 торговых дней по 120 баров."""
+    path = tmp_path_factory.mktemp("db") / "RTS_futures_minute.db"
+    return write_minute_db(generate_minute_bars(years=60 / 252, bars_per_day=120, seed=7), path)
+
+
+@pytest.fixture
+def minute_db(synthetic_db, tmp_path):
+    """Копия синтетической БД, которую тест может менять."""
+    return Path(shutil.copy(synthetic_db, tmp_path / synthetic_db.name))
+
+
+@pytest.fixture
+def settings(synthetic_db, tmp_path, monkeypatch):
+    """settings.yaml репозитория поверх синтетической БД; артефакты пишутся во временный каталог, кэш выключен."""
+    monkeypatch.chdir(tmp_path)
+    return {
+        **config.load_settings(),
+        'path_db_minute': str(synthetic_db),
+        'artifact_cache_dir': "",
+        'continuous_prices': False,
+        'quality_exclude': False,
+        'out_of_core_chunk_rows': 1000,
+        'similarity_checkpoint_every': 10,
+    }
@@ -0,0 +1,63 @@
+"""
+Кэш промежуточных файлов (artifact_cache.py): отпечаток БД и выдача файлов стадии по ключу.
+"""
+
+import sqlite3
+
+import pytest
+
+import artifact_cache
+import config
+from artifact_cache import ArtifactCache, db_fingerprint
+from run_profiler import RunProfiler, set_profiler
+
+
+@pytest.fixture
+def profiler():
+    yield set_profiler(RunProfiler("test"))
+    set_profiler(None)
+
+
+def test_fingerprint_is_persisted_next_to_db(minute_db, profiler):
+    first = db_fingerprint(minute_db, config.BARS_TABLE)
+    assert profiler.counters == {'db_fingerprint_scans': 1}
+    assert artifact_cache._fingerprint_path(minute_db).exists()
+
+    # Новый процесс (пустой lru_cache) берёт отпечаток неизменной БД из файла рядом с ней
+    artifact_cache._db_fingerprint.cache_clear()
+    assert db_fingerprint(minute_db, config.BARS_TABLE) == first
+    assert profiler.counters == {'db_fingerprint_scans': 1}
+
+    # Правка бара меняет размер или mtime файла — таблица читается заново и ключ меняется
+    with sqlite3.connect(minute_db) as connection:
+        connection.execute("UPDATE Futures SET CLOSE = CLOSE + 1 "
+                           "WHERE TRADEDATE = (SELECT MAX(TRADEDATE) FROM Futures)")
+    assert db_fingerprint(minute_db, config.BARS_TABLE) != first
+    assert profiler.counters == {'db_fingerprint_scans': 2}
+
+    # Отпечаток склеенного ряда хранится отдельно от таблицы баров
+    db_fingerprint(minute_db, config.CONTINUOUS_VIEW)
+    artifact_cache._db_fingerprint.cache_clear()
+    db_fingerprint(minute_db, config.BARS_TABLE)
+    db_fingerprint(minute_db, config.CONTINUOUS_VIEW)
+    assert profiler.counters == {'db_fingerprint_scans': 3}
+
+
+def test_corrupt_fingerprint_file_is_rescanned(minute_db):
+    first = db_fingerprint(minute_db, config.BARS_TABLE)
+    artifact_cache._fingerprint_path(minute_db).write_text("{", encoding='utf-8')
+    artifact_cache._db_fingerprint.cache_clear()
+    assert db_fingerprint(minute_db, config.BARS_TABLE) == first
+
+
+def test_fetch_restores_stored_files(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache")
+    target = tmp_path / "stage.pkl"
+    target.write_bytes(b"result")
+    assert not cache.fetch("k1", {'stage': target})
+    cache.store("k1", {'stage': target})
+
+    target.write_bytes(b"other")
+    assert cache.fetch("k1", {'stage': target})
+    assert target.read_bytes() == b"result"
+    assert not cache.fetch("k2", {'stage': target})
@@ -0,0 +1,47 @@
+"""
+Единая точка входа (cli.py): модули импортируются без побочных эффектов, стадии вызываются повторно.
+"""
+
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import cli
+import config
+from conftest import RTS_DIR
+
+IMPORT_ALL = f"""
+import importlib, pkgutil, sys
+sys.path.insert(0, {str(RTS_DIR)!r})
+import cli
+assert 'pandas' not in sys.modules, 'cli импортирует pandas при старте'
+for module in pkgutil.iter_modules([{str(RTS_DIR)!r}]):
+    importlib.import_module(module.name)
+heavy = [name for name in ('tslearn', 'matplotlib') if name in sys.modules]
+assert not heavy, heavy
+"""
+
+
+def test_modules_import_without_side_effects(tmp_path):
+    """Импорт любого модуля не запускает стадии, не пишет логов и файлов и не тянет tslearn/matplotlib."""
+    result = subprocess.run([sys.executable, "-c", IMPORT_ALL], cwd=tmp_path, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_help_lists_all_commands(capsys):
+    with pytest.raises(SystemExit) as exc:
+        cli.main(["--help"])
+    assert exc.value.code == 0
+    out = capsys.readouterr().out
+    assert all(name in out for name in cli.STAGES)
+
+
+def test_stages_can_be_rerun_in_one_process(settings):
+    """Долгоживущий процесс вызывает стадии повторно и получает тот же результат."""
+    cli.run_pipeline(["minute-vectors", "daily-vectors", "similarity"], settings)
+    first = pd.read_pickle(config.artifact_path("similarity", settings))
+    cli.run_pipeline(["minute-vectors", "daily-vectors", "similarity"], settings)
+    pd.testing.assert_frame_equal(pd.read_pickle(config.artifact_path("similarity", settings)), first)
@@ -0,0 +1,123 @@
+"""
+Демон (daemon.py): инкрементальное обновление после загрузки совпадает с пакетными стадиями.
+"""
+
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import config
+import daemon
+import data_processing_similarity
+import minutes_bars_to_vectors_pkl
+import minutes_vectors_to_days_vectors
+import rts_download_minutes_to_db
+from rolling_stats import RollingVolumeStats
+
+STAGE_ARTIFACTS = ("minute_vectors", "volume_state", "daily_vectors", "similarity", "day_quality")
+
+
+def run_stages(settings) -> dict:
+    """Пакетные стадии minute-vectors → daily-vectors → similarity; возвращает их результаты."""
+    minutes_bars_to_vectors_pkl.main(settings)
+    minutes_vectors_to_days_vectors.main(settings)
+    data_processing_similarity.main(settings)
+    return {kind: pd.read_pickle(config.artifact_path(kind, settings)) for kind in ("minute_vectors", "daily_vectors", "similarity")}
+
+
+class FakeDownloader:
+    """rts_download_minutes_to_db.main: дописывает отложенные бары в БД и возвращает самый ранний из них."""
+
+    def __init__(self, path_db, rows):
+        self.path_db = path_db
+        self.rows = rows
+        self.calls = 0
+
+    def __call__(self, settings=None, vacuum=True, **kwargs):
+        self.calls += 1
+        if not self.rows:
+            return None
+        with sqlite3.connect(self.path_db) as connection:
+            connection.executemany(f"INSERT INTO Futures VALUES ({', '.join('?' * len(self.rows[0]))})", self.rows)
+        first_inserted = min(r[0] for r in self.rows)
+        self.rows = []
+        return first_inserted
+
+
+def hold_back(path_db, where: str, params=()) -> list:
+    """Удаляет бары по условию из БД и возвращает их для FakeDownloader."""
+    with sqlite3.connect(path_db) as connection:
+        rows = connection.execute(f"SELECT * FROM Futures WHERE {where}", params).fetchall()
+        connection.execute(f"DELETE FROM Futures WHERE {where}", params)
+    return rows
+
+
+def stages_without(settings, minute_db, where: str, params=()) -> tuple:
+    """Эталон пакетных стадий по полной БД, затем pkl файлы стадий по БД без баров where (они отложены)."""
+    settings = {**settings, 'path_db_minute': str(minute_db)}
+    expected = run_stages(settings)
+    for kind in STAGE_ARTIFACTS:
+        config.artifact_path(kind, settings).unlink()
+    rows = hold_back(minute_db, where, params)
+    run_stages(settings)
+    return settings, expected, FakeDownloader(minute_db, rows)
+
+
+def trading_days(path_db) -> list:
+    with sqlite3.connect(path_db) as connection:
+        return [r[0] for r in connection.execute("SELECT DISTINCT DATE(TRADEDATE) FROM Futures ORDER BY 1")]
+
+
+@pytest.fixture
+def daemon_settings(settings, minute_db):
+    """pkl файлы стадий по БД без последних трёх дней."""
+    return stages_without(settings, minute_db, "DATE(TRADEDATE) >= ?", (trading_days(minute_db)[-3],))
+
+
+def assert_matches(settings, expected):
+    for kind, df in expected.items():
+        pd.testing.assert_frame_equal(pd.read_pickle(config.artifact_path(kind, settings)), df)
+
+
+def test_once_downloads_once_and_matches_stages(daemon_settings, monkeypatch):
+    settings, expected, downloader = daemon_settings
+    monkeypatch.setattr(rts_download_minutes_to_db, "main", downloader)
+    monkeypatch.setattr(rts_download_minutes_to_db, "setup_logging", lambda **kwargs: None)
+
+    daemon.main(settings, once=True)
+    assert downloader.calls == 1
+    assert_matches(settings, expected)
+
+    # Минутные векторы сохранены вместе с окном объёма: следующий запуск продолжает без пересчёта
+    df_minute = pd.read_pickle(config.artifact_path("minute_vectors", settings))
+    assert str(df_minute["TRADEDATE"].max()) == \
+        RollingVolumeStats.load(config.artifact_path("volume_state", settings)).last_tradedate
+
+
+def test_backfilled_interior_days_are_recomputed(settings, minute_db, monkeypatch):
+    """Загрузка закрыла пропуск внутри истории: минутные векторы, окно объёма и схожесть пересчитаны с него."""
+    days = trading_days(minute_db)
+    settings, expected, downloader = stages_without(
+        settings, minute_db, "DATE(TRADEDATE) BETWEEN ? AND ?", (days[40], days[42]))
+    monkeypatch.setattr(rts_download_minutes_to_db, "main", downloader)
+    monkeypatch.setattr(rts_download_minutes_to_db, "setup_logging", lambda **kwargs: None)
+
+    daemon.main(settings, once=True)
+    assert downloader.calls == 1
+    assert_matches(settings, expected)
+
+
+def test_poll_schedule_stops_after_complete_session(settings):
+    pipeline = daemon.PipelineDaemon({**settings, 'daemon_ready_time': '19:05', 'daemon_poll_seconds': 300})
+    pipeline.df_minute = pd.DataFrame({'TRADEDATE': pd.to_datetime(["2015-03-16 10:00", "2015-03-16 18:45"])})
+
+    assert pipeline.next_poll(datetime(2015, 3, 16, 12, 0)) == datetime(2015, 3, 16, 19, 5)
+    assert pipeline.next_poll(datetime(2015, 3, 16, 20, 0)) == datetime(2015, 3, 16, 20, 5)
+    assert pipeline.next_poll(datetime(2015, 3, 16, 23, 58)) == datetime(2015, 3, 17, 0, 0)
+
+    # Бар конца вечерней сессии получен: до daemon_ready_time следующего дня ISS не опрашивается
+    pipeline.df_minute.loc[2] = pd.Timestamp("2015-03-16 23:49")
+    assert pipeline.session_complete(datetime(2015, 3, 16).date())
+    assert pipeline.next_poll(datetime(2015, 3, 16, 23, 55)) == datetime(2015, 3, 17, 19, 5)
@@ -0,0 +1,110 @@
+"""
+Проверка качества баров (data_quality.py): флаги, таблица качества дней и исключение дней из схожести.
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import config
+import data_processing_similarity
+import minutes_bars_to_vectors_pkl
+import minutes_vectors_to_days_vectors
+import out_of_core
+from data_quality import clean_bars, compute_day_quality, flag_bars
+from minutes_bars_to_vectors_pkl import load_ohlcv_from_sqlite
+
+
+def bars(day: str, secid: str, closes, start: str = "10:00") -> pd.DataFrame:
+    """Бары дня с OPEN = CLOSE предыдущего бара дня и диапазоном 10 пунктов."""
+    closes = np.asarray(closes, dtype=float)
+    opens = np.r_[closes[0], closes[:-1]]
+    return pd.DataFrame({
+        'TRADEDATE': pd.date_range(f"{day} {start}", periods=len(closes), freq="min"),
+        'SECID': secid,
+        'OPEN': opens,
+        'LOW': np.minimum(opens, closes) - 5,
+        'HIGH': np.maximum(opens, closes) + 5,
+        'CLOSE': closes,
+        'VOLUME': 10,
+    })
+
+
+def test_roll_and_overnight_jump_are_flagged():
+    """Ролловер через ночь: смена SECID и скачок открытия к закрытию предыдущего дня."""
+    df = pd.concat([
+        bars("2015-03-13", "RIH5", np.full(100, 100_000.0)),
+        bars("2015-03-16", "RIM5", np.full(100, 108_000.0)),
+        bars("2015-03-17", "RIM5", np.full(100, 108_500.0)),
+    ], ignore_index=True)
+    flags = flag_bars(df)
+    assert flags['ROLL'].sum() == 1 and flags.at[100, 'ROLL']
+    assert flags['JUMP'].sum() == 1 and flags.at[100, 'JUMP']
+    assert not flags['SPIKE'].any()
+
+    quality = compute_day_quality(df)
+    assert quality['ROLLS'].tolist() == [0, 1, 0]
+    assert quality.at[1, 'OPEN_JUMP'] == pytest.approx(np.log(1.08), rel=1e-6)
+    assert quality['EXCLUDE'].tolist() == [False, True, False]
+    assert quality.at[1, 'REASON'] == 'jump'
+
+    # Та же таблица по части истории с последним баром перед ней
+    tail = compute_day_quality(df.iloc[100:], previous=df.iloc[:100])
+    pd.testing.assert_frame_equal(tail, quality.iloc[1:].reset_index(drop=True))
+
+
+def test_clean_bars_drops_only_exact_duplicates_and_empty_bars():
+    df = bars("2015-03-13", "RIH5", np.linspace(100_000, 100_100, 10))
+    df = pd.concat([df, df.iloc[[3]], df.iloc[[1]].assign(CLOSE=100_500.0)], ignore_index=True)
+    df.loc[5, 'VOLUME'] = None
+    cleaned, counts = clean_bars(df)
+    assert len(cleaned) == len(df) - 2  # дубль строки и бар без объёма
+    assert counts['DUPLICATE'] == 2
+    assert counts['OUT_OF_ORDER'] >= 1
+
+
+def test_synthetic_db_roll_is_detected(synthetic_db):
+    df = load_ohlcv_from_sqlite(str(synthetic_db), config.BARS_TABLE)
+    quality = compute_day_quality(df)
+    roll_days = quality.loc[quality['ROLLS'] > 0, 'TRADEDATE'].tolist()
+    first_bars = df.groupby('SECID')['TRADEDATE'].min().sort_values()
+    assert roll_days == [t.date() for t in first_bars.iloc[1:]]
+
+
+@pytest.fixture
+def short_days_settings(settings, minute_db):
+    """Синтетическая БД, в которой у трёх дней осталось по 30 баров, и исключение дней включено."""
+    with sqlite3.connect(minute_db) as connection:
+        days = [r[0] for r in connection.execute(
+            "SELECT DISTINCT DATE(TRADEDATE) FROM Futures ORDER BY 1")][35:50:6]
+        for day in days:
+            connection.execute("DELETE FROM Futures WHERE DATE(TRADEDATE) = ? AND TIME(TRADEDATE) >= '09:30:00'",
+                               (day,))
+    return {**settings, 'path_db_minute': str(minute_db), 'quality_exclude': True}, days
+
+
+def test_excluded_days_are_not_built_or_compared(short_days_settings):
+    settings, days = short_days_settings
+    minutes_bars_to_vectors_pkl.main(settings)
+    minutes_vectors_to_days_vectors.main(settings)
+    data_processing_similarity.main(settings)
+
+    quality = pd.read_pickle(config.artifact_path("day_quality", settings))
+    excluded = {d.isoformat() for d in quality.loc[quality['EXCLUDE'], 'TRADEDATE']}
+    assert excluded == set(days)
+
+    # Матрицы исключённых дней не строятся, BODY и NEXT_BODY остальных дней на месте
+    df_daily = pd.read_pickle(config.artifact_path("daily_vectors", settings))
+    no_vectors = {d.isoformat() for d in df_daily.loc[df_daily['VECTORS'].isna(), 'TRADEDATE']}
+    assert no_vectors == excluded
+    assert df_daily['BODY'].notna().all()
+
+    df_rez = pd.read_pickle(config.artifact_path("similarity", settings))
+    assert not set(df_rez['TRADEDATE'].dt.date.astype(str)) & excluded
+
+    # Режим вне памяти: та же таблица качества и та же схожесть
+    out_of_core.main(settings)
+    pd.testing.assert_frame_equal(pd.read_pickle(config.artifact_path("day_quality", settings)), quality)
+    pd.testing.assert_frame_equal(pd.read_pickle(config.artifact_path("similarity", settings)), df_rez)
@@ -0,0 +1,75 @@
+"""
+Экспорт тензора (days_vectors_to_tensor.py): выравнивание по минутам сессии, интерполяция, индекс и батчи.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import config
+import days_vectors_to_tensor
+import minutes_bars_to_vectors_pkl
+import minutes_vectors_to_days_vectors
+from day_layout import resample_day
+from days_vectors_to_tensor import iter_batches, load_tensor
+
+
+@pytest.fixture
+def stages(settings):
+    """Минутные и дневные векторы стадий — эталон для тензора, который строится потоком из БД."""
+    minutes_bars_to_vectors_pkl.main(settings)
+    minutes_vectors_to_days_vectors.main(settings)
+    df_minute = pd.read_pickle(config.artifact_path("minute_vectors", settings))
+    df_daily = pd.read_pickle(config.artifact_path("daily_vectors", settings))
+    return df_minute, df_daily
+
+
+def test_align_places_bars_at_session_minutes(settings, stages):
+    df_minute, df_daily = stages
+    days_vectors_to_tensor.main(settings)
+    tensor, mask, index = load_tensor(settings)
+
+    minutes = df_minute["TRADEDATE"].dt.hour * 60 + df_minute["TRADEDATE"].dt.minute
+    start = int(minutes.min())
+    assert index['session_start'] == f"{start // 60:02d}:{start % 60:02d}"
+    assert tensor.shape == (len(df_daily), int(minutes.max()) - start + 1, 7) and tensor.dtype == np.float32
+    assert index['dates'] == [d.isoformat() for d in df_daily["TRADEDATE"]]
+    np.testing.assert_allclose(index['body'], df_daily["BODY"])
+    np.testing.assert_allclose(np.array(index['next_body'][:-1], dtype=float), df_daily["NEXT_BODY"].iloc[:-1])
+
+    for k, (day, g) in enumerate(df_minute.groupby(df_minute["TRADEDATE"].dt.date)):
+        slots = (minutes[g.index] - start).to_numpy()
+        assert mask[k].sum() == len(g) and mask[k, slots].all()
+        np.testing.assert_array_equal(tensor[k, slots], np.stack(g["VECTORS"].to_numpy()).astype(np.float32))
+        assert not tensor[k][mask[k] == 0].any()
+
+
+def test_resample_interpolates_each_day(settings, stages):
+    _, df_daily = stages
+    settings = {**settings, 'tensor_mode': 'resample', 'tensor_session_minutes': 50}
+    days_vectors_to_tensor.main(settings)
+    tensor, mask, _ = load_tensor(settings)
+    assert tensor.shape == (len(df_daily), 50, 7) and mask.all()
+    for k in (0, len(df_daily) // 2, len(df_daily) - 1):
+        expected = resample_day(df_daily.at[k, "VECTORS"].astype(np.float64), 50)
+        np.testing.assert_allclose(tensor[k], expected, rtol=1e-6, atol=1e-6)
+
+
+def test_unknown_mode_is_rejected(settings):
+    with pytest.raises(ValueError, match="stretch"):
+        days_vectors_to_tensor.tensor_params({**settings, 'tensor_mode': 'stretch'})
+
+
+def test_batches_cover_days_once(settings, stages):
+    days_vectors_to_tensor.main(settings)
+    tensor, mask, index = load_tensor(settings)
+    seen = []
+    for x, m, next_body, dates in iter_batches(settings, batch_size=16, shuffle=True, seed=1):
+        assert x.shape[1:] == tensor.shape[1:] and len(x) == len(m) == len(next_body) == len(dates)
+        assert list(dates) == sorted(dates)
+        seen.extend(dates)
+    assert sorted(seen) == index['dates']
+
+    batches = list(iter_batches(settings, batch_size=16, drop_last=True, days=np.arange(40)))
+    assert [len(b[0]) for b in batches] == [16, 16]
+    np.testing.assert_array_equal(batches[0][0], tensor[:16])
@@ -0,0 +1,71 @@
+"""
+Нативный движок DTW (dtw_engine.py) против tslearn: та же лента расстояний.
+"""
+
+import numpy as np
+import pytest
+
+import dtw_engine
+from similarity_metrics import distance_band
+
+pytest.importorskip("numba")
+pytest.importorskip("tslearn")
+
+MAX_SHIFT = 5
+
+
+@pytest.fixture
+def days():
+    """Матрицы дней разной длины (N_day, 7), как VECTORS дневных векторов."""
+    rng = np.random.default_rng(0)
+    return [rng.normal(size=(int(n), 7)).astype(np.float32) for n in rng.integers(20, 60, size=12)]
+
+
+def test_dtw_band_float64_matches_tslearn(days):
+    from tslearn.metrics import dtw
+
+    values, offsets = dtw_engine.pack_days(days, 'float64')
+    rows = np.arange(len(days))
+    band = dtw_engine.dtw_band(values, offsets, rows, MAX_SHIFT)
+
+    expected = np.full_like(band, np.inf)
+    for i in rows:
+        for s in range(1, min(MAX_SHIFT, i) + 1):
+            expected[i, s - 1] = dtw(days[i].astype(np.float64), days[i - s].astype(np.float64))
+    np.testing.assert_array_equal(np.isinf(band), np.isinf(expected))
+    np.testing.assert_allclose(band, expected, rtol=1e-10)
+
+
+def test_distance_band_engines_agree(days):
+    rows = [3, 7, 11]
+    native = distance_band(days, MAX_SHIFT, 'dtw', rows=rows, params={'engine': 'numba', 'precision': 'float64'})
+    pairs = distance_band(days, MAX_SHIFT, 'dtw', rows=rows, params={'engine': 'tslearn'})
+    np.testing.assert_allclose(native, pairs, rtol=1e-10)
+
+    # float32 — та же лента с точностью одинарной арифметики
+    single = distance_band(days, MAX_SHIFT, 'dtw', rows=rows, params={'engine': 'numba', 'precision': 'float32'})
+    np.testing.assert_allclose(single, pairs, rtol=1e-4)
+
+
+def test_kernel_keeps_inf_semantics():
+    """np.inf — граница матрицы DTW, поэтому ядро компилируется без допущений ninf/nnan."""
+    assert not {'fast', 'ninf', 'nnan'} & dtw_engine.FASTMATH
+    values, offsets = dtw_engine.pack_days([np.zeros((3, 7)), np.ones((2, 7))], 'float32')
+    band = dtw_engine.dtw_band(values, offsets, np.arange(2), 2)
+    assert np.isinf(band[0]).all() and np.isinf(band[1, 1])
+    assert band[1, 0] == pytest.approx(np.sqrt(3 * 7))
+
+
+def test_soft_dtw_band_matches_tslearn(days):
+    from tslearn.metrics import soft_dtw
+
+    values, offsets = dtw_engine.pack_days(days, 'float64')
+    rows = np.arange(len(days))
+    for gamma in (0.1, 1.0):
+        band = dtw_engine.dtw_band(values, offsets, rows, MAX_SHIFT, gamma=gamma)
+        expected = np.full_like(band, np.inf)
+        for i in rows:
+            for s in range(1, min(MAX_SHIFT, i) + 1):
+                expected[i, s - 1] = soft_dtw(days[i].astype(np.float64), days[i - s].astype(np.float64), gamma=gamma)
+        np.testing.assert_array_equal(np.isinf(band), np.isinf(expected))
+        np.testing.assert_allclose(band, expected, rtol=1e-8)
@@ -0,0 +1,68 @@
+"""
+Режим вне памяти (out_of_core.py) против стадий minute-vectors -> daily-vectors -> similarity.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import config
+import data_processing_similarity
+import minutes_bars_to_vectors_pkl
+import minutes_vectors_to_days_vectors
+import out_of_core
+from vector_codec import decode_day
+
+
+@pytest.fixture
+def in_memory(settings):
+    """Таблица схожести и дневные векторы стадий в памяти."""
+    minutes_bars_to_vectors_pkl.main(settings)
+    minutes_vectors_to_days_vectors.main(settings)
+    data_processing_similarity.main(settings)
+    return (pd.read_pickle(config.artifact_path("similarity", settings)),
+            pd.read_pickle(config.artifact_path("daily_vectors", settings)))
+
+
+def test_out_of_core_matches_in_memory(settings, in_memory):
+    df_similarity, df_daily = in_memory
+    out_of_core.main(settings)
+
+    df_rez = pd.read_pickle(config.artifact_path("similarity", settings))
+    assert len(df_rez) > 0
+    pd.testing.assert_frame_equal(df_rez, df_similarity)
+
+    # Дневное хранилище: те же матрицы дней и BODY, что у daily-vectors
+    values, offsets, index = out_of_core.load_day_store(settings)
+    assert index['dates'] == [pd.Timestamp(d).date().isoformat() for d in df_daily['TRADEDATE']]
+    for i, matrix in enumerate(df_daily['VECTORS']):
+        np.testing.assert_array_equal(np.asarray(values[offsets[i]:offsets[i + 1]]), decode_day(matrix))
+    np.testing.assert_allclose(index['body'], df_daily['BODY'].to_numpy(dtype=float))
+
+    df_quality = pd.read_pickle(config.artifact_path("day_quality", settings))
+    assert len(df_quality) == len(df_daily)
+
+
+def test_out_of_core_resumes_from_checkpoint(settings, in_memory, monkeypatch):
+    """Проход, прерванный после нескольких блоков, продолжается по контрольной точке с тем же результатом."""
+    df_similarity, _ = in_memory
+    compute_similarity = out_of_core.compute_similarity
+    calls = []
+
+    def failing(*args, **kwargs):
+        if len(calls) == 3:
+            raise RuntimeError("сбой прохода")
+        calls.append(1)
+        return compute_similarity(*args, **kwargs)
+
+    monkeypatch.setattr(out_of_core, "compute_similarity", failing)
+    with pytest.raises(RuntimeError):
+        out_of_core.main(settings)
+    monkeypatch.setattr(out_of_core, "compute_similarity", compute_similarity)
+
+    checkpoint = config.artifact_path("similarity_checkpoint", settings)
+    assert len(data_processing_similarity.load_similarity_checkpoint(checkpoint)) == 3 * settings[
+        'similarity_checkpoint_every']
+    out_of_core.main(settings)
+    pd.testing.assert_frame_equal(pd.read_pickle(config.artifact_path("similarity", settings)), df_similarity)
+    assert not checkpoint.exists()
@@ -0,0 +1,66 @@
+"""
+Графики отчёта (plot_report.py): кумулятивные кривые одной операцией, прореживание и пакетный рендер.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from plot_report import cumsum_curves, decimate, lttb_indices, minmax_indices, render_batch
+
+
+@pytest.fixture
+def similarity():
+    """Таблица схожести как у стадии similarity: TRADEDATE и P/L окон MAX_3..MAX_30."""
+    rng = np.random.default_rng(4)
+    n = 5000
+    df = pd.DataFrame({f"MAX_{w}": rng.normal(0, 100, n) for w in range(3, 31)})
+    df.insert(0, 'TRADEDATE', pd.date_range("2005-01-03", periods=n, freq="B"))
+    return df
+
+
+def test_cumsum_curves_match_per_column(similarity):
+    dates, columns, curves = cumsum_curves(similarity)
+    assert columns == [f"MAX_{w}" for w in range(3, 31)]
+    for k, col in enumerate(columns):
+        np.testing.assert_allclose(curves[:, k], similarity[col].cumsum().to_numpy())
+
+
+def test_minmax_keeps_extremes_and_ends(similarity):
+    _, _, curves = cumsum_curves(similarity)
+    idx = minmax_indices(curves, 200)
+    assert len(idx) <= 200
+    assert (idx[0] == 0).all() and (idx[-1] == len(curves) - 1).all()
+    assert (np.diff(idx, axis=0) >= 0).all()
+    for k in range(curves.shape[1]):
+        kept = curves[idx[:, k], k]
+        assert kept.min() == curves[:, k].min() and kept.max() == curves[:, k].max()
+
+    # Короткая история не прореживается
+    assert len(minmax_indices(curves[:150], 200)) == 150
+
+
+def test_lttb_returns_ordered_subset(similarity):
+    dates, _, curves = cumsum_curves(similarity)
+    x = dates.astype('datetime64[s]').astype(np.float64)
+    idx = lttb_indices(x, curves[:, 0], 300)
+    assert len(idx) == 300 and idx[0] == 0 and idx[-1] == len(x) - 1
+    assert (np.diff(idx) > 0).all()
+
+    series = decimate(dates, curves, 300, 'lttb')
+    assert len(series) == curves.shape[1] and all(len(xs) == 300 for xs, _ in series)
+    with pytest.raises(ValueError):
+        decimate(dates, curves, 300, 'every_nth')
+
+
+def test_batch_renders_all_charts_in_parallel(similarity, tmp_path):
+    pytest.importorskip("matplotlib")
+    files = []
+    for name in ("RTS_dtw", "RTS_euclidean"):
+        similarity.to_pickle(tmp_path / f"{name}.pkl")
+        files.append(tmp_path / f"{name}.pkl")
+    paths = render_batch(files, tmp_path / "reports", "RTS", workers=2, max_points=500)
+    assert sorted(p.name for p in paths) == [
+        "RTS_dtw_cumsum_plot.png", "RTS_dtw_cumsum_top5_plot.png",
+        "RTS_euclidean_cumsum_plot.png", "RTS_euclidean_cumsum_top5_plot.png"]
+    assert all(p.stat().st_size > 0 for p in paths)
@@ -0,0 +1,88 @@
+"""
+RollingVolumeStats против pandas rolling(window, min_periods=1).mean() / .std(ddof=0).
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rolling_stats
+from rolling_stats import RollingVolumeStats
+
+WINDOW = 100
+
+
+@pytest.fixture
+def volume():
+    """Объёмы как у минутных баров: целые с тяжёлым хвостом и серии одинаковых значений."""
+    rng = np.random.default_rng(1)
+    values = np.maximum(1, rng.lognormal(3.0, 1.0, 5000)).astype(np.int64).astype(float)
+    values[1000:1300] = 5.0
+    values[3000] = 1e7
+    return values
+
+
+def expected(values):
+    rolling = pd.Series(values).rolling(WINDOW, min_periods=1)
+    return rolling.mean().to_numpy(), rolling.std(ddof=0).to_numpy()
+
+
+def test_run_is_bit_exact(volume):
+    means, stds = RollingVolumeStats(WINDOW).run(volume)
+    exp_means, exp_stds = expected(volume)
+    np.testing.assert_array_equal(means, exp_means)
+    np.testing.assert_array_equal(stds, exp_stds)
+
+
+def test_extend_is_bit_exact_from_empty_window(volume):
+    means, stds = RollingVolumeStats(WINDOW).extend(volume)
+    exp_means, exp_stds = expected(volume)
+    np.testing.assert_array_equal(means, exp_means)
+    np.testing.assert_array_equal(stds, exp_stds)
+
+
+def test_update_continues_saved_state(volume, tmp_path):
+    """Снимок после части ряда продолжается update так же, как непрерывный проход."""
+    stats = RollingVolumeStats(WINDOW)
+    stats.run(volume[:2500])
+    restored = RollingVolumeStats.load(stats.save(tmp_path / "state.json"))
+    means, stds = restored.run(volume[2500:])
+    exp_means, exp_stds = RollingVolumeStats(WINDOW).run(volume)
+    np.testing.assert_array_equal(means, exp_means[2500:])
+    np.testing.assert_array_equal(stds, exp_stds[2500:])
+    assert restored.count == len(volume)
+
+
+def test_extend_in_chunks_is_bit_exact(volume):
+    """Продолжение окна порциями (демон, режим вне памяти) совпадает с pandas по всей истории бит в бит."""
+    pytest.importorskip("numba")
+    stats = RollingVolumeStats(WINDOW)
+    parts = [stats.extend(chunk) for chunk in np.array_split(volume, 7)]
+    means = np.concatenate([p[0] for p in parts])
+    stds = np.concatenate([p[1] for p in parts])
+    exp_means, exp_stds = expected(volume)
+    np.testing.assert_array_equal(means, exp_means)
+    np.testing.assert_array_equal(stds, exp_stds)
+
+    # Состояние после пакетов — то же, что после поштучного прохода
+    continuous = RollingVolumeStats(WINDOW)
+    continuous.run(volume)
+    assert stats.to_state() == continuous.to_state()
+
+
+def test_extend_without_numba_stays_within_tolerance(volume, monkeypatch):
+    """Без numba продолжение отличается от pandas только его накопленной погрешностью."""
+    monkeypatch.setattr(rolling_stats, "njit", None)
+    stats = RollingVolumeStats(WINDOW)
+    parts = [stats.extend(chunk) for chunk in np.array_split(volume, 7)]
+    means = np.concatenate([p[0] for p in parts])
+    stds = np.concatenate([p[1] for p in parts])
+    exp_means, exp_stds = expected(volume)
+    np.testing.assert_allclose(means, exp_means, rtol=1e-9, atol=1e-4)
+    np.testing.assert_allclose(stds, exp_stds, rtol=1e-9, atol=1e-4)
+    assert stats.count == len(volume)
+
+    # Точные значения полных окон: переснятое окно к ним не дальше, чем pandas
+    windows = np.lib.stride_tricks.sliding_window_view(volume, WINDOW)
+    exact = windows.std(axis=1)
+    assert np.abs(stds[WINDOW - 1:] - exact).max() <= np.abs(exp_stds[WINDOW - 1:] - exact).max()
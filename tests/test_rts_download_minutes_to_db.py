@@ -0,0 +1,261 @@
+"""
+Загрузчик минуток (rts_download_minutes_to_db.py): кэш ответов ISS, план загрузки по календарю,
+календарь ролловеров.
+"""
+
+import json
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+import config
+import rts_download_minutes_to_db as downloader
+from rts_download_minutes_to_db import (
+    ResponseCache, create_continuous_tables, execute_fetch_ranges, plan_fetch_ranges, request_moex, scan_db_days,
+    update_rolls)
+
+HISTORY_URL = 'https://iss.moex.com/iss/history/engines/futures/markets/forts/securities.json?date={}&assetcode=RTS'
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """Сессия requests, отвечающая заданным payload и считающая запросы."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        return FakeResponse(self.payload)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path / "iss_cache")
+    monkeypatch.setattr(downloader, "_response_cache", cache)
+    return cache
+
+
+def test_past_response_is_served_from_disk(cache):
+    day = date(2015, 3, 2)
+    url = HISTORY_URL.format(day)
+    cache.put(url, {'history': {'data': [[1]]}}, today_date=day + timedelta(days=1))
+    assert cache.get(url, today_date=day + timedelta(days=10)) == {'history': {'data': [[1]]}}
+
+    session = FakeSession({'history': {'data': [[2]]}})
+    assert request_moex(session, url) == {'history': {'data': [[1]]}}
+    assert session.urls == []
+
+
+def test_response_fetched_during_its_day_is_refetched(cache):
+    """Ответ, записанный во время сессии своего дня, после этого дня не отдаётся, а перезапрашивается."""
+    day = date.today() - timedelta(days=1)
+    url = HISTORY_URL.format(day)
+    cache.put(url, {'history': {'data': []}}, today_date=day)
+    assert cache.get(url, today_date=day + timedelta(days=5)) is None
+
+    session = FakeSession({'history': {'data': [[3]]}})
+    assert request_moex(session, url) == {'history': {'data': [[3]]}}
+    assert session.urls == [url]
+    assert cache.get(url) == {'history': {'data': [[3]]}}
+
+
+def test_offline_replays_any_recorded_response(tmp_path):
+    day = date.today()
+    url = HISTORY_URL.format(day)
+    ResponseCache(tmp_path).put(url, {'history': {'data': []}}, today_date=day)
+    assert ResponseCache(tmp_path, offline=True).get(url) == {'history': {'data': []}}
+
+
+def test_corrupt_entry_is_a_miss(cache):
+    url = HISTORY_URL.format(date(2015, 3, 2))
+    cache.put(url, {'history': {'data': [[1]]}}, today_date=date(2015, 3, 3))
+    path = cache._path(url)
+    path.write_bytes(path.read_bytes()[:10])
+    assert cache.get(url) is None
+    assert not path.exists()
+
+
+# ==== План загрузки по торговому календарю ====
+
+START = date(2015, 1, 1)
+LATER = datetime(2030, 1, 1)
+
+
+def trading_calendar(connection) -> dict:
+    """Календарь загрузчика по дням БД: контракт и экспирация дня, дни без торгов — None; все дни докачаны."""
+    days = dict(connection.execute(
+        "SELECT DATE(TRADEDATE), SECID || '|' || LSTTRADE FROM Futures GROUP BY DATE(TRADEDATE)").fetchall())
+    calendar = {}
+    day = date.fromisoformat(min(days))
+    while day <= date.fromisoformat(max(days)):
+        value = days.get(day.isoformat())
+        calendar[day.isoformat()] = None if value is None else dict(
+            zip(('SECID', 'LSTTRADE'), value.split('|')), COMPLETE=True)
+        day += timedelta(days=1)
+    return calendar
+
+
+class FakeCandles:
+    """get_minute_candles по отложенным барам БД: бары контракта в диапазоне FROM-TILL."""
+
+    def __init__(self, rows, fail_from=None):
+        self.df = pd.DataFrame(rows, columns=['TRADEDATE', 'SECID', 'OPEN', 'LOW', 'HIGH', 'CLOSE', 'VOLUME',
+                                              'LSTTRADE']).drop(columns='LSTTRADE')
+        self.fail_from = fail_from
+        self.requests = []
+
+    def __call__(self, session, ticker, start_date, from_str=None, till_str=None, raise_errors=False):
+        self.requests.append((ticker, from_str, till_str))
+        if self.fail_from is not None and from_str >= self.fail_from:
+            raise requests.RequestException("ISS недоступен")
+        since, till = (datetime.fromisoformat(x).strftime('%Y-%m-%d %H:%M:%S') for x in (from_str, till_str))
+        df = self.df
+        return df[(df['SECID'] == ticker) & (df['TRADEDATE'] >= since) & (df['TRADEDATE'] <= till)].reset_index(drop=True)
+
+
+@pytest.fixture
+def holes(minute_db):
+    """БД без трёх подряд идущих дней и с оборванным днём; их бары отложены, в календаре они не докачаны."""
+    connection = sqlite3.connect(minute_db)
+    calendar = trading_calendar(connection)
+    days = [d for d, entry in calendar.items() if entry]
+    missing, partial = days[8:11], days[20]
+    rows = connection.execute(
+        "SELECT * FROM Futures WHERE DATE(TRADEDATE) IN (?, ?, ?) "
+        "OR (DATE(TRADEDATE) = ? AND TIME(TRADEDATE) >= '10:00:00') ORDER BY TRADEDATE",
+        (*missing, partial)).fetchall()
+    connection.execute("DELETE FROM Futures WHERE TRADEDATE IN (%s)" % ', '.join('?' * len(rows)), [r[0] for r in rows])
+    connection.commit()
+    for day in (*missing, partial):
+        calendar[day]['COMPLETE'] = False
+    yield connection, calendar, missing, partial, rows
+    connection.close()
+
+
+def test_plan_merges_missing_days_and_resumes_partial_day(holes):
+    connection, calendar, missing, partial, _ = holes
+    plan = plan_fetch_ranges(scan_db_days(connection, START), calendar, START, LATER)
+
+    # Три дня одного контракта — один диапазон, выходные между ними в план не попадают
+    assert plan['DAYS'].tolist() == [missing, [partial]]
+    assert plan['SECID'].tolist() == [calendar[missing[0]]['SECID'], calendar[partial]['SECID']]
+    assert plan.at[0, 'FROM'] == datetime.fromisoformat(missing[0])
+    assert plan.at[0, 'TILL'] == datetime.fromisoformat(missing[-1]).replace(hour=23, minute=59, second=59)
+    # Оборванный день докачивается со следующей минуты после последнего бара
+    assert plan.at[1, 'FROM'] == datetime.fromisoformat(f"{partial} 10:00:00")
+
+
+def test_execute_restores_db_and_marks_days_complete(holes, synthetic_db, monkeypatch):
+    connection, calendar, missing, partial, rows = holes
+    candles = FakeCandles(rows)
+    monkeypatch.setattr(downloader, "get_minute_candles", candles)
+
+    plan = plan_fetch_ranges(scan_db_days(connection, START), calendar, START, LATER)
+    first_inserted = execute_fetch_ranges(None, plan, calendar, connection, connection.cursor(), LATER.date())
+    assert len(candles.requests) == 2
+    assert first_inserted == rows[0][0]
+    assert all(calendar[day]['COMPLETE'] for day in (*missing, partial))
+
+    with sqlite3.connect(synthetic_db) as original:
+        expected = original.execute("SELECT * FROM Futures ORDER BY TRADEDATE").fetchall()
+    assert connection.execute("SELECT * FROM Futures ORDER BY TRADEDATE").fetchall() == expected
+    assert plan_fetch_ranges(scan_db_days(connection, START), calendar, START, LATER).empty
+
+
+def test_failed_range_is_planned_again(holes, monkeypatch):
+    connection, calendar, missing, partial, rows = holes
+    monkeypatch.setattr(downloader, "get_minute_candles", FakeCandles(rows, fail_from=partial))
+
+    plan = plan_fetch_ranges(scan_db_days(connection, START), calendar, START, LATER)
+    execute_fetch_ranges(None, plan, calendar, connection, connection.cursor(), LATER.date())
+    assert all(calendar[day]['COMPLETE'] for day in missing)
+    assert not calendar[partial]['COMPLETE']
+    assert plan_fetch_ranges(scan_db_days(connection, START), calendar, START, LATER)['DAYS'].tolist() == [[partial]]
+
+
+def test_plan_completeness_and_today(monkeypatch):
+    """Прошедший день с баром 23:49 полон; сегодняшний день докачивается до текущего момента и не закрывается."""
+    entry = {'SECID': 'RIH5', 'LSTTRADE': '2015-03-16', 'COMPLETE': False}
+    calendar = {'2015-03-02': dict(entry), '2015-03-03': dict(entry), '2015-03-04': dict(entry), '2015-03-05': None}
+    df_days = pd.DataFrame({'BARS': [890, 600], 'LAST_BAR': ['2015-03-02 23:49:00', '2015-03-03 18:44:00']},
+                           index=pd.Index(['2015-03-02', '2015-03-03'], name='DAY'))
+    now = datetime(2015, 3, 4, 20, 0)
+    plan = plan_fetch_ranges(df_days, calendar, date(2015, 3, 1), now)
+    assert plan['DAYS'].tolist() == [['2015-03-03', '2015-03-04']]
+    assert plan.at[0, 'FROM'] == datetime(2015, 3, 3, 18, 45) and plan.at[0, 'TILL'] == now
+
+    # Прошедший день диапазона отмечается докачанным, даже если ISS не вернул баров; сегодняшний — нет
+    monkeypatch.setattr(downloader, "get_minute_candles", lambda *args, **kwargs: pd.DataFrame())
+    execute_fetch_ranges(None, plan, calendar, None, None, now.date())
+    assert calendar['2015-03-03']['COMPLETE'] and not calendar['2015-03-04']['COMPLETE']
+
+
+# ==== Календарь ролловеров и склеенный ряд ====
+
+def rolls(connection):
+    return connection.execute("SELECT SECID, FIRST_BAR, LAST_BAR, RATIO, FACTOR FROM Rolls ORDER BY FIRST_BAR").fetchall()
+
+
+def test_rolls_cover_all_contracts(minute_db):
+    with sqlite3.connect(minute_db) as connection:
+        contracts = rolls(connection)
+        secids = [r[0] for r in connection.execute("SELECT DISTINCT SECID FROM Futures ORDER BY TRADEDATE")]
+        assert [r[0] for r in contracts] == secids
+        assert len(contracts) > 1
+        assert contracts[-1][4] == 1.0
+        # FACTOR — произведение RATIO более поздних контрактов
+        for k in range(len(contracts) - 1):
+            assert contracts[k][4] == pytest.approx(np.prod([r[3] for r in contracts[k + 1:]]))
+
+        # Склеенный ряд без разрыва: OPEN первого бара контракта равен CLOSE последнего бара предыдущего
+        for (_, _, prev_last, _, _), (_, first, _, _, _) in zip(contracts, contracts[1:]):
+            prev_close = connection.execute(
+                f"SELECT CLOSE FROM {config.CONTINUOUS_VIEW} WHERE TRADEDATE = ?", (prev_last,)).fetchone()[0]
+            first_open = connection.execute(
+                f"SELECT OPEN FROM {config.CONTINUOUS_VIEW} WHERE TRADEDATE = ?", (first,)).fetchone()[0]
+            assert first_open == pytest.approx(prev_close)
+        n_view = connection.execute(f"SELECT COUNT(*) FROM {config.CONTINUOUS_VIEW}").fetchone()[0]
+        assert n_view == connection.execute("SELECT COUNT(*) FROM Futures").fetchone()[0]
+
+
+def test_empty_rolls_are_built_over_whole_history(minute_db):
+    """Rolls, созданная в БД с барами, строится по всей истории, даже если since задан планом загрузки."""
+    with sqlite3.connect(minute_db) as connection:
+        expected = rolls(connection)
+        connection.execute("DROP VIEW FuturesContinuous")
+        connection.execute("DROP TABLE Rolls")
+        create_continuous_tables(connection)
+        last_bar = connection.execute("SELECT MAX(TRADEDATE) FROM Futures").fetchone()[0]
+        update_rolls(connection, since=last_bar)
+        assert rolls(connection) == expected
+        n_view = connection.execute(f"SELECT COUNT(*) FROM {config.CONTINUOUS_VIEW}").fetchone()[0]
+        assert n_view == connection.execute("SELECT COUNT(*) FROM Futures").fetchone()[0]
+
+
+def test_incremental_rolls_match_full_build(minute_db):
+    """Бары, дописанные после построения календаря, дают тот же календарь, что построение с нуля."""
+    with sqlite3.connect(minute_db) as connection:
+        expected = rolls(connection)
+        tail_from = connection.execute(
+            "SELECT TRADEDATE FROM Futures ORDER BY TRADEDATE LIMIT 1 OFFSET 4000").fetchone()[0]
+        tail = connection.execute("SELECT * FROM Futures WHERE TRADEDATE >= ?", (tail_from,)).fetchall()
+        connection.execute("DELETE FROM Futures WHERE TRADEDATE >= ?", (tail_from,))
+        connection.execute("DELETE FROM Rolls")
+        update_rolls(connection)
+
+        connection.executemany(f"INSERT INTO Futures VALUES ({', '.join('?' * len(tail[0]))})", tail)
+        update_rolls(connection, since=tail_from)
+        assert rolls(connection) == expected
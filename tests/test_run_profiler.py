@@ -0,0 +1,68 @@
+"""
+Инструментирование стадий (run_profiler.py): счётчики, отчёт запуска и профили стадий.
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+import cli
+from run_profiler import RunProfiler, set_profiler, stage
+
+
+@pytest.fixture
+def reset_profiler():
+    yield
+    set_profiler(None)
+
+
+def test_nested_stages_and_report_history(tmp_path, reset_profiler):
+    profiler = set_profiler(RunProfiler("unit", report_path=tmp_path / "report.json",
+                                        profile='cprofile', profile_dir=tmp_path / "profiles"))
+    with stage("outer") as outer:
+        outer.add("rows", 10)
+        with stage("inner"):
+            profiler.count("pairs", 3)
+            profiler.count("pairs", 2)
+    profiler.count("requests")
+
+    inner, outer = profiler.stages
+    assert (inner.name, inner.counters) == ("inner", {'pairs': 5})
+    assert outer.counters == {'rows': 10}
+    assert outer.wall_s >= inner.wall_s and outer.cpu_s >= 0 and outer.peak_rss_mb
+    # cProfile допускает один профайлер: профилируется только внешняя стадия
+    assert outer.profile_file and inner.profile_file is None
+    assert list((tmp_path / "profiles").iterdir()) == [Path(outer.profile_file)]
+
+    profiler.write_report()
+    profiler.write_report()
+    report = json.loads((tmp_path / "report.json").read_text(encoding='utf-8'))
+    assert report['counters'] == {'requests': 1}
+    assert [s['name'] for s in report['stages']] == ["inner", "outer"]
+    assert len((tmp_path / "report.jsonl").read_text(encoding='utf-8').splitlines()) == 2
+
+
+def test_stages_without_profiler_are_noop(reset_profiler):
+    set_profiler(None)
+    with stage("anything") as st:
+        st.add("rows", 1)
+
+
+def test_pipeline_report_counts_rows_and_pairs(settings, reset_profiler):
+    profiler = set_profiler(RunProfiler.from_settings(settings, "test"))
+    cli.run_pipeline(["minute-vectors", "daily-vectors", "similarity"], settings)
+    path = profiler.write_report()
+    assert path.name == f"{settings['ticker']}_run_report_test.json"
+
+    stages = {s['name']: s for s in json.loads(path.read_text(encoding='utf-8'))['stages']}
+    assert {"load_ohlcv_from_sqlite", "compute_features", "build_daily_vectors", "compute_daily_body",
+            "dtw_sweep"} <= set(stages)
+    with sqlite3.connect(settings['path_db_minute']) as connection:
+        n_bars, n_days = connection.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT DATE(TRADEDATE)) FROM Futures").fetchone()
+    assert stages["compute_features"]['counters']['rows'] == n_bars
+    assert stages["build_daily_vectors"]['counters']['days'] == n_days
+    sweep = stages["dtw_sweep"]['counters']
+    assert sweep['pairs_computed'] > 0 and sweep['pairs_pruned'] > 0
@@ -0,0 +1,78 @@
+"""
+Контрольная точка DTW-прохода (SimilarityCheckpoint): прерванный compute_similarity продолжается без потерь.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_processing_similarity
+from data_processing_similarity import SimilarityCheckpoint, compute_similarity
+
+EVERY = 10
+
+
+@pytest.fixture
+def df_daily():
+    """Дневные векторы: TRADEDATE, VECTORS (N_day, 7), NEXT_BODY."""
+    rng = np.random.default_rng(3)
+    n_days = 70
+    return pd.DataFrame({
+        "TRADEDATE": pd.bdate_range("2015-01-05", periods=n_days),
+        "VECTORS": [rng.normal(size=(int(n), 7)).astype(np.float32) for n in rng.integers(20, 40, size=n_days)],
+        "NEXT_BODY": rng.normal(size=n_days) * 100,
+    })
+
+
+def interrupt_after(monkeypatch, blocks: int):
+    """distance_band падает на блоке номер blocks + 1."""
+    distance_band = data_processing_similarity.distance_band
+    calls = []
+
+    def failing(*args, **kwargs):
+        if len(calls) == blocks:
+            raise RuntimeError("сбой прохода")
+        calls.append(1)
+        return distance_band(*args, **kwargs)
+
+    monkeypatch.setattr(data_processing_similarity, "distance_band", failing)
+
+
+def test_resume_matches_uninterrupted(df_daily, tmp_path, monkeypatch):
+    expected = compute_similarity(df_daily)
+    path = tmp_path / "checkpoint.jsonl"
+
+    interrupt_after(monkeypatch, 3)
+    with pytest.raises(RuntimeError):
+        compute_similarity(df_daily, checkpoint=SimilarityCheckpoint(path, "key", every=EVERY))
+    monkeypatch.undo()
+
+    checkpoint = SimilarityCheckpoint(path, "key", every=EVERY)
+    assert len(checkpoint.rows) == 3 * EVERY
+    band_calls = []
+    distance_band = data_processing_similarity.distance_band
+    monkeypatch.setattr(data_processing_similarity, "distance_band",
+                        lambda *args, **kwargs: band_calls.append(kwargs["rows"]) or distance_band(*args, **kwargs))
+    resumed = compute_similarity(df_daily, checkpoint=checkpoint)
+
+    pd.testing.assert_frame_equal(resumed, expected)
+    # DTW посчитанных дней не повторяется
+    assert min(int(rows.min()) for rows in band_calls) == 3 * EVERY
+
+
+def test_torn_line_is_dropped(df_daily, tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    compute_similarity(df_daily.head(25), checkpoint=SimilarityCheckpoint(path, "key", every=EVERY))
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"TRADEDATE": "2015-02')
+
+    checkpoint = SimilarityCheckpoint(path, "key", every=EVERY)
+    assert len(checkpoint.rows) == 25
+    assert path.read_text(encoding='utf-8').endswith("\n")
+    pd.testing.assert_frame_equal(compute_similarity(df_daily, checkpoint=checkpoint), compute_similarity(df_daily))
+
+
+def test_foreign_key_starts_over(df_daily, tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    compute_similarity(df_daily.head(25), checkpoint=SimilarityCheckpoint(path, "old", every=EVERY))
+    assert SimilarityCheckpoint(path, "new", every=EVERY).rows == []
@@ -0,0 +1,58 @@
+"""
+Метрики схожести (similarity_metrics.py): счётчики ленты, выравнивание euclidean, soft-DTW движком.
+"""
+
+import numpy as np
+import pytest
+
+from day_layout import pad_day, resample_day
+from run_profiler import RunProfiler, set_profiler
+from similarity_metrics import distance_band
+
+MAX_SHIFT = 5
+
+
+@pytest.fixture
+def days():
+    rng = np.random.default_rng(2)
+    return [rng.normal(size=(int(n), 7)).astype(np.float32) for n in rng.integers(20, 60, size=10)]
+
+
+@pytest.fixture
+def profiler():
+    yield set_profiler(RunProfiler("test"))
+    set_profiler(None)
+
+
+@pytest.mark.parametrize("metric", ["dtw", "euclidean", "feature_dist"])
+def test_pair_counters_follow_band_geometry(days, profiler, metric):
+    """Пропущенные пары — сдвиги раньше начала истории, а не все нечисловые клетки ленты."""
+    rows = [0, 2, 7, 9]
+    distance_band(days, MAX_SHIFT, metric, rows=rows)
+    assert profiler.counters == {'pairs_computed': 0 + 2 + 5 + 5, 'pairs_pruned': 5 + 3 + 0 + 0}
+
+
+def test_euclidean_compares_bars_by_session_slot():
+    """Короткий день сравнивается с началом длинного по тем же слотам сессии, а не растягивается."""
+    rng = np.random.default_rng(3)
+    long_day = rng.normal(size=(40, 7))
+    short_day = long_day[:25].copy()
+    band = distance_band([long_day, short_day], 1, 'euclidean', rows=[1], params={'session_bars': 50})
+    assert band[0, 0] == pytest.approx(0.0)
+
+    shifted = long_day + 0.5
+    band = distance_band([long_day, shifted], 1, 'euclidean', params={'session_bars': 30})
+    assert band[1, 0] == pytest.approx(0.5)
+
+    assert np.isnan(pad_day(short_day, 30)[25:]).all()
+    np.testing.assert_allclose(resample_day(short_day, 25), short_day)
+
+
+def test_soft_dtw_engines_agree(days):
+    pytest.importorskip("numba")
+    pytest.importorskip("tslearn")
+    rows = [3, 6, 9]
+    params = {'gamma': 0.5, 'precision': 'float64'}
+    native = distance_band(days, MAX_SHIFT, 'soft_dtw', rows=rows, params={**params, 'engine': 'numba'})
+    pairs = distance_band(days, MAX_SHIFT, 'soft_dtw', rows=rows, params={**params, 'engine': 'tslearn'})
+    np.testing.assert_allclose(native, pairs, rtol=1e-8)
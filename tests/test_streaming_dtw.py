@@ -0,0 +1,82 @@
+"""
+Потоковый режим (streaming_dtw.py): open-end DTW по минутам и контракт текущего дня.
+"""
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rts_download_minutes_to_db as downloader
+from rts_download_minutes_to_db import front_contract_on
+from streaming_dtw import PrefixDTW, StreamingMatcher
+
+
+@pytest.fixture
+def days():
+    rng = np.random.default_rng(1)
+    return [rng.normal(size=(int(n), 7)) for n in rng.integers(20, 60, size=8)]
+
+
+def test_full_day_distances_match_tslearn(days):
+    tslearn = pytest.importorskip("tslearn.metrics")
+    query, references = days[0], days[1:]
+    dtw = PrefixDTW(references)
+    for k, vec in enumerate(query, start=1):
+        open_end = dtw.push(vec)
+        # open-end — минимум по префиксам эталона, не больше расстояния до полного эталона
+        assert (open_end <= dtw.full_distances() + 1e-12).all()
+        if k in (1, len(query) // 2):
+            expected = [tslearn.dtw(query[:k], ref) for ref in references]
+            np.testing.assert_allclose(dtw.full_distances(), expected, rtol=1e-10)
+
+    expected = [tslearn.dtw(query, ref) for ref in references]
+    np.testing.assert_allclose(dtw.full_distances(), expected, rtol=1e-10)
+    best = dtw.best_prefix_lengths()
+    np.testing.assert_allclose(
+        open_end, [tslearn.dtw(query, ref[:m]) for ref, m in zip(references, best)], rtol=1e-10)
+
+
+def test_matcher_skips_days_without_vectors(days):
+    df_daily = pd.DataFrame({
+        'TRADEDATE': pd.date_range("2015-03-02", periods=len(days), freq="B"),
+        'VECTORS': [d.astype(np.float32) for d in days],
+        'BODY': np.arange(len(days), dtype=float) - 3,
+    })
+    df_daily['NEXT_BODY'] = df_daily['BODY'].shift(-1)
+    df_daily.at[len(days) - 2, 'VECTORS'] = None  # исключённый по качеству день
+
+    matcher = StreamingMatcher(df_daily, min_window=1, max_window=10)
+    assert matcher.max_window == len(days) - 1
+    assert df_daily.at[len(days) - 2, 'TRADEDATE'] not in set(matcher.history['TRADEDATE'])
+
+    # Текущий день — копия вчерашнего: на окне 1 и больше находится вчерашний день с нулевым расстоянием
+    for vec in days[-1]:
+        df_matches = matcher.push(vec)
+    assert (df_matches['SIMILAR_DATE'] == df_daily['TRADEDATE'].iloc[-1]).all()
+    assert df_matches['DISTANCE'].max() == pytest.approx(0.0, abs=1e-5)
+    assert (df_matches['MATCHED_BARS'] == len(days[-1])).all()
+
+
+def test_front_contract_follows_the_roll(monkeypatch):
+    """Внутри сессии контракт дня берётся из календаря; после экспирации — следующий контракт."""
+    calls = []
+
+    def fake_front_contract(session, ticker, trade_date, expires_after=None):
+        calls.append((trade_date, expires_after))
+        return ('RIM5', date(2015, 6, 15))
+
+    monkeypatch.setattr(downloader, "get_front_contract", fake_front_contract)
+    calendar = {
+        '2015-03-12': {'SECID': 'RIH5', 'LSTTRADE': '2015-03-16', 'COMPLETE': True},
+        '2015-03-13': {'SECID': 'RIH5', 'LSTTRADE': '2015-03-16', 'COMPLETE': True},
+        '2015-03-14': None,
+    }
+    assert front_contract_on(None, 'RTS', calendar, date(2015, 3, 13)) == 'RIH5'
+    assert front_contract_on(None, 'RTS', calendar, date(2015, 3, 15)) == 'RIH5'
+    assert calls == []
+
+    # В день экспирации RIH5 торгуется уже RIM5: ищется в истории последнего известного дня
+    assert front_contract_on(None, 'RTS', calendar, date(2015, 3, 16)) == 'RIM5'
+    assert calls == [(date(2015, 3, 13), date(2015, 3, 16))]
@@ -0,0 +1,58 @@
+"""
+Компактное хранение матриц дня (vector_codec.py): точность кодировок и DTW по закодированным дням.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import config
+import minutes_bars_to_vectors_pkl
+import minutes_vectors_to_days_vectors
+from similarity_metrics import distance_band
+from vector_codec import FEATURE_RANGES, STORAGE_MODES, _scale, decode_day, encode_day
+
+
+@pytest.fixture
+def daily_vectors(settings):
+    """Дневные векторы синтетической БД в float32."""
+    minutes_bars_to_vectors_pkl.main(settings)
+    minutes_vectors_to_days_vectors.main(settings)
+    return pd.read_pickle(config.artifact_path("daily_vectors", settings))
+
+
+@pytest.mark.parametrize("storage", ["q8", "q16"])
+def test_quantisation_error_is_half_a_step(daily_vectors, storage):
+    matrix = np.concatenate(daily_vectors["VECTORS"].tolist()).astype(np.float64)
+    codes = encode_day(matrix, storage)
+    assert codes.dtype == np.dtype(np.uint8 if storage == 'q8' else np.uint16)
+    clipped = np.clip(matrix, FEATURE_RANGES[:, 0], FEATURE_RANGES[:, 1])
+    error = np.abs(decode_day(codes) - clipped)
+    assert (error <= _scale(codes.dtype) / 2 + 1e-12).all()
+
+
+def test_zero_is_encoded_exactly():
+    """Ноль лог-ретёрна и z-score объёма (середина симметричного диапазона) восстанавливается точно."""
+    zeros = np.zeros((3, 7))
+    for storage in STORAGE_MODES:
+        assert (decode_day(encode_day(zeros, storage))[:, 5:] == 0).all()
+
+
+def test_unknown_storage_is_rejected():
+    with pytest.raises(ValueError, match="q4"):
+        encode_day(np.zeros((2, 7)), 'q4')
+
+
+def test_dtw_runs_on_encoded_days(daily_vectors):
+    """DTW по закодированным дням близок к float32; соседние дни в разных кодировках сравниваются напрямую."""
+    days = daily_vectors["VECTORS"].tolist()
+    rows = np.arange(30, len(days))
+    reference = distance_band(days, 10, 'dtw', rows=rows, params={'precision': 'float64'})
+    for storage, rtol in (('float16', 1e-3), ('q16', 1e-4), ('q8', 2e-2)):
+        encoded = [encode_day(m, storage) for m in days]
+        band = distance_band(encoded, 10, 'dtw', rows=rows, params={'precision': 'float64'})
+        np.testing.assert_allclose(band, reference, rtol=rtol)
+
+    mixed = [encode_day(m, 'q16') if k % 2 else m for k, m in enumerate(days)]
+    band = distance_band(mixed, 10, 'dtw', rows=rows, params={'precision': 'float64'})
+    np.testing.assert_allclose(band, reference, rtol=1e-4)
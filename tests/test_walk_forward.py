@@ -0,0 +1,51 @@
+"""
+Walk-forward (walk_forward.py) против построчного выбора окна data_processing_pl.py.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing_pl import add_pl_columns, compute_pl
+from walk_forward import make_folds, run_batch, walk_forward, walk_forward_params
+
+
+@pytest.fixture
+def df_rez():
+    """Таблица схожести TRADEDATE, MAX_3..MAX_30 с весами обоих знаков и нулями."""
+    rng = np.random.default_rng(2)
+    n_days = 300
+    values = rng.normal(size=(n_days, 28)) * 100
+    values[rng.random(values.shape) < 0.1] = 0.0
+    df = pd.DataFrame(values, columns=[f"MAX_{n}" for n in range(3, 31)])
+    df.insert(0, "TRADEDATE", pd.bdate_range("2015-01-05", periods=n_days))
+    return df
+
+
+def test_one_day_folds_match_data_processing_pl(df_rez):
+    _, df_daily = walk_forward(df_rez, test_days=1, train_days=22, min_train_days=1)
+    expected = compute_pl(add_pl_columns(df_rez.copy())).iloc[1:].reset_index(drop=True)
+
+    np.testing.assert_array_equal(df_daily["TRADEDATE"].to_numpy(), expected["TRADEDATE"].to_numpy())
+    np.testing.assert_allclose(df_daily["P/L"].to_numpy(), expected["P/L"].to_numpy(), rtol=1e-12, atol=1e-9)
+
+
+def test_folds_cover_history_after_min_train():
+    folds = make_folds(100, test_days=22, train_days=50, min_train_days=10)
+    assert folds["TEST_LO"].iloc[0] == 10
+    assert (folds["TEST_LO"].iloc[1:].to_numpy() == folds["TEST_HI"].iloc[:-1].to_numpy()).all()
+    assert folds["TEST_HI"].iloc[-1] == 100
+    assert (folds["TRAIN_HI"] - folds["TRAIN_LO"]).max() == 50
+
+
+def test_batch_uses_settings_folds(df_rez, tmp_path):
+    """Пакетный режим с параметрами settings.yaml даёт те же фолды, что и main."""
+    settings = {'test_days': 5, 'walk_forward_train_days': 40, 'walk_forward_min_train_days': 30}
+    params = walk_forward_params(settings)
+    assert params == {'test_days': 5, 'train_days': 40, 'min_train_days': 30}
+
+    path = tmp_path / "similarity.pkl"
+    df_rez.to_pickle(path)
+    run_batch([path], **params, workers=1, out_dir=tmp_path / "folds")
+    df_folds, _ = walk_forward(df_rez, **params)
+    pd.testing.assert_frame_equal(pd.read_pickle(tmp_path / "folds" / "similarity_walk_forward.pkl"), df_folds)